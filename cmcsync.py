@@ -1,12 +1,17 @@
 #%% ========================================
 import time
+import hashlib
+import threading
+import queue
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from dataclasses import dataclass
 from itertools import batched
 import json
 from sqlalchemy import create_engine, text
 import pandas as pd
 from src.secrets_ import POSTGRES_URL
-from src.api_cmc import get_metadata, get_cmc_map1
+from src.pgcopy import copy_buffer
+from src.api_cmc import get_metadata, get_cmc_map1, iter_cmc_map, destructure_row
 
 # defers DB connection until connect/execute
 engine = create_engine(POSTGRES_URL)
@@ -86,8 +91,35 @@ CREATE INDEX cmcnotes_rank_idx ON cmcnotes(rank);
     conn.close()
     print("Created table cmcnotes")
 
+
+def _create_table_cmcmaster_changes():
+    """Creates the cmcmaster_changes log and adds the fingerprint
+    column to cmcmaster. Existing rows start with a NULL fingerprint,
+    so the first incremental sync rewrites (and logs) everything once."""
+    sql = \
+"""
+ALTER TABLE cmcmaster ADD COLUMN IF NOT EXISTS fingerprint INT8;
+
+CREATE TABLE cmcmaster_changes (
+    change_id               BIGSERIAL PRIMARY KEY,
+    id                      INT4 NOT NULL,
+    op                      CHAR(1) NOT NULL,   -- 'I'nsert or 'U'pdate
+    fingerprint             INT8 NOT NULL,
+    changed_at              TIMESTAMPTZ NOT NULL DEFAULT now()
+);
+
+CREATE INDEX cmcmaster_changes_changed_at_idx ON cmcmaster_changes(changed_at);
+CREATE INDEX cmcmaster_changes_id_idx ON cmcmaster_changes(id);
+"""
+    conn = engine.connect()
+    conn.execute(text(sql))
+    conn.commit()
+    conn.close()
+    print("Created table cmcmaster_changes")
+
 # _create_table_cmcmaster()
 # _create_table_cmcnotes()
+# _create_table_cmcmaster_changes()
 
 
 #%% ========================================
@@ -141,13 +173,262 @@ SET
     conn.close()
     print("Done!")
 
+#%% ========================================
+# COPY-based bulk load into the cmcmaster table
+# bulk_upsert_cmcmaster above does one parameterized INSERT per row
+# (tens of thousands of round trips). Instead we stream every row
+# with COPY into a temp staging table and merge it into cmcmaster
+# with one set-based upsert, all in a single transaction.
+
+CMCMASTER_COLUMNS = (
+    "id", "rank", "name", "symbol", "slug", "status", "is_active",
+    "first_historical_data", "last_historical_data",
+    "platform_id", "platform_name", "platform_symbol",
+    "platform_slug", "platform_token_address",
+)
+
+
+def copy_upsert_cmcmaster(rows: list[dict], fingerprint: bool = True) -> int:
+    """COPY rows into a temp staging table, then merge into cmcmaster
+    with a single INSERT ... SELECT ... ON CONFLICT. Returns rowcount.
+    Also stores each row's fingerprint (see sync_cmcmaster_incremental),
+    so a later incremental sync doesn't see these rows as changed.
+    fingerprint=False for a cmcmaster without that column yet."""
+    columns = CMCMASTER_COLUMNS
+    if fingerprint:
+        columns += ("fingerprint",)
+        rows = [{**row, "fingerprint": _fingerprint(row)} for row in rows]
+    cols = ", ".join(columns)
+    updates = ",\n    ".join(f"{c} = EXCLUDED.{c}" for c in columns if c != "id")
+    sql_stage = \
+"""
+CREATE TEMP TABLE cmcmaster_stage
+    (LIKE cmcmaster INCLUDING DEFAULTS)
+    ON COMMIT DROP
+"""
+    sql_copy = f"COPY cmcmaster_stage ({cols}) FROM STDIN WITH (FORMAT text)"
+    # DISTINCT ON guards against duplicate ids in the feed, otherwise
+    # ON CONFLICT would try to touch the same row twice and error out
+    sql_merge = \
+f"""
+INSERT INTO cmcmaster ({cols})
+SELECT DISTINCT ON (id) {cols}
+FROM cmcmaster_stage
+ORDER BY id
+ON CONFLICT (id) DO UPDATE
+SET
+    {updates}
+"""
+    print(f"Copying {len(rows)} total rows")
+    t0 = time.time()
+    # raw_connection hands us the underlying psycopg2 connection,
+    # which is the only way to get at copy_expert
+    conn = engine.raw_connection()
+    try:
+        cur = conn.cursor()
+        cur.execute(sql_stage)
+        cur.copy_expert(sql_copy, copy_buffer(rows, columns))
+        t1 = time.time()
+        cur.execute(sql_merge)
+        n = cur.rowcount
+        conn.commit()
+        cur.close()
+    except Exception as e:
+        conn.rollback()
+        raise e
+    finally:
+        conn.close()
+    t2 = time.time()
+    print(f"Upserted {n} rows, copy {t1 - t0:.2f}s + merge {t2 - t1:.2f}s = {t2 - t0:.2f}s")
+    return n
+
+
+def compare_upsert_cmcmaster(rows: list[dict]) -> dict:
+    """Times the executemany path against the COPY path on the same rows.
+    Both are idempotent upserts so it's safe to run against the live table."""
+    t0 = time.time()
+    bulk_upsert_cmcmaster(rows)
+    t1 = time.time()
+    copy_upsert_cmcmaster(rows)
+    t2 = time.time()
+    timings = {"executemany": t1 - t0, "copy": t2 - t1}
+    print(f"executemany: {timings['executemany']:.2f}s, "
+          f"copy: {timings['copy']:.2f}s, "
+          f"speedup: {timings['executemany'] / max(timings['copy'], 1e-9):.1f}x")
+    return timings
+
+# timings = compare_upsert_cmcmaster(rows)
+
+
+#%% ========================================
+# Incremental sync: only write rows that actually changed
+# Most of the CMC map is static between runs, so rewriting every row
+# just burns WAL and leaves dead tuples behind for vacuum. We hash each
+# destructured row, diff against the fingerprints already stored in
+# cmcmaster, and only COPY/merge the new or changed rows. Every write
+# also lands in cmcmaster_changes so downstream steps know which ids moved.
+
+def _fingerprint(row: dict) -> int:
+    """Stable 64-bit fingerprint of a destructured CMC map row"""
+    blob = json.dumps(row, sort_keys=True, separators=(",", ":"), default=str)
+    digest = hashlib.blake2b(blob.encode(), digest_size=8).digest()
+    # signed so it fits in an INT8
+    return int.from_bytes(digest, "big", signed=True)
+
+
+def sync_cmcmaster_incremental(rows: list[dict]) -> list[int]:
+    """Upserts only new/changed rows into cmcmaster and logs them
+    into cmcmaster_changes. Returns the list of ids that moved."""
+    t0 = time.time()
+    # dedup on id (last one wins) and diff against what's stored
+    latest = {}
+    for row in rows:
+        latest[row["id"]] = row
+    # only pull the fingerprints for the ids we were handed, so this
+    # stays cheap when called once per page
+    sql = "SELECT id, fingerprint FROM cmcmaster WHERE id = ANY(:ids)"
+    conn = engine.connect()
+    stored = dict(conn.execute(text(sql), {"ids": list(latest)}).fetchall())
+    conn.close()
+
+    changed = []
+    for id, row in latest.items():
+        fp = _fingerprint(row)
+        if stored.get(id) != fp:
+            changed.append({**row, "fingerprint": fp})
+    print(f"{len(changed)}/{len(latest)} rows new or changed")
+
+    if not changed:
+        return []
+
+    columns = CMCMASTER_COLUMNS + ("fingerprint",)
+    cols = ", ".join(columns)
+    updates = ",\n    ".join(f"{c} = EXCLUDED.{c}" for c in columns if c != "id")
+    sql_stage = \
+"""
+CREATE TEMP TABLE cmcmaster_stage
+    (LIKE cmcmaster INCLUDING DEFAULTS)
+    ON COMMIT DROP
+"""
+    sql_copy = f"COPY cmcmaster_stage ({cols}) FROM STDIN WITH (FORMAT text)"
+    # the WHERE on the conflict branch keeps this idempotent if another
+    # sync slipped in between our read of the fingerprints and now.
+    # xmax = 0 is only true for freshly inserted tuples.
+    sql_merge = \
+f"""
+WITH upserted AS (
+    INSERT INTO cmcmaster ({cols})
+    SELECT {cols}
+    FROM cmcmaster_stage
+    ON CONFLICT (id) DO UPDATE
+    SET
+    {updates}
+    WHERE cmcmaster.fingerprint IS DISTINCT FROM EXCLUDED.fingerprint
+    RETURNING id, fingerprint, (xmax = 0) AS inserted
+)
+INSERT INTO cmcmaster_changes (id, op, fingerprint)
+SELECT id, CASE WHEN inserted THEN 'I' ELSE 'U' END, fingerprint
+FROM upserted
+RETURNING id
+"""
+    conn = engine.raw_connection()
+    try:
+        cur = conn.cursor()
+        cur.execute(sql_stage)
+        cur.copy_expert(sql_copy, copy_buffer(changed, columns))
+        cur.execute(sql_merge)
+        ids = [r[0] for r in cur.fetchall()]
+        conn.commit()
+        cur.close()
+    except Exception as e:
+        conn.rollback()
+        raise e
+    finally:
+        conn.close()
+    print(f"Wrote {len(ids)} changed rows in {time.time() - t0:.2f}s")
+    return ids
+
+
+def get_changed_ids(since) -> list[int]:
+    """ids in cmcmaster that were inserted/updated at or after `since`"""
+    sql = \
+"""
+SELECT DISTINCT id
+FROM cmcmaster_changes
+WHERE changed_at >= :since
+ORDER BY id
+"""
+    conn = engine.connect()
+    rows = conn.execute(text(sql), {"since": since}).fetchall()
+    conn.close()
+    return [row[0] for row in rows]
+
+
+#%% ========================================
+# Pipelined ETL: fetch page n+1 while page n is being written
+# A producer thread pages through the CMC map API (including the
+# polite sleep between pages) and hands destructured pages over a
+# bounded queue. The main thread writes each page as it arrives, so
+# network time and DB time overlap and memory stays at ~one page.
+
+_DONE = object()
+
+
+def stream_cmcmaster(upsert=sync_cmcmaster_incremental, maxpages: int = 1) -> list[int]:
+    """Streams the CMC map into cmcmaster page by page.
+    `upsert` is called with each destructured page, `maxpages` bounds
+    how many pages can be buffered ahead of the writer."""
+    q = queue.Queue(maxsize=maxpages)
+    stop = threading.Event()
+
+    def producer():
+        try:
+            for page in iter_cmc_map():
+                if stop.is_set():
+                    return
+                q.put([destructure_row(row) for row in page])
+        except Exception as e:
+            q.put(e)
+        finally:
+            q.put(_DONE)
+
+    t0 = time.time()
+    thread = threading.Thread(target=producer, daemon=True)
+    thread.start()
+    nrows = 0
+    results = []
+    try:
+        while True:
+            item = q.get()
+            if item is _DONE:
+                break
+            if isinstance(item, Exception):
+                raise item
+            res = upsert(item)
+            if isinstance(res, list):
+                results.extend(res)
+            nrows += len(item)
+            print(f"+{len(item)} rows (total: {nrows}), elapsed {time.time() - t0:.2f}s")
+    finally:
+        # unblock the producer if we bailed out early
+        stop.set()
+        while thread.is_alive():
+            try:
+                q.get_nowait()
+            except queue.Empty:
+                thread.join(0.1)
+    print(f"Streamed {nrows} rows in {time.time() - t0:.2f}s")
+    return results
+
+
 #%% ========================================
 # ETL from CMC API into the cmcmaster table
 
-rows = get_cmc_map1()
-print(f"got {len(rows)} rows")
-#%%
-bulk_upsert_cmcmaster(rows)
+# rows = get_cmc_map1()
+# print(f"got {len(rows)} rows")
+# copy_upsert_cmcmaster(rows)
+# changed_ids = sync_cmcmaster_incremental(rows)
+changed_ids = stream_cmcmaster()
 
 
 #%% ========================================
@@ -228,13 +509,122 @@ WHERE id = :id
 
 
 
-while True:
-    updated = hydrate_urls()
-    if updated == 0:
-        break
-    if updated == None:
-        break
-    time.sleep(5)
+# while True:
+#     updated = hydrate_urls()
+#     if updated == 0:
+#         break
+#     if updated == None:
+#         break
+#     time.sleep(5)
+
+
+#%% ========================================
+# concurrent url hydration
+# The v2 info endpoint costs 1 credit per 100 ids, so we split every
+# `urls IS NULL` id into 100-id batches and run several get_metadata
+# calls at once under a shared credits-per-minute budget. Results get
+# written back in bulk as each batch lands, and a short response only
+# loses the ids CMC didn't return (they stay NULL for the next run).
+
+class CreditBudget:
+    """Thread-safe token bucket: `per_minute` credits, refilled continuously."""
+
+    def __init__(self, per_minute: float, burst: float | None = None):
+        self.rate = per_minute / 60.0
+        self.capacity = burst if burst is not None else per_minute
+        self.tokens = self.capacity
+        self.t = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self, cost: float = 1.0) -> None:
+        """Blocks until `cost` credits are available, then spends them."""
+        if cost > self.capacity:
+            # the bucket never holds more than capacity, so this would spin forever
+            raise ValueError(f"cost {cost} exceeds bucket capacity {self.capacity}")
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.t) * self.rate)
+                self.t = now
+                if self.tokens >= cost:
+                    self.tokens -= cost
+                    return
+                wait = (cost - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+def _write_urls(metadata: list[dict]) -> int:
+    """Bulk writes [{'id', 'urls'}, ...] into cmcnotes.urls in one statement."""
+    if not metadata:
+        return 0
+    sql = \
+"""
+UPDATE cmcnotes AS c
+SET urls = u.urls
+FROM jsonb_to_recordset(CAST(:payload AS JSONB)) AS u(id INT4, urls JSONB)
+WHERE c.id = u.id
+"""
+    payload = [{"id": d["id"], "urls": d.get("urls") or {}} for d in metadata]
+    conn = engine.connect()
+    res = conn.execute(text(sql), {"payload": json.dumps(payload)})
+    conn.commit()
+    conn.close()
+    return res.rowcount
+
+
+def hydrate_urls_concurrent(batch_size: int = 100,
+                            workers: int = 4,
+                            credits_per_minute: float = 30) -> int:
+    """Hydrates every NULL cmcnotes.urls. Returns the number of rows updated."""
+    sql = \
+"""
+SELECT id
+FROM cmcnotes
+WHERE urls IS NULL
+ORDER BY rank ASC
+"""
+    conn = engine.connect()
+    ids = [row[0] for row in conn.execute(text(sql)).fetchall()]
+    conn.close()
+    print(f"Found {len(ids)} ids")
+    if not ids:
+        return 0
+
+    # 1 credit per 100 ids (rounded up); the bucket must hold at least
+    # one full batch or acquire could never be satisfied
+    max_cost = -(-batch_size // 100)
+    budget = CreditBudget(credits_per_minute, burst=max(workers, max_cost))
+
+    def worker(batch: tuple[int, ...]) -> list[dict]:
+        budget.acquire(-(-len(batch) // 100))
+        return get_metadata(list(batch))
+
+    t0 = time.time()
+    nupdated = 0
+    nmissing = 0
+    nfailed = 0
+    batches = list(batched(ids, batch_size))
+    with ThreadPoolExecutor(max_workers=workers) as ex:
+        futures = {ex.submit(worker, b): b for b in batches}
+        for fut in as_completed(futures):
+            batch = futures[fut]
+            try:
+                metadata = fut.result()
+            except Exception as e:
+                nfailed += len(batch)
+                print(f"batch of {len(batch)} failed: {e}")
+                continue
+            # only the ids that didn't come back, the rest of the batch is fine
+            nmissing += len(set(batch) - {m['id'] for m in metadata})
+            # write back on the main thread while other batches are in flight
+            nupdated += _write_urls(metadata)
+            dt = time.time() - t0
+            print(f"Updated {nupdated}/{len(ids)} urls, elapsed {dt:.2f}s")
+    print(f"Done! updated {nupdated}, missing {nmissing}, failed {nfailed}")
+    return nupdated
+
+
+nupdated = hydrate_urls_concurrent()
 
 
 
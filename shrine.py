@@ -2,43 +2,46 @@
 
 #%% ========================================
 import time
+import asyncio
 from pprint import pprint
-from concurrent.futures import ThreadPoolExecutor
 from sqlalchemy import create_engine, text
 
 from src.api_chatbot import gpt5_web, gpt5_web_flex_mini, gpt5
+from src.api_chatbot import agpt5, agpt5_web_flex_mini
+from src.hydrator import Hydrator
+from src import prompts
+from src.limiter import Limiter
+from src.batch import BatchRunner
 from src.secrets_ import POSTGRES_CREDENTIALS, POSTGRES_URL
 engine = create_engine(POSTGRES_URL)
 
 # sqlalchemy rawsql is preferred over psycopg2 because the API
 # is more readable and it auto manages connection pools.
 
+# Each enrichment column is a Hydrator (src/hydrator.py): the target
+# column, the columns it depends on, a prompt template (src/prompts.py)
+# and a model.
+# The framework handles selecting pending rows, concurrency, retries,
+# progress and batched write-back.
+
 
 # pprint(rows)
 #%% ========================================
 
 
-def hydrate_cmcnotes():
-    sql = \
-"""
-SELECT *
-FROM cmcnotes
-WHERE webprint_gpt5mini IS NULL
-ORDER BY rank ASC
-LIMIT 10
-"""
-    # connect and return a list[dict]
-    conn = engine.connect()
-    rows = conn.execute(text(sql))
-    rows = rows.mappings().fetchall()
-    conn.close()
-    print(f"got: {str([row['name'] for row in rows])} fresh from db")
-
-    for row in rows:
-        slugtxt = f"Platform-Slug: {row.get('platform_slug')}" if row.get('platform_slug') else ""
-        prompt = f"""
-        Please write a research report on the following coin:
-        Name: {row['name']}. Slug: {row['slug']}. {slugtxt}
+def _webprint_data(row: dict) -> str:
+    slugtxt = f"Platform-Slug: {row.get('platform_slug')}" if row.get('platform_slug') else ""
+    return "\n".join([
+        f"Name: {row['name']}. Slug: {row['slug']}. {slugtxt}",
+        "",
+        "Some relevant links:",
+        f"{row['urls']}",
+    ])
+
+
+# static instructions first (byte-stable, cacheable prefix), coin last
+prompt_webprint = prompts.register("webprint", """
+        Please write a research report on the coin given in the INPUT below.
 
         I have aggregated a number of links that you can use as reference. Use my links to guide you,
         but favor your own web search to find information on your own. Make sure to look through many 
@@ -59,65 +62,29 @@ LIMIT 10
         This report will be a single part of a greater collage of reports which will be aggregated together
         to aim to explore hundreds of different tokens/blockchains.
 
-        Some relevant links:
-        {row['urls']}
-
         Return ONLY the full report. Do NOT add extraneous text afterwards. Do NOT prompt the user
         for information. Do NOT suggest to reformat the information.
         Return only the report, intended to be presented to a user in a professional manner.
+        """, _webprint_data)
 
-        """
-        print(prompt)
-
-        # response = gpt5_web(prompt)
-        response = gpt5_web_flex_mini(prompt)
-        print(response)
-
-        sql2 = \
-"""
-UPDATE cmcnotes
-SET webprint_gpt5mini = :webprint_gpt5mini
-WHERE id = :id
-"""
-        conn = engine.connect()
-        conn.execute(text(sql2), {"webprint_gpt5mini": response, "id": row['id']})
-        conn.commit()
-        conn.close()
-        print(f"Uploaded response to cmcnotes.webprint_gpt5mini for {row['name']}")
-
-    return rows
 
+hydrate_cmcnotes = Hydrator(
+    column="webprint_gpt5mini",
+    prompt=prompt_webprint,
+    # model=gpt5_web,
+    model=gpt5_web_flex_mini,
+    amodel=agpt5_web_flex_mini,
+    limiter=Limiter("gpt-5-mini", max_output=8000),
+)
 
-
-rows = hydrate_cmcnotes()
-print(f"updated {len(rows)} ids")
-pprint(rows)
-print("done")
-
+stats = hydrate_cmcnotes.run(limit=10)
+pprint(stats)
 
 
 # %%
 
 
-def hydrate_webprint_distill1s():
-    sql = \
-"""
-SELECT *
-FROM cmcnotes
-WHERE webprint_distill1s IS NULL
-AND webprint_gpt5mini IS NOT NULL
-ORDER BY rank ASC
-LIMIT 500
-"""
-    conn = engine.connect()
-    rows = conn.execute(text(sql))
-    rows = rows.mappings().fetchall()
-    conn.close()
-    print(f"got: {str([row['name'] for row in rows])} fresh from db")
-
-    for row in rows:
-
-        prompt = f"""
+prompt_distill1s = prompts.register("distill1s", """
         In only one sentence, describe what this crypto project is and
         the nature of this project. Start with '[name of project] is...'.
         Do not bother defining the ticker/symbol, unless critical to the 
@@ -125,61 +92,31 @@ LIMIT 500
         unless they present critical or highly relevant information.
         Return only one sentence (~30 words). Be as succinct and vivid 
         as possible, with as high information density per token as possible:
-        INPUT:
-        <<<
-        {row['webprint_gpt5mini']}
-        >>>
-        """
-
-        print(prompt)
-        response = gpt5(prompt)
-        print(response)
-
-        sql2 = \
-"""
-UPDATE cmcnotes
-SET webprint_distill1s = :webprint_distill1s
-WHERE id = :id
-"""
-        conn = engine.connect()
-        conn.execute(text(sql2), {"webprint_distill1s": response, "id": row['id']})
-        conn.commit()
-        conn.close()
-        print(f"Uploaded response to cmcnotes.webprint_distill1s for {row['name']}")
-
-
-    return rows
-
-rows = hydrate_webprint_distill1s()
-print(f"updated {len(rows)} ids")
-pprint(rows)
-print("done")
+        """, lambda row: row['webprint_gpt5mini'])
+
+
+hydrate_webprint_distill1s = Hydrator(
+    column="webprint_distill1s",
+    depends=("webprint_gpt5mini",),
+    prompt=prompt_distill1s,
+    model=gpt5,
+    amodel=agpt5,
+    # concurrency adapts from 10 up to 64 threads depending on 429s
+    workers=64,
+    limiter=Limiter("gpt-5", initial=10, maximum=64),
+)
+
+stats = hydrate_webprint_distill1s.run(limit=500)
+pprint(stats)
+
+# or the whole universe through the Batch API (half price, no threads
+# held, results land within 24h). Safe to re-run, it resumes open jobs:
+# stats = BatchRunner(hydrate_webprint_distill1s, preset="gpt5").run()
 
 # %%
 
 
-def hydrate_webprint_distill1s_fun() -> int:
-    # concurrent hydration version
-    # retrieve some null rows to work on
-    t0 = time.time()
-    sql = """
-    SELECT *
-    FROM cmcnotes
-    WHERE webprint_distill1s_fun IS NULL
-    AND webprint_gpt5mini IS NOT NULL
-    ORDER BY rank ASC
-    LIMIT 200
-    """
-    conn = engine.connect()
-    rows = conn.execute(text(sql))
-    rows = rows.mappings().fetchall()
-    conn.close()
-    print(f"retrieved {len(rows)} rows from db...")
-
-    # define the worker
-    def worker(row: dict) -> None:
-        # make request to inference api
-        prompt = f"""
+prompt_distill1s_fun = prompts.register("distill1s_fun", """
         In only one sentence, describe what this crypto project is and
         the nature of this project. Start with '[name of project] is...'.
         Do not bother defining the ticker/symbol, unless critical to the 
@@ -198,40 +135,24 @@ def hydrate_webprint_distill1s_fun() -> int:
         alternate responses, ponder each one, and then select the best one 
         from those 5 based off of (1, primarily) the quality of the information it 
         provides, and (2, secondarily), the quality, nuance, and depth of the humor it presents.
-
-        INPUT:
-        <<<
-        {row['webprint_gpt5mini']}
-        >>>
-        """
-        response = gpt5(prompt)
-
-        # insert into db
-        # engine.connect() is safe across threads bc it pulls from a pool.
-        # (don't use the same instance across threads)
-        sql2 = """
-        UPDATE cmcnotes
-        SET webprint_distill1s_fun = :webprint_distill1s_fun
-        WHERE id = :id
-        """
-        conn = engine.connect()
-        conn.execute(text(sql2), {"webprint_distill1s_fun": response, "id": row['id']})
-        conn.commit()
-        conn.close()
-        print(f".", end="", flush=True)
-
-
-    # run the workers concurrently (yes this works in ipython)
-    rows = [dict(r) for r in rows]
-    with ThreadPoolExecutor(max_workers=10) as ex:
-        # yes this will surface errors
-        list(ex.map(worker, rows))
-    dt = time.time() - t0
-    print(f"done!")
-    return dt
-
-
-elapsed = hydrate_webprint_distill1s_fun()
-print(f"elapsed: {elapsed:.2f}")
+        """, lambda row: row['webprint_gpt5mini'])
+
+
+hydrate_webprint_distill1s_fun = Hydrator(
+    column="webprint_distill1s_fun",
+    depends=("webprint_gpt5mini",),
+    prompt=prompt_distill1s_fun,
+    model=gpt5,
+    amodel=agpt5,
+    concurrency=500,
+    limiter=Limiter("gpt-5", initial=50, maximum=500, target_latency=120.0),
+)
+
+# async: hundreds of requests in flight from one thread
+# (in jupyter use `await hydrate_webprint_distill1s_fun.arun(limit=200)`)
+stats = asyncio.run(hydrate_webprint_distill1s_fun.arun(limit=200))
+# stats = hydrate_webprint_distill1s_fun.run(limit=200)
+# stats = BatchRunner(hydrate_webprint_distill1s_fun, preset="gpt5").run()
+print(f"elapsed: {stats['elapsed']:.2f}")
 
 #%%
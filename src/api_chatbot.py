@@ -1,15 +1,45 @@
 #%% ========================================
+from __future__ import annotations
 import json
-from openai import OpenAI
-from openai.types.responses import Response
+import asyncio
+from functools import cache
+from typing import TYPE_CHECKING
 
 from pprint import pprint
 import time
 
 from src.secrets_ import OPENAI_API_KEY
+from src import llmcache
+from src.ledger import ledger, cost
+
+if TYPE_CHECKING:
+    from openai import OpenAI, AsyncOpenAI
+    from openai.types.responses import Response
 
 mins15 = 15 * 60
-client = OpenAI(api_key=OPENAI_API_KEY, timeout=mins15)
+
+
+# the openai sdk is slow to import, so the client gets built on first use
+# (base_url points a client at something else, e.g. src/standin.py)
+@cache
+def get_client(base_url: str | None = None) -> OpenAI:
+    from openai import OpenAI
+    return OpenAI(api_key=OPENAI_API_KEY, base_url=base_url, timeout=mins15)
+
+
+@cache
+def get_async_client(base_url: str | None = None) -> AsyncOpenAI:
+    # one async client (and one http connection pool) for the process,
+    # concurrency is bounded by the callers' semaphores, not by threads
+    from openai import AsyncOpenAI
+    return AsyncOpenAI(api_key=OPENAI_API_KEY, base_url=base_url, timeout=mins15)
+
+
+def __getattr__(name):
+    # keeps `from src.api_chatbot import client` working
+    if name == "client":
+        return get_client()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 # USAGE:
 # https://platform.openai.com/settings/organization/usage
@@ -27,6 +57,7 @@ client = OpenAI(api_key=OPENAI_API_KEY, timeout=mins15)
 
 
 # PRICING SNAPSHOT (SEPTEMBER 2025):
+# (the table that's actually used for costs is src/ledger.py PRICES)
 # Model	                  Input	     Cached input     Output
 # gpt-5      	          $1.25	     $0.125	          $10.00
 # gpt-5-mini	          $0.25	     $0.025	           $2.00
@@ -59,137 +90,189 @@ client = OpenAI(api_key=OPENAI_API_KEY, timeout=mins15)
 def _destructure_usage(response: Response) -> dict:
     ncalls = sum([getattr(i, "type", "") == "web_search_call" 
                   for i in (response.output or [])])
-    d = {"nwebcalls":   ncalls,
-         "ntokens_in":  response.usage.input_tokens,
-         "ntokens_out": response.usage.output_tokens}
+    details = getattr(response.usage, "input_tokens_details", None)
+    d = {"nwebcalls":      ncalls,
+         "ntokens_in":     response.usage.input_tokens,
+         "ntokens_cached": getattr(details, "cached_tokens", 0) or 0,
+         "ntokens_out":    response.usage.output_tokens}
     return d
 
 
-def gpt5_web(input_text: str) -> str:
-    response = client.responses.create(
+def record_response(response: Response, request: dict, latency: float, cache_hit: bool) -> dict | None:
+    """Logs one call to the usage ledger (src/ledger.py). Cache hits cost nothing.
+    Public so other ways of getting a Response (background jobs) log the same way.
+    Best effort: the response is already paid for, so a bookkeeping error
+    (no usage, unknown model, ...) is printed and never raised."""
+    try:
+        model = request["model"]
+        tier = request.get("service_tier") or "default"
+        usage = _destructure_usage(response)
+        rec = {"model": model, "tier": tier, **usage, "latency": latency,
+               "cost": 0.0 if cache_hit else cost(model, tier, **usage),
+               "cache_hit": cache_hit}
+        ledger.record(**rec)
+        return rec
+    except Exception as e:
+        print(f"ledger: couldn't record {getattr(response, 'id', '?')}: {e!r}")
+        return None
+
+
+def _print_cost(rec: dict | None) -> None:
+    if rec is None:
+        return
+    price = "?" if rec["cost"] is None else f"{rec['cost']:.4f}"
+    print(f"price: ${price}, web calls: {rec['nwebcalls']}, input: {rec['ntokens_in']} "
+          f"({rec['ntokens_cached']} cached), output: {rec['ntokens_out']}, {rec['latency']:.1f}s")
+
+
+def _create(fresh: bool = False, **kwargs) -> Response:
+    """responses.create behind the on-disk llmcache.
+    The key covers every kwarg (model, tools, reasoning, service_tier, input).
+    fresh=True skips the lookup but still stores the new response."""
+    from openai.types.responses import Response
+    key = llmcache.cache_key(**kwargs)
+    t0 = time.time()
+    if not fresh:
+        payload = llmcache.cache.get(key)
+        if payload is not None:
+            print(f"llmcache: hit {key[:12]}")
+            response = Response.model_validate(payload)
+            record_response(response, kwargs, time.time() - t0, cache_hit=True)
+            return response
+    response = get_client().responses.create(**kwargs)
+    latency = time.time() - t0
+    # cache first: the paid response is saved whatever the bookkeeping does.
+    # only keep finished responses, never cache a failure/incomplete one
+    if response.status == "completed":
+        llmcache.cache.put(key, response.model_dump(mode="json"))
+    _print_cost(record_response(response, kwargs, latency, cache_hit=False))
+    return response
+
+
+# request kwargs per wrapper, shared by the sync and async versions (and
+# so by their cache keys)
+PRESETS = {
+    "gpt5": dict(
+        model="gpt-5",
+        reasoning={"effort": "medium"},
+    ),
+    "gpt5_web": dict(
         model="gpt-5",
         tools=[{"type": "web_search"}],
         reasoning={"effort": "medium"},
-        input=input_text
-    )
-    # tabulate usage cost
-    calls      = sum([getattr(i, "type", "") == "web_search_call" 
-                      for i in (response.output or [])])
-    tokens_in  = response.usage.input_tokens
-    tokens_out = response.usage.output_tokens
-    cost_calls = calls * 10.00 / 1000
-    cost_in    = tokens_in / 1_000_000 * 1.25
-    cost_out   = tokens_out / 1_000_000 * 10.00
-    cost_total = cost_calls + cost_in + cost_out
-    print(f"price: ${cost_total:.4f}, calls: ${cost_calls:.4f}, input: ${cost_in:.4f}, output: ${cost_out:.4f}")
-    return response.output_text
-
-
-def gpt5_web_flex(input_text: str) -> str:
-    response = client.responses.create(
+    ),
+    "gpt5_web_flex": dict(
         model="gpt-5",
         tools=[{"type": "web_search"}],
         reasoning={"effort": "medium"},
-        input=input_text,
         service_tier="flex",
-    )
-    # tabulate usage cost
-    calls      = sum([getattr(i, "type", "") == "web_search_call" 
-                      for i in (response.output or [])])
-    tokens_in  = response.usage.input_tokens
-    tokens_out = response.usage.output_tokens
-    cost_calls = calls * 10.00 / 1000
-    cost_in    = tokens_in / 1_000_000 * 0.625
-    cost_out   = tokens_out / 1_000_000 * 5.00
-    cost_total = cost_calls + cost_in + cost_out
-    print(f"price: ${cost_total:.4f}, calls: ${cost_calls:.4f}, input: ${cost_in:.4f}, output: ${cost_out:.4f}")
-    return response.output_text
-
-
-def gpt5_web_flex_mini(input_text: str) -> str:
-    response = client.responses.create(
+    ),
+    "gpt5_web_flex_mini": dict(
         model="gpt-5-mini",
         tools=[{"type": "web_search"}],
         reasoning={"effort": "medium"},
-        input=input_text,
         service_tier="flex",
-    )
-    # tabulate usage cost
-    calls      = sum([getattr(i, "type", "") == "web_search_call" 
-                      for i in (response.output or [])])
-    tokens_in  = response.usage.input_tokens
-    tokens_out = response.usage.output_tokens
-    cost_calls = calls * 10.00 / 1000
-    cost_in    = tokens_in / 1_000_000 * 0.125
-    cost_out   = tokens_out / 1_000_000 * 1.00
-    cost_total = cost_calls + cost_in + cost_out
-    print(f"price: ${cost_total:.4f}, calls: ${cost_calls:.4f}, input: ${cost_in:.4f}, output: ${cost_out:.4f}")
+    ),
+}
+
+
+def gpt5_web(input_text: str, fresh: bool = False) -> str:
+    response = _create(fresh=fresh, input=input_text, **PRESETS["gpt5_web"])
     return response.output_text
 
 
-def gpt5(input_text: str) -> str:
-    response = client.responses.create(
-        model="gpt-5",
-        reasoning={"effort": "medium"},
-        input=input_text
-    )
-    # tabulate usage cost
-    tokens_in  = response.usage.input_tokens
-    tokens_out = response.usage.output_tokens
-    cost_in    = tokens_in / 1_000_000 * 1.25
-    cost_out   = tokens_out / 1_000_000 * 10.00
-    cost_total = cost_in + cost_out
-    print(f"price: ${cost_total:.4f}, input: ${cost_in:.4f}, output: ${cost_out:.4f}")
+def gpt5_web_flex(input_text: str, fresh: bool = False) -> str:
+    response = _create(fresh=fresh, input=input_text, **PRESETS["gpt5_web_flex"])
     return response.output_text
 
 
-def o3_background(input_text: str) -> str:
-    # background mode example:
-    # https://platform.openai.com/docs/guides/background
-    resp = client.responses.create(
-        model="o3",
-        input=input_text,
-        background=True,
-    )
+def gpt5_web_flex_mini(input_text: str, fresh: bool = False) -> str:
+    response = _create(fresh=fresh, input=input_text, **PRESETS["gpt5_web_flex_mini"])
+    return response.output_text
+
 
+def gpt5(input_text: str, fresh: bool = False) -> str:
+    response = _create(fresh=fresh, input=input_text, **PRESETS["gpt5"])
+    return response.output_text
+
+
+#%% ========================================
+# async counterparts
+# Same requests (and the same cache) as the wrappers above, but on
+# AsyncOpenAI. A flex call can take minutes, and a thread per in-flight
+# request caps us at ~10. With coroutines, one process can keep
+# hundreds in flight. Bound them with a semaphore (see agather).
+
+async def _acreate(fresh: bool = False, **kwargs) -> Response:
+    """async _create, sharing the same on-disk cache"""
+    from openai.types.responses import Response
+    key = llmcache.cache_key(**kwargs)
     t0 = time.time()
-    while True:
+    if not fresh:
+        payload = await asyncio.to_thread(llmcache.cache.get, key)
+        if payload is not None:
+            response = Response.model_validate(payload)
+            record_response(response, kwargs, time.time() - t0, cache_hit=True)
+            return response
+    response = await get_async_client().responses.create(**kwargs)
+    latency = time.time() - t0
+    if response.status == "completed":
+        await asyncio.to_thread(llmcache.cache.put, key, response.model_dump(mode="json"))
+    record_response(response, kwargs, latency, cache_hit=False)
+    return response
+
+
+async def agpt5(input_text: str, fresh: bool = False) -> str:
+    response = await _acreate(fresh=fresh, input=input_text, **PRESETS["gpt5"])
+    return response.output_text
 
-        dt = time.time() - t0
-        if resp.status not in {"queued", "in_progress"}:
-            break
 
-        time.sleep(10)
-        print(f"polling, elapsed: {dt:.2f}s")
-        resp = client.responses.retrieve(resp.id)
+async def agpt5_web(input_text: str, fresh: bool = False) -> str:
+    response = await _acreate(fresh=fresh, input=input_text, **PRESETS["gpt5_web"])
+    return response.output_text
 
-    print(f"Done! {resp.status}. elapsed: {dt:.2f}s")
-    return resp.output_text
 
+async def agpt5_web_flex(input_text: str, fresh: bool = False) -> str:
+    response = await _acreate(fresh=fresh, input=input_text, **PRESETS["gpt5_web_flex"])
+    return response.output_text
 
-def o3_deep_research(input_text: str) -> str:
-    # deep research in background mode
-    # https://platform.openai.com/docs/guides/deep-research
-    resp = client.responses.create(
-        model="o3-deep-research",
-        input=input_text,
-        background=True,
-        tools=[{"type": "web_search"}],
-    )
 
-    t0 = time.time()
-    while True:
+async def agpt5_web_flex_mini(input_text: str, fresh: bool = False) -> str:
+    response = await _acreate(fresh=fresh, input=input_text, **PRESETS["gpt5_web_flex_mini"])
+    return response.output_text
+
 
-        dt = time.time() - t0
-        if resp.status not in {"queued", "in_progress"}:
-            break
+async def agather(fn, inputs: list[str], concurrency: int = 200) -> list:
+    """Runs fn over inputs with at most `concurrency` requests in flight.
+    Results come back in input order, exceptions are returned, not raised."""
+    sem = asyncio.Semaphore(concurrency)
 
-        time.sleep(60)
-        print(f"polling, elapsed: {dt:.2f}s")
-        resp = client.responses.retrieve(resp.id)
+    async def one(x):
+        async with sem:
+            return await fn(x)
 
-    print(f"Done! {resp.status}. elapsed: {dt:.2f}s")
-    return resp.output_text
+    return await asyncio.gather(*(one(x) for x in inputs), return_exceptions=True)
+
+
+#%% ========================================
+
+def o3_background(input_text: str) -> str:
+    # background mode example:
+    # https://platform.openai.com/docs/guides/background
+    # (blocks on one job; for many at once use src/jobs.py directly)
+    from src.jobs import jobs
+    job = jobs.wait(jobs.submit(input_text, preset="o3"))
+    print(f"Done! {job['status']}. elapsed: {job['finished'] - job['created']:.2f}s")
+    return job["output_text"]
+
+
+def o3_deep_research(input_text: str) -> str:
+    # deep research in background mode
+    # https://platform.openai.com/docs/guides/deep-research
+    from src.jobs import jobs
+    job = jobs.wait(jobs.submit(input_text, preset="o3_deep_research"))
+    print(f"Done! {job['status']}. elapsed: {job['finished'] - job['created']:.2f}s")
+    return job["output_text"]
 
 # We don't really have a use for the Batch API anymore
 # because we can just call service tier flex.
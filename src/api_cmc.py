@@ -3,7 +3,6 @@ import time
 import requests
 from pprint import pprint
 from src.secrets_ import CMC_API_KEY
-import pandas as pd
 
 # Coinmarketcap Universe Scraper
 # This endpoint is free with an account
@@ -15,8 +14,9 @@ import pandas as pd
 URL = "https://pro-api.coinmarketcap.com/v1/cryptocurrency/map"
 
 
-def get_cmc_map():
-    """Dumps raw data from the CMC map API"""
+def iter_cmc_map(limit: int = 5000, delay: float = 2.0):
+    """Yields raw pages from the CMC map API, one list of rows at a time.
+    Only one page is held in memory at a time."""
 
     headers = {
         "Accept": "application/json",
@@ -27,14 +27,12 @@ def get_cmc_map():
 
     params = {
         "start": start,
-        "limit": 5000,
+        "limit": limit,
         "listing_status": "active,inactive,untracked",
         "aux": "platform,first_historical_data,last_historical_data,is_active,status",
         "sort": "id",
     }
 
-    rows = []
-
     while True:
         # ingest data
         params["start"] = start
@@ -43,17 +41,26 @@ def get_cmc_map():
         payload = response.json()
         data = payload.get("data") or []
 
-        rows.extend(data)
-        print(f"+{len(data)} rows (total: {len(rows)})")
-
-        # print the last 5 rows
-        # print(f"Last 5 rows: {rows[-5:]}")
+        yield data
 
         if len(data) < params["limit"]:
             break
 
         start += len(data)
-        time.sleep(2)
+        time.sleep(delay)
+
+
+def get_cmc_map():
+    """Dumps raw data from the CMC map API"""
+
+    rows = []
+
+    for data in iter_cmc_map():
+        rows.extend(data)
+        print(f"+{len(data)} rows (total: {len(rows)})")
+
+        # print the last 5 rows
+        # print(f"Last 5 rows: {rows[-5:]}")
 
     # count rows, sanity check
     print(f"Total rows: {len(rows)}")
@@ -108,6 +115,7 @@ def get_cmc_map1(writecsv=False) -> list[dict]:
     rows = get_cmc_map()
     rows = [destructure_row(row) for row in rows]
     if writecsv:
+        import pandas as pd
         df = pd.DataFrame(rows)
         df.to_csv("cmcmap.csv", index=False)
         print("Wrote cmc_map.csv")
@@ -127,16 +135,20 @@ def get_metadata(cmcids: list[int]) -> list[dict]:
         "Accept": "application/json",
         "X-CMC_PRO_API_KEY": CMC_API_KEY,
     }
-    params = {"id": idstxt}
+    # without skip_invalid a single bad id fails the whole request
+    params = {"id": idstxt, "skip_invalid": "true"}
 
     response = requests.get(url, headers=headers, params=params, timeout=30)
     response.raise_for_status()
     payload = response.json()
     data = payload.get("data", {})
 
+    # with skip_invalid, invalid ids are left out of `data` (and listed
+    # in status.error_message), so this can come back shorter than
+    # cmcids. Callers should keep whatever they got.
     urls = []
     for d in data.values():
-        urls.append({'id': d['id'], 'urls': d['urls']})
+        urls.append({'id': d['id'], 'urls': d.get('urls')})
 
     return urls
 
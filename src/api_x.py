@@ -1,12 +1,15 @@
 #%% ========================================
 import time
+import asyncio
 import csv
 import re
 from pprint import pprint
-from dataclasses import dataclass, asdict
+from array import array
+from dataclasses import dataclass, asdict, fields
+from functools import cache
 
-import requests
-from selenium import webdriver
+# requests/httpx/selenium are imported where they're used, so importing
+# this module (e.g. for Profile) stays cheap
 
 from src.secrets_ import XAPI_CURL
 
@@ -124,9 +127,18 @@ def parse_curl_headers_cookies(curl_text: str) -> tuple[dict, dict]:
 
     return headers, cookies
 
-# TODO: load curl_str from dotenv instead?
-headers, cookies = parse_curl_headers_cookies(XAPI_CURL)
-print(f"xapi: successfully parsed headers and cookies!")
+@cache
+def get_credentials() -> tuple[dict, dict]:
+    """(headers, cookies) parsed from XAPI_CURL, on first use.
+    Callers get copies, so they can tweak headers freely."""
+    headers, cookies = parse_curl_headers_cookies(XAPI_CURL)
+    print(f"xapi: successfully parsed headers and cookies!")
+    return headers, cookies
+
+
+def _credentials() -> tuple[dict, dict]:
+    headers, cookies = get_credentials()
+    return dict(headers), dict(cookies)
 
 
 #%% ========================================
@@ -135,63 +147,27 @@ print(f"xapi: successfully parsed headers and cookies!")
 # url -> user_id
 
 def get_user_id_selenium(url: str) -> int:
-    """renders js page with selenium quick and dirty.
+    """renders js page with selenium.
     example: https://x.com/zxocw
-    errors if regex is not found."""
-    # load selenium and get the webpage (we need js)
-    # wait for js to load (2s)
-    # https://gist.github.com/kentbrew/8942accb5c584f11a775af02d097dd40
-    opts = webdriver.ChromeOptions()
-    opts.add_argument('--headless')
-    driver = webdriver.Chrome(options=opts)
-    driver.get(url)
-    time.sleep(3)
-    src = driver.page_source
-    driver.quit()
-    PAT = re.compile(r'https?://pbs\.twimg\.com/profile_banners/(\d+)(?:/|$)')
-    m = PAT.search(src)
-    userid = m.group(1)
-    userid = int(userid)
-    return userid
+    Runs on the shared warm Chrome pool (src/browser.py).
+    raises ValueError if the id can't be found."""
+    from src.browser import get_pool
+    return get_pool().user_id(url)
 
 
 def user_id_to_url_selenium(id: int) -> str:
-    """quick and dirty selenium hack to get the url of a user.
-    twitter seems to not redirect unless you have user-agent."""
-    id = str(id)
-    opts = webdriver.ChromeOptions()
-    opts.add_argument('--headless')
-    opts.add_argument("--window-size=1280,800")
-    opts.add_argument(
-        "user-agent="
-        "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) "
-        "AppleWebKit/537.36 (KHTML, like Gecko) "
-        "Chrome/124 Safari/537.36"
-    )
-    driver = webdriver.Chrome(options=opts)
-    starturl   = f"https://x.com/i/user/{id}"
-    currenturl = starturl
-    driver.get(starturl)
-    t0 = time.time()
-    while True:
-        dt = time.time() - t0
-        currenturl = driver.current_url
-        if currenturl != starturl:
-            break
-        if dt > 5:
-            break
-        time.sleep(1)
-    driver.quit()
-    if currenturl != starturl:
-        return currenturl
-    raise ValueError(f"Could not resolve profile URL for {id}")
+    """selenium hack to get the url of a user.
+    twitter seems to not redirect unless you have user-agent.
+    Runs on the shared warm Chrome pool (src/browser.py)."""
+    from src.browser import get_pool
+    return get_pool().url(id)
 
 
 
 #%% ========================================
 
 
-@dataclass
+@dataclass(slots=True)
 class Profile:
     id:              int
     screen_name:     str
@@ -202,10 +178,105 @@ class Profile:
     urlprofile:      str
 
 
+PROFILE_FIELDS = tuple(f.name for f in fields(Profile))
+
+# followers_count lives in an array('q'), which can't hold None, so an
+# unknown count is stored as -1 and turned back into None on the way out
+NO_COUNT = -1
+
+
+class ProfileBatch:
+    """Column-backed batch of profiles.
+    Crawls produce thousands of profiles that only ever get shipped
+    straight to postgres, so instead of one Profile object (+ asdict
+    copy) per user we keep one list per column. The db layer binds the
+    columns directly as arrays. Iterating still yields Profiles for
+    code that wants them.
+    followers_count is stored with NO_COUNT for unknown, columns() and
+    iteration give None back."""
+
+    __slots__ = PROFILE_FIELDS
+
+    def __init__(self):
+        self.id:              array = array('q')
+        self.screen_name:     list[str] = []
+        self.name:            list[str] = []
+        self.description:     list[str] = []
+        self.followers_count: array = array('q')
+        self.urlpinned:       list[str] = []
+        self.urlprofile:      list[str] = []
+
+    def __len__(self) -> int:
+        return len(self.id)
+
+    def __iter__(self):
+        for row in zip(*self.columns()):
+            yield Profile(*row)
+
+    def __getitem__(self, i: int) -> Profile:
+        p = Profile(*(getattr(self, f)[i] for f in PROFILE_FIELDS))
+        if p.followers_count == NO_COUNT:
+            p.followers_count = None
+        return p
+
+    def __repr__(self) -> str:
+        return f"ProfileBatch({len(self)} profiles)"
+
+    def columns(self) -> tuple:
+        """columns in PROFILE_FIELDS order (unknown followers_count -> None)"""
+        counts = [None if c == NO_COUNT else c for c in self.followers_count]
+        return tuple(counts if f == "followers_count" else getattr(self, f)
+                     for f in PROFILE_FIELDS)
+
+    def append(self, p: Profile) -> None:
+        for f in PROFILE_FIELDS:
+            v = getattr(p, f)
+            if f == "followers_count" and v is None:
+                v = NO_COUNT
+            getattr(self, f).append(v)
+
+    def extend(self, other) -> None:
+        """Appends another ProfileBatch (column-wise) or any iterable of Profiles"""
+        if isinstance(other, ProfileBatch):
+            for f in PROFILE_FIELDS:
+                getattr(self, f).extend(getattr(other, f))
+        else:
+            for p in other:
+                self.append(p)
+
+    @classmethod
+    def from_profiles(cls, profiles) -> "ProfileBatch":
+        if isinstance(profiles, ProfileBatch):
+            return profiles
+        batch = cls()
+        batch.extend(profiles)
+        return batch
+
+    def add_users(self, users: list[dict]) -> int:
+        """Parses a friends/list.json 'users' payload straight into the columns"""
+        for user in users:
+            self.id.append(int(user['id_str']))
+            self.screen_name.append(user['screen_name'])
+            self.name.append(user['name'])
+            self.description.append(user['description'])
+            count = user.get('followers_count')
+            self.followers_count.append(NO_COUNT if count is None else count)
+            self.urlpinned.append(user['url'])
+            self.urlprofile.append(f"https://x.com/{user['screen_name']}")
+        return len(users)
+
+
 # TODO: get more data into the dataclass?
 # TODO: get expanded urls? rn its t.co/ links.
 
-def get_targets(id: int) -> list[Profile]:
+def _parse_users(users: list[dict]) -> ProfileBatch:
+    """friends/list.json 'users' payload -> ProfileBatch"""
+    batch = ProfileBatch()
+    batch.add_users(users)
+    return batch
+
+
+def get_targets(id: int) -> ProfileBatch:
     """given an id, get the people that user follows."""
     # clean this up? needs to loop over paginated data.
     # apparently cursor starts at -1 and ends at 0
@@ -215,10 +286,12 @@ def get_targets(id: int) -> list[Profile]:
         'count': '100',
         'cursor': '-1',
     }
+    import requests
+    headers, cookies = _credentials()
     # not sure if we need this...
     headers['referer'] = ""
-    # targets is a list of Profile objects
-    targets: list[Profile] = []
+    # targets is a column-backed batch of profiles
+    targets = ProfileBatch()
     # start infinite loop
     while True:
         # get the data
@@ -235,17 +308,7 @@ def get_targets(id: int) -> list[Profile]:
         # safety: make it raise if we're stacking more than n users
         if len(targets) > 3000:
             raise Exception("Upper limit of users reached")
-        for user in users:
-            profile = Profile(
-                id             =int(user['id_str']),
-                screen_name    =user['screen_name'],
-                name           =user['name'],
-                description    =user['description'],
-                followers_count=user['followers_count'],
-                urlpinned      =user['url'],
-                urlprofile     =f"https://x.com/{user['screen_name']}",
-            )
-            targets.append(profile)
+        targets.add_users(users)
         # update params
         params['cursor'] = next_cursor_str
         print(f"+{len(users)} users (total: {len(targets)}) => next_cursor: {next_cursor_str}")
@@ -256,6 +319,165 @@ def get_targets(id: int) -> list[Profile]:
         time.sleep(2)
     return targets
 
+#%% ========================================
+# async crawl engine
+# get_targets walks one user at a time with a fixed 2s sleep per page.
+# Here every root gets its own cursor loop running as an asyncio task,
+# and all requests made with the same credentials share one token
+# bucket. Wall-clock time is then bounded by the rate limit instead
+# of by the number of users. Pages are yielded as soon as they land.
+
+class TokenBucket:
+    """asyncio token bucket: `rate` requests/sec with bursts up to `capacity`."""
+
+    def __init__(self, rate: float, capacity: float = 1.0):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.t = time.monotonic()
+        self.lock = asyncio.Lock()
+
+    async def acquire(self) -> None:
+        # holding the lock while sleeping keeps the waiters fifo
+        async with self.lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.t) * self.rate)
+                self.t = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+@dataclass
+class CrawlSession:
+    """One set of credentials and the rate limit that goes with it."""
+    headers: dict
+    cookies: dict
+    bucket:  TokenBucket
+
+
+def default_session(rate: float = 0.5, capacity: float = 1.0) -> CrawlSession:
+    """Session built from the module-level cURL credentials.
+    0.5 req/s matches the old sleep(2) per page."""
+    headers, cookies = _credentials()
+    return CrawlSession(headers={**headers, 'referer': ""},
+                        cookies=cookies,
+                        bucket=TokenBucket(rate, capacity))
+
+
+async def _crawl_one(client, session: CrawlSession, id: int,
+                     out: asyncio.Queue, max_users: int) -> None:
+    """Pages through one user's following list, pushing (id, profiles) onto `out`."""
+    params = {
+        'include_followed_by': '1',
+        'user_id': str(id),
+        'count': '100',
+        'cursor': '-1',
+    }
+    total = 0
+    BACKOFF = 15.0
+    backoff = BACKOFF
+    while True:
+        await session.bucket.acquire()
+        response = await client.get(
+            'https://x.com/i/api/1.1/friends/list.json',
+            params=params,
+            cookies=session.cookies,
+            headers=session.headers,
+        )
+        if response.status_code == 429:
+            # rate limited: back off and retry the same cursor
+            reset = response.headers.get('x-rate-limit-reset')
+            wait = max(float(reset) - time.time(), 1.0) if reset else backoff
+            backoff = min(backoff * 2, 900.0)
+            print(f"429 on {id}, sleeping {wait:.0f}s")
+            await asyncio.sleep(wait)
+            continue
+        response.raise_for_status()
+        backoff = BACKOFF
+        data = response.json()
+        profiles = _parse_users(data["users"])
+        total += len(profiles)
+        if total > max_users:
+            raise Exception(f"Upper limit of users reached for {id}")
+        await out.put((id, profiles))
+        params['cursor'] = data["next_cursor_str"]
+        if params['cursor'] == '0':
+            break
+
+
+async def crawl_targets(ids: list[int],
+                        sessions: list[CrawlSession] | None = None,
+                        concurrency: int = 16,
+                        max_users: int = 3000):
+    """Async generator of (root_id, ProfileBatch) batches, one per page,
+    for many roots at once. Roots are spread round-robin over `sessions`.
+    An error in any root cancels the crawl and is re-raised here."""
+    sessions = sessions or [default_session()]
+    out: asyncio.Queue = asyncio.Queue(maxsize=concurrency * 2)
+    sem = asyncio.Semaphore(concurrency)
+    DONE = object()
+
+    async def run(client, session, id):
+        async with sem:
+            await _crawl_one(client, session, id, out, max_users)
+
+    async def supervise(client):
+        try:
+            tasks = [asyncio.create_task(run(client, sessions[i % len(sessions)], id))
+                     for i, id in enumerate(dict.fromkeys(ids))]
+            try:
+                await asyncio.gather(*tasks)
+            except BaseException:
+                for t in tasks:
+                    t.cancel()
+                raise
+        except Exception as e:
+            await out.put(e)
+        finally:
+            await out.put(DONE)
+
+    import httpx
+    t0 = time.time()
+    total = 0
+    async with httpx.AsyncClient(timeout=30) as client:
+        supervisor = asyncio.create_task(supervise(client))
+        try:
+            while True:
+                item = await out.get()
+                if item is DONE:
+                    break
+                if isinstance(item, Exception):
+                    raise item
+                total += len(item[1])
+                yield item
+        finally:
+            supervisor.cancel()
+            # if the consumer stopped early `out` can be full, and the
+            # supervisor's final put(DONE) would block forever: keep
+            # draining until it has actually finished
+            while not supervisor.done():
+                while not out.empty():
+                    out.get_nowait()
+                await asyncio.wait({supervisor}, timeout=0.01)
+            try:
+                await supervisor
+            except asyncio.CancelledError:
+                pass
+    print(f"crawled {total} users from {len(ids)} roots in {time.time() - t0:.2f}s")
+
+
+def get_targets_many(ids: list[int], **kwargs) -> dict[int, ProfileBatch]:
+    """Blocking wrapper around crawl_targets. Returns {root_id: ProfileBatch}"""
+    async def collect():
+        targets = {id: ProfileBatch() for id in ids}
+        async for id, profiles in crawl_targets(ids, **kwargs):
+            targets[id].extend(profiles)
+        return targets
+    return asyncio.run(collect())
+
 #%% ========================================
 # tests:
 
@@ -268,6 +490,7 @@ def get_targets(id: int) -> list[Profile]:
 # print(type(url))
 
 # result = get_targets(uid)
+# results = get_targets_many([uid, 1312083283])
 # import json
 # with open('targets.json', 'w') as f:
 #     dicts = [asdict(p) for p in result]
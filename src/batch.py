@@ -0,0 +1,295 @@
+#%% ========================================
+from __future__ import annotations
+import os
+import json
+import time
+import glob
+from typing import TYPE_CHECKING
+
+from src.api_chatbot import PRESETS, get_client
+from src.ledger import ledger as default_ledger, cost
+
+if TYPE_CHECKING:
+    from openai import OpenAI
+    from src.hydrator import Hydrator
+    from src.ledger import Ledger
+
+# Batch API execution mode for hydrators.
+# Batch is half price and doesn't hold a single client thread while the
+# provider works through it (up to 24h). Web search isn't supported in
+# the Batch API, so this is for the hydrators that don't need it
+# (webprint_distill1s, webprint_distill1s_fun), not webprint_gpt5mini.
+#
+# BatchRunner(hydrator, preset):
+#   submit()   pending rows -> jsonl (one /v1/responses request per row,
+#              custom_id = row key) -> files.create -> batches.create.
+#              Rows are split into batches of at most MAX_REQUESTS
+#              requests and MAX_BYTES of jsonl (the api's input limits).
+#              The job (batch id, file ids, keys) is saved under
+#              local/batch/ so it can be tracked across restarts, and rows
+#              that are already in an open job aren't submitted twice.
+#   poll()     refreshes the status of every open job.
+#   collect()  streams a finished job's output file line by line into
+#              a WriteBack (bulk UPDATEs), and logs usage to the ledger
+#              once the WriteBack has closed (so a collect that dies
+#              halfway and gets rerun doesn't count the cost twice).
+#              Failed requests (error file, non-200, or missing from the
+#              output altogether) are counted and their errors kept on
+#              the job record. Their rows stay NULL, so the next submit()
+#              picks them up again.
+#   run()      all three, until every job is done.
+#
+# base_url (or the OPENAI_BASE_URL env var) points it somewhere else,
+# e.g. the local stand-in in src/standin.py. It shares api_chatbot's
+# client (15 min timeout, plenty for file uploads/downloads).
+# ledger defaults to the process-wide one in src/ledger.py.
+
+BATCH_DIR = "local/batch"
+MAX_REQUESTS = 50_000               # per batch, api limit
+MAX_BYTES = 200 * 1024 * 1024       # per input file, api limit
+FINAL = {"completed", "failed", "expired", "cancelled"}
+
+
+def _output_text(body: dict) -> str:
+    """output_text of a Response in json form"""
+    return "".join(c.get("text", "")
+                   for item in body.get("output") or [] if item.get("type") == "message"
+                   for c in item.get("content") or [] if c.get("type") == "output_text")
+
+
+def _usage(body: dict) -> dict:
+    """_destructure_usage for a Response in json form"""
+    usage = body.get("usage") or {}
+    return {"nwebcalls":      sum(i.get("type") == "web_search_call" for i in body.get("output") or []),
+            "ntokens_in":     usage.get("input_tokens", 0),
+            "ntokens_cached": (usage.get("input_tokens_details") or {}).get("cached_tokens", 0),
+            "ntokens_out":    usage.get("output_tokens", 0)}
+
+
+def _error(out: dict) -> str | None:
+    """error message of a batch output/error line, None if it succeeded"""
+    if out.get("error"):
+        return out["error"].get("message") or json.dumps(out["error"])
+    response = out.get("response") or {}
+    body = response.get("body") or {}
+    if response.get("status_code") != 200:
+        return ((body.get("error") or {}).get("message")
+                or f"status {response.get('status_code')}")
+    if body.get("status") != "completed":
+        return f"response {body.get('status')}"
+    return None
+
+
+#%% ========================================
+
+class BatchRunner:
+
+    def __init__(self, hydrator: Hydrator, preset: str = "gpt5",
+                 base_url: str | None = None, root: str = BATCH_DIR,
+                 chunk: int = MAX_REQUESTS, max_bytes: int = MAX_BYTES,
+                 ledger: Ledger | None = None):
+        body = PRESETS[preset]
+        if any(t.get("type", "").startswith("web_search") for t in body.get("tools", [])):
+            raise ValueError(f"{preset}: web search isn't supported in the Batch API")
+        if body.get("service_tier"):
+            body = {k: v for k, v in body.items() if k != "service_tier"}
+        self.h = hydrator
+        self.preset = preset
+        self.body = body
+        self.base_url = base_url
+        self.root = root
+        self.chunk = chunk
+        self.max_bytes = max_bytes
+        self.ledger = ledger if ledger is not None else default_ledger
+
+    def __repr__(self) -> str:
+        return f"BatchRunner({self.h.column!r}, {self.preset!r}, jobs={len(self.jobs())})"
+
+    @property
+    def client(self) -> OpenAI:
+        return get_client(self.base_url)
+
+    # ---- local job records
+
+    def _path(self, batch_id: str) -> str:
+        return os.path.join(self.root, f"{batch_id}.json")
+
+    def _save(self, job: dict) -> None:
+        os.makedirs(self.root, exist_ok=True)
+        tmp = self._path(job["id"]) + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(job, f)
+        os.replace(tmp, self._path(job["id"]))
+
+    def jobs(self, open_only: bool = False) -> list[dict]:
+        """This hydrator's jobs, oldest first. open_only: not collected yet."""
+        out = []
+        for p in sorted(glob.glob(os.path.join(self.root, "*.json"))):
+            with open(p, encoding="utf-8") as f:
+                job = json.load(f)
+            if (job["table"], job["column"]) != (self.h.table, self.h.column):
+                continue
+            if open_only and job["collected"]:
+                continue
+            out.append(job)
+        return sorted(out, key=lambda j: j["created"])
+
+    def outstanding(self) -> set[str]:
+        """keys (as custom_ids) already sitting in an open job"""
+        return {str(k) for job in self.jobs(open_only=True) for k in job["keys"]}
+
+    # ---- submit / poll / collect
+
+    def _request(self, row: dict) -> dict:
+        return {"custom_id": str(row[self.h.key]),
+                "method": "POST",
+                "url": "/v1/responses",
+                "body": {**self.body, "input": self.h.prompt(row)}}
+
+    def _chunks(self, rows: list[dict]):
+        """[(row, jsonl line bytes), ...] groups within the count/size limits"""
+        chunk, size = [], 0
+        for row in rows:
+            line = (json.dumps(self._request(row), ensure_ascii=False) + "\n").encode()
+            if len(line) > self.max_bytes:
+                print(f"{self.h.column}: row {row[self.h.key]} is over {self.max_bytes} bytes, skipped")
+                continue
+            if chunk and (len(chunk) >= self.chunk or size + len(line) > self.max_bytes):
+                yield chunk
+                chunk, size = [], 0
+            chunk.append((row, line))
+            size += len(line)
+        if chunk:
+            yield chunk
+
+    def submit(self, limit: int | None = None) -> list[str]:
+        """Submits pending rows (not already in an open job). Returns batch ids."""
+        busy = self.outstanding()
+        rows = [r for r in self.h.pending() if str(r[self.h.key]) not in busy]
+        rows = rows[:limit] if limit is not None else rows
+        print(f"{self.h.column}: {len(rows)} rows to submit ({len(busy)} already in flight)")
+        os.makedirs(self.root, exist_ok=True)
+        ids = []
+        for i, chunk in enumerate(self._chunks(rows)):
+            fname = os.path.join(self.root, f"{self.h.column}-{int(time.time())}-{i}.jsonl")
+            with open(fname, "wb") as f:
+                for _, line in chunk:
+                    f.write(line)
+            with open(fname, "rb") as f:
+                batchfile = self.client.files.create(file=f, purpose="batch")
+            batch = self.client.batches.create(
+                input_file_id=batchfile.id,
+                endpoint="/v1/responses",
+                completion_window="24h",
+                metadata={"table": self.h.table, "column": self.h.column},
+            )
+            self._save({"id": batch.id, "table": self.h.table, "column": self.h.column,
+                        "preset": self.preset, "input_file": fname,
+                        "input_file_id": batchfile.id, "status": batch.status,
+                        "created": time.time(), "collected": False,
+                        "keys": [row[self.h.key] for row, _ in chunk]})
+            ids.append(batch.id)
+            print(f"{self.h.column}: submitted {batch.id} with {len(chunk)} requests")
+        return ids
+
+    def poll(self) -> list[dict]:
+        """Refreshes every open job from the api. Returns them."""
+        jobs = self.jobs(open_only=True)
+        for job in jobs:
+            if job["status"] in FINAL:
+                continue
+            batch = self.client.batches.retrieve(job["id"])
+            counts = batch.request_counts
+            job.update(status=batch.status,
+                       output_file_id=batch.output_file_id,
+                       error_file_id=batch.error_file_id,
+                       counts=counts.model_dump() if counts else None,
+                       created_at=batch.created_at,
+                       completed_at=batch.completed_at)
+            self._save(job)
+        return jobs
+
+    def _lines(self, file_id: str):
+        """parsed jsonl lines of a batch output/error file, streamed"""
+        with self.client.files.with_streaming_response.content(file_id) as resp:
+            for line in resp.iter_lines():
+                if line.strip():
+                    yield json.loads(line)
+
+    def collect(self, job: dict, max_errors: int = 100) -> int:
+        """Streams a finished job's results into the table. Returns rows written.
+        Failures (first `max_errors` messages) end up in job["errors"]."""
+        if job["status"] not in FINAL:
+            raise ValueError(f"{job['id']} is still {job['status']}")
+        keys = {str(k): k for k in job["keys"]}
+        seen = set()
+        errors = {}
+        written = 0
+        if job.get("output_file_id"):
+            model = self.body["model"]
+            latency = (job.get("completed_at") or time.time()) - (job.get("created_at") or job["created"])
+            wb = self.h.writeback()
+            usages = []
+            for out in self._lines(job["output_file_id"]):
+                seen.add(out["custom_id"])
+                error = _error(out)
+                if error:
+                    errors[out["custom_id"]] = error
+                    continue
+                body = out["response"]["body"]
+                usages.append(_usage(body))
+                wb.add(keys[out["custom_id"]], _output_text(body))
+            written = wb.close()
+            for usage in usages:
+                self.ledger.record(model=model, tier="batch", **usage, latency=latency,
+                                   cost=cost(model, "batch", **usage), cache_hit=False)
+        if job.get("error_file_id"):
+            for out in self._lines(job["error_file_id"]):
+                seen.add(out["custom_id"])
+                errors[out["custom_id"]] = _error(out) or "unknown error"
+        for custom_id in keys.keys() - seen:
+            # expired/cancelled batches just leave requests out
+            errors[custom_id] = f"no result (batch {job['status']})"
+        failed = len(errors)
+        if errors:
+            sample = dict(list(errors.items())[:3])
+            print(f"{self.h.column}: {job['id']}: {failed} requests failed, e.g. {sample}")
+        job.update(collected=True, written=written, failed=failed,
+                   errors=dict(list(errors.items())[:max_errors]))
+        self._save(job)
+        print(f"{self.h.column}: collected {job['id']} ({job['status']}), "
+              f"{written} written, {failed} failed")
+        return written
+
+    def run(self, limit: int | None = None, every: float = 60.0) -> dict:
+        """submit, then poll every `every` seconds and collect jobs as they finish.
+        Picks up jobs left open by an earlier (crashed) run as well."""
+        t0 = time.time()
+        self.submit(limit)
+        written = 0
+        while True:
+            jobs = self.poll()
+            for job in jobs:
+                if job["status"] in FINAL:
+                    written += self.collect(job)
+            left = [j for j in jobs if j["status"] not in FINAL]
+            if not left:
+                break
+            print(f"{self.h.column}: {len(left)} batches open "
+                  f"({', '.join(j['status'] for j in left)}), elapsed {time.time() - t0:.0f}s")
+            time.sleep(every)
+        stats = {"column": self.h.column, "written": written, "elapsed": time.time() - t0}
+        print(f"{self.h.column}: batch done! {written} written in {stats['elapsed']:.0f}s")
+        return stats
+
+
+#%% ========================================
+# usage:
+# from shrine import hydrate_webprint_distill1s
+# runner = BatchRunner(hydrate_webprint_distill1s, preset="gpt5")
+# runner.run()                 # or submit() now, poll()/collect() later
+#
+# against the local stand-in:
+# from src.standin import serve
+# server = serve(port=8765)
+# runner = BatchRunner(hydrate_webprint_distill1s, base_url="http://127.0.0.1:8765/v1")
@@ -0,0 +1,95 @@
+#%% ========================================
+import os
+import sys
+import subprocess
+
+# Importing anything under src/ is supposed to be side effect free:
+# engines, api clients and credentials are all built on first use.
+# Anything that actually needs to talk to the outside world up front
+# (seeding the root node, warming the clients) lives in bootstrap().
+#
+#   python -m src.bootstrap            # bootstrap
+#   python -m src.bootstrap --imports  # check the import time budget
+
+MODULES = (
+    "src.secrets_",
+    "src.lazy",
+    "src.pgcopy",
+    "src.intersect",
+    "src.api_cmc",
+    "src.api_x",
+    "src.browser",
+    "src.llmcache",
+    "src.prompts",
+    "src.ledger",
+    "src.api_chatbot",
+    "src.standin",
+    "src.batch",
+    "src.jobs",
+    "src.db",
+    "src.crawl",
+    "src.graph",
+    "src.rank",
+    "src.minhash",
+    "src.writeback",
+    "src.limiter",
+    "src.hydrator",
+    "src.search",
+    "src.embed",
+)
+
+# sqlalchemy (~200ms cold) and numpy (~90ms) are only imported on first
+# use (src/lazy.py), so no module should get anywhere near this: no
+# network, no clients, no selenium, no heavy libraries at import
+IMPORT_BUDGET_MS = 300
+HEAVY = ("numpy", "pandas", "sqlalchemy", "openai", "selenium")
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def bootstrap() -> None:
+    """Connects to the db, seeds the root node and builds the api clients."""
+    from src.db import bootstrap as bootstrap_db
+    from src.api_chatbot import get_client
+    bootstrap_db()
+    get_client()
+
+
+def import_times(modules=MODULES) -> dict[str, float]:
+    """Cold import time (ms) of each module, each in a fresh interpreter."""
+    code = ("import time, importlib, sys; t0 = time.perf_counter(); "
+            "importlib.import_module(sys.argv[1]); "
+            "print((time.perf_counter() - t0) * 1000)")
+    times = {}
+    for mod in modules:
+        out = subprocess.run([sys.executable, "-c", code, mod], cwd=ROOT,
+                             capture_output=True, text=True, check=True)
+        times[mod] = float(out.stdout.strip().splitlines()[-1])
+    return times
+
+
+def check_import_budget(budget_ms: float = IMPORT_BUDGET_MS) -> dict[str, float]:
+    """Raises if any module takes longer than budget_ms to import."""
+    times = import_times()
+    for mod, ms in times.items():
+        print(f"{mod:<20} {ms:8.1f}ms")
+    slow = {mod: ms for mod, ms in times.items() if ms > budget_ms}
+    if slow:
+        raise AssertionError(f"over the {budget_ms}ms import budget: {slow}")
+    return times
+
+
+def heavy_imports(mod: str) -> list[str]:
+    """Which of HEAVY get imported as a side effect of importing mod."""
+    code = ("import sys, importlib; importlib.import_module(sys.argv[1]); "
+            "print(' '.join(m for m in sys.argv[2:] if m in sys.modules))")
+    out = subprocess.run([sys.executable, "-c", code, mod, *HEAVY], cwd=ROOT,
+                         capture_output=True, text=True, check=True)
+    return out.stdout.split()
+
+
+if __name__ == "__main__":
+    if "--imports" in sys.argv:
+        check_import_budget()
+    else:
+        bootstrap()
@@ -0,0 +1,216 @@
+#%% ========================================
+import re
+import queue
+import atexit
+import threading
+from functools import cache
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
+
+# Pool of warm headless Chromes for the X lookups that need js.
+# get_user_id_selenium/user_id_to_url_selenium used to start a fresh
+# Chrome per lookup (~1-2s), then sleep a fixed 3s (or poll the url once
+# a second) and quit. Here drivers are started once and reused, page
+# loads are 'eager' with images off, and every wait is a WebDriverWait
+# on the thing we actually want (the banner url in the page, or the
+# redirect), polled every 50ms. A warm lookup is mostly just the page
+# load. user_ids()/urls() fan a list out over all the drivers.
+# A driver that errors is thrown away and a fresh one is started on the
+# next checkout, so one crashed Chrome doesn't poison the pool.
+# selenium is only imported when the first driver starts.
+
+BANNER = re.compile(r'https?://pbs\.twimg\.com/profile_banners/(\d+)(?:/|$)')
+USER_AGENT = ("Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) "
+              "AppleWebKit/537.36 (KHTML, like Gecko) "
+              "Chrome/124 Safari/537.36")
+
+
+def profile_url(handle: str) -> str:
+    """'zxocw', '@zxocw' or 'https://x.com/zxocw' -> https://x.com/zxocw"""
+    if handle.startswith("http"):
+        return handle
+    return f"https://x.com/{handle.lstrip('@')}"
+
+
+class ChromePool:
+
+    def __init__(self, size: int = 4, timeout: float = 8.0, poll: float = 0.05):
+        self.size = size
+        self.timeout = timeout
+        self.poll = poll
+        self.idle: queue.Queue = queue.Queue()
+        self.lock = threading.Lock()
+        self.started = 0
+        self.closed = False
+
+    def __repr__(self) -> str:
+        return f"ChromePool(size={self.size}, started={self.started}, idle={self.idle.qsize()})"
+
+    def _new_driver(self):
+        from selenium import webdriver
+        opts = webdriver.ChromeOptions()
+        opts.add_argument("--headless=new")
+        opts.add_argument("--window-size=1280,800")
+        opts.add_argument("--disable-gpu")
+        opts.add_argument("--blink-settings=imagesEnabled=false")
+        opts.add_argument(f"user-agent={USER_AGENT}")
+        # don't wait for every image/iframe, we wait for what we need ourselves
+        opts.page_load_strategy = "eager"
+        driver = webdriver.Chrome(options=opts)
+        driver.set_page_load_timeout(self.timeout * 2)
+        return driver
+
+    def _start(self):
+        """Starts a driver in a free slot. None if the pool is full."""
+        with self.lock:
+            if self.started >= self.size:
+                return None
+            self.started += 1
+        try:
+            return self._new_driver()
+        except Exception:
+            with self.lock:
+                self.started -= 1
+            raise
+
+    def warm(self, n: int | None = None) -> None:
+        """Starts drivers up front (in parallel) so the first lookups are fast.
+        Drivers that did start stay in the pool even if another one failed."""
+        n = min(n or self.size, self.size)
+        with ThreadPoolExecutor(max_workers=max(1, n)) as ex:
+            futures = [ex.submit(self._start) for _ in range(n)]
+        errors = []
+        for fut in futures:
+            try:
+                driver = fut.result()
+            except Exception as e:
+                errors.append(e)
+                continue
+            if driver is not None:
+                self.idle.put(driver)
+        if errors:
+            raise errors[0]
+
+    def _checkout(self):
+        while True:
+            try:
+                return self.idle.get_nowait()
+            except queue.Empty:
+                pass
+            driver = self._start()
+            if driver is not None:
+                return driver
+            # pool is full, wait for a driver back (or for a slot to free
+            # up if a broken one gets discarded)
+            try:
+                return self.idle.get(timeout=0.5)
+            except queue.Empty:
+                continue
+
+    @contextmanager
+    def driver(self):
+        """Checks a driver out of the pool (starting one if there's room)."""
+        if self.closed:
+            raise RuntimeError("ChromePool is closed")
+        d = self._checkout()
+        try:
+            yield d
+        except Exception:
+            # could be a dead/wedged browser, don't hand it out again
+            self._discard(d)
+            raise
+        else:
+            if self.closed:
+                self._discard(d)
+            else:
+                self.idle.put(d)
+
+    def _discard(self, d) -> None:
+        with self.lock:
+            self.started -= 1
+        try:
+            d.quit()
+        except Exception:
+            pass
+
+    def close(self) -> None:
+        self.closed = True
+        while True:
+            try:
+                d = self.idle.get_nowait()
+            except queue.Empty:
+                break
+            self._discard(d)
+
+    # ---- lookups
+
+    def user_id(self, handle: str) -> int:
+        """x handle/profile url -> user id (scraped from the banner url)"""
+        from selenium.webdriver.support.ui import WebDriverWait
+        from selenium.common.exceptions import TimeoutException
+        url = profile_url(handle)
+        with self.driver() as d:
+            d.get(url)
+            try:
+                m = WebDriverWait(d, self.timeout, poll_frequency=self.poll).until(
+                    lambda d: BANNER.search(d.page_source))
+            except TimeoutException:
+                m = None
+        # (raised outside the with: a page without a banner isn't a broken driver)
+        if m is None:
+            raise ValueError(f"no user id found on {url}")
+        return int(m.group(1))
+
+    def url(self, id: int) -> str:
+        """user id -> profile url (x redirects /i/user/<id> once js runs)"""
+        from selenium.webdriver.support.ui import WebDriverWait
+        from selenium.webdriver.support import expected_conditions as EC
+        from selenium.common.exceptions import TimeoutException
+        starturl = f"https://x.com/i/user/{id}"
+        with self.driver() as d:
+            d.get(starturl)
+            try:
+                WebDriverWait(d, self.timeout, poll_frequency=self.poll).until(
+                    EC.url_changes(starturl))
+            except TimeoutException:
+                pass
+            currenturl = d.current_url
+        if currenturl != starturl:
+            return currenturl
+        raise ValueError(f"Could not resolve profile URL for {id}")
+
+    def _map(self, fn, items) -> dict:
+        """{item: result or exception}, spread over every driver"""
+        items = list(dict.fromkeys(items))
+
+        def one(x):
+            try:
+                return fn(x)
+            except Exception as e:
+                return e
+
+        with ThreadPoolExecutor(max_workers=self.size) as ex:
+            return dict(zip(items, ex.map(one, items)))
+
+    def user_ids(self, handles) -> dict:
+        return self._map(self.user_id, handles)
+
+    def urls(self, ids) -> dict:
+        return self._map(self.url, ids)
+
+
+@cache
+def get_pool(size: int = 4) -> ChromePool:
+    """The shared pool, closed at exit."""
+    pool = ChromePool(size=size)
+    atexit.register(pool.close)
+    return pool
+
+
+#%% ========================================
+# usage:
+# pool = get_pool()
+# pool.warm()
+# pool.user_id("realGeorgeHotz")
+# pool.user_ids(["zxocw", "@jackalxhunt", "https://x.com/realGeorgeHotz"])
+# pool.urls([1234, 5678])
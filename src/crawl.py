@@ -0,0 +1,277 @@
+#%% ========================================
+import time
+import socket
+import os
+
+from src.db import get_engine, text, upsert_branch
+from src.api_x import get_targets
+
+# Persistent BFS over the X graph.
+# Instead of calling get_targets + upsert_branch by hand for every
+# root, the crawl state lives in a frontier table keyed on xusers.id.
+# Every node in the frontier is either pending, claimed by a worker,
+# done or failed. Workers grab the highest priority pending nodes with
+# FOR UPDATE SKIP LOCKED, so any number of processes can expand the
+# graph at once without stepping on each other. Everything is in the
+# db, so a crashed or restarted crawl just picks up where it left off
+# (claims whose lease expired go back to pending).
+#
+# priority = ln(1 + followers_count)
+#          - DEPTH_WEIGHT * depth
+#          + STALE_WEIGHT * days since last crawl (capped, never crawled = cap)
+
+
+DEPTH_WEIGHT = 2.0
+STALE_WEIGHT = 0.05
+STALE_CAP_DAYS = 365
+
+_PRIORITY_SQL = f"""
+    ln(1 + greatest(coalesce(u.followers_count, 0), 0))
+    - {DEPTH_WEIGHT} * f.depth
+    + {STALE_WEIGHT} * least(
+        coalesce(extract(epoch from now() - f.crawled_at) / 86400, {STALE_CAP_DAYS}),
+        {STALE_CAP_DAYS})
+"""
+
+
+#%% ========================================
+
+def _create_table_xfrontier():
+    # BFS frontier, one row per node we intend to expand
+    sql = \
+"""
+CREATE TABLE xfrontier (
+    id          INT8 PRIMARY KEY
+        REFERENCES xusers(id) ON DELETE CASCADE,
+    depth       INT4 NOT NULL,
+    status      TEXT NOT NULL DEFAULT 'pending',  -- pending | claimed | done | failed
+    priority    FLOAT8 NOT NULL DEFAULT 0,
+    attempts    INT4 NOT NULL DEFAULT 0,
+    claimed_by  TEXT,
+    claimed_at  TIMESTAMPTZ,
+    crawled_at  TIMESTAMPTZ,
+    error       TEXT
+);
+CREATE INDEX xfrontier_pending_idx ON xfrontier(priority DESC) WHERE status = 'pending';
+CREATE INDEX xfrontier_claimed_idx ON xfrontier(claimed_at) WHERE status = 'claimed';
+"""
+    conn = get_engine().connect()
+    conn.execute(text(sql))
+    conn.commit()
+    conn.close()
+    print("Created table xfrontier")
+
+# _create_table_xfrontier()
+
+
+#%% ========================================
+
+def _enqueue(conn, ids: list[int], depth: int) -> int:
+    """Adds ids to the frontier (as pending) if they aren't there yet.
+    Must run on a connection where the ids already exist in xusers."""
+    if not ids:
+        return 0
+    sql = """
+    INSERT INTO xfrontier (id, depth)
+    SELECT unnest(CAST(:ids AS INT8[])), :depth
+    ON CONFLICT (id) DO UPDATE
+    SET depth = EXCLUDED.depth
+    WHERE xfrontier.status = 'pending' AND xfrontier.depth > EXCLUDED.depth
+    """
+    res = conn.execute(text(sql), {"ids": list(ids), "depth": depth})
+    _reprioritize(conn, ids)
+    return res.rowcount
+
+
+def _reprioritize(conn, ids: list[int]) -> None:
+    sql = f"""
+    UPDATE xfrontier AS f
+    SET priority = {_PRIORITY_SQL}
+    FROM xusers AS u
+    WHERE u.id = f.id AND f.id = ANY(CAST(:ids AS INT8[]))
+    """
+    conn.execute(text(sql), {"ids": list(ids)})
+
+
+def seed(ids: list[int], depth: int = 0) -> int:
+    """Puts root nodes into the frontier. They must already be in xusers."""
+    conn = get_engine().connect()
+    n = _enqueue(conn, ids, depth)
+    conn.commit()
+    conn.close()
+    print(f"Seeded {n} nodes into xfrontier")
+    return n
+
+
+def claim(worker: str, n: int = 1) -> list[tuple[int, int]]:
+    """Claims up to n pending nodes for `worker`. Returns [(id, depth), ...]"""
+    sql = """
+    WITH next AS (
+        SELECT id
+        FROM xfrontier
+        WHERE status = 'pending'
+        ORDER BY priority DESC
+        LIMIT :n
+        FOR UPDATE SKIP LOCKED
+    )
+    UPDATE xfrontier AS f
+    SET status = 'claimed', claimed_by = :worker, claimed_at = now(),
+        attempts = f.attempts + 1
+    FROM next
+    WHERE f.id = next.id
+    RETURNING f.id, f.depth
+    """
+    conn = get_engine().connect()
+    rows = conn.execute(text(sql), {"worker": worker, "n": n}).fetchall()
+    conn.commit()
+    conn.close()
+    return [(row[0], row[1]) for row in rows]
+
+
+def complete(id: int, depth: int, child_ids: list[int], max_depth: int,
+             worker: str) -> bool:
+    """Marks a node done and pushes its children one level deeper.
+    Only if `worker` still holds the claim: if the lease expired and the
+    node was re-claimed by someone else, nothing is written and this
+    returns False."""
+    sql = """
+    UPDATE xfrontier
+    SET status = 'done', crawled_at = now(), claimed_by = NULL, error = NULL,
+        attempts = 0
+    WHERE id = :id
+    AND status = 'claimed'
+    AND claimed_by = :worker
+    """
+    conn = get_engine().connect()
+    trans = conn.begin()
+    try:
+        res = conn.execute(text(sql), {"id": id, "worker": worker})
+        if res.rowcount == 0:
+            trans.rollback()
+            return False
+        if depth + 1 <= max_depth:
+            _enqueue(conn, child_ids, depth + 1)
+        _reprioritize(conn, [id])
+        trans.commit()
+        return True
+    except Exception as e:
+        trans.rollback()
+        raise e
+    finally:
+        conn.close()
+
+
+def fail(id: int, error: str, max_attempts: int = 3, worker: str | None = None) -> bool:
+    """Puts a node back to pending, or marks it failed after max_attempts.
+    With `worker`, only if that worker still holds the claim."""
+    sql = """
+    UPDATE xfrontier
+    SET status = CASE WHEN attempts >= :max_attempts THEN 'failed' ELSE 'pending' END,
+        claimed_by = NULL, error = :error
+    WHERE id = :id
+    """
+    if worker is not None:
+        sql += "AND status = 'claimed' AND claimed_by = :worker\n"
+    conn = get_engine().connect()
+    res = conn.execute(text(sql), {"id": id, "error": error[:2000],
+                                   "max_attempts": max_attempts, "worker": worker})
+    conn.commit()
+    conn.close()
+    return res.rowcount > 0
+
+
+def release_expired(lease_minutes: int = 30, max_attempts: int = 3) -> int:
+    """Returns claims older than the lease to pending (dead/restarted workers),
+    or marks them failed after max_attempts, same as fail()."""
+    sql = """
+    UPDATE xfrontier
+    SET status = CASE WHEN attempts >= :max_attempts THEN 'failed' ELSE 'pending' END,
+        claimed_by = NULL,
+        error = CASE WHEN attempts >= :max_attempts THEN 'lease expired' ELSE error END
+    WHERE status = 'claimed'
+    AND claimed_at < now() - make_interval(mins => :lease)
+    """
+    conn = get_engine().connect()
+    res = conn.execute(text(sql), {"lease": lease_minutes, "max_attempts": max_attempts})
+    conn.commit()
+    conn.close()
+    if res.rowcount:
+        print(f"Released {res.rowcount} expired claims")
+    return res.rowcount
+
+
+def requeue_stale(max_age_days: int = 30, max_attempts: int = 3) -> int:
+    """Sends done nodes older than max_age_days back to pending for a recrawl.
+    complete() resets attempts, so only nodes at the cap are marked failed."""
+    sql = f"""
+    UPDATE xfrontier AS f
+    SET status = CASE WHEN f.attempts >= :max_attempts THEN 'failed' ELSE 'pending' END,
+        priority = {_PRIORITY_SQL}
+    FROM xusers AS u
+    WHERE u.id = f.id
+    AND f.status = 'done'
+    AND f.crawled_at < now() - make_interval(days => :days)
+    """
+    conn = get_engine().connect()
+    res = conn.execute(text(sql), {"days": max_age_days, "max_attempts": max_attempts})
+    conn.commit()
+    conn.close()
+    print(f"Requeued {res.rowcount} stale nodes")
+    return res.rowcount
+
+
+def frontier_stats() -> dict:
+    sql = "SELECT status, count(*) FROM xfrontier GROUP BY status"
+    conn = get_engine().connect()
+    rows = conn.execute(text(sql)).fetchall()
+    conn.close()
+    return {row[0]: row[1] for row in rows}
+
+
+#%% ========================================
+
+def run_worker(max_depth: int = 2,
+               batch: int = 1,
+               max_nodes: int | None = None,
+               lease_minutes: int = 30,
+               idle_exit: bool = True) -> int:
+    """Expands the frontier until it's empty (or max_nodes is hit).
+    Safe to run in several processes at once. Returns nodes expanded."""
+    worker = f"{socket.gethostname()}:{os.getpid()}"
+    release_expired(lease_minutes)
+    nexpanded = 0
+    t0 = time.time()
+    while max_nodes is None or nexpanded < max_nodes:
+        claimed = claim(worker, batch)
+        if not claimed:
+            if idle_exit:
+                break
+            time.sleep(30)
+            release_expired(lease_minutes)
+            continue
+        for id, depth in claimed:
+            try:
+                profiles = get_targets(id)
+                upsert_branch(id, profiles)
+                owned = complete(id, depth, list(profiles.id), max_depth, worker)
+            except Exception as e:
+                print(f"failed to expand {id}: {e}")
+                fail(id, repr(e), worker=worker)
+                continue
+            if not owned:
+                print(f"lost the claim on {id} (lease expired), skipping")
+                continue
+            nexpanded += 1
+            dt = time.time() - t0
+            print(f"expanded {id} (depth {depth}, +{len(profiles)}) "
+                  f"[{nexpanded} nodes, {dt:.0f}s]")
+    print(f"worker {worker} done: {nexpanded} nodes, {frontier_stats()}")
+    return nexpanded
+
+
+#%% ========================================
+# usage:
+
+# from src.db import jackalxhunt
+# seed([jackalxhunt.id])
+# run_worker(max_depth=2)
@@ -1,12 +1,50 @@
 #%% ========================================
-from dataclasses import dataclass, asdict
-from sqlalchemy import create_engine, text, bindparam, ARRAY, BIGINT
-import pandas as pd
+import re
+import time
+import atexit
+import threading
+from functools import cache
 
 from src.secrets_ import POSTGRES_URL
-from src.api_x import Profile
+from src.lazy import lazy
+from src.api_x import Profile, ProfileBatch, PROFILE_FIELDS
+from src.intersect import at_least_k
+from src.pgcopy import copy_buffer
+
+# sqlalchemy takes ~200ms to import, it's only pulled in once the first
+# engine/statement gets built
+sa = lazy("sqlalchemy")
+
+
+def text(sql: str):
+    """sqlalchemy.text, for `from src.db import get_engine, text`"""
+    return sa.text(sql)
+
+
+_IDENT = re.compile(r"^[a-z_][a-z0-9_]*$")
+
+
+def ident(name: str) -> str:
+    """Guards identifiers (tables, columns) we have to paste into sql"""
+    if not _IDENT.match(name):
+        raise ValueError(f"bad sql identifier {name!r}")
+    return name
+
+
+# The engine is built on first use, not at import. Importing this module
+# shouldn't cost anything or touch the network (see bootstrap() below).
+@cache
+def get_engine():
+    # defers DB connection until connect/execute
+    return sa.create_engine(POSTGRES_URL)
+
+
+def __getattr__(name):
+    # keeps `from src.db import engine` / `db.engine` working
+    if name == "engine":
+        return get_engine()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
-engine = create_engine(POSTGRES_URL)
 
 # X/Twitter is one giant DiGraph. We can represent it
 # with two tables:
@@ -32,7 +70,7 @@ CREATE TABLE xusers (
 );
 CREATE INDEX xusers_screen_name_idx ON xusers(screen_name);
 """
-    conn = engine.connect()
+    conn = get_engine().connect()
     conn.execute(text(sql))
     conn.commit()
     conn.close()
@@ -55,7 +93,7 @@ CREATE TABLE xfollows (
     CHECK         (source_id <> target_id)
 );
 """
-    conn = engine.connect()
+    conn = get_engine().connect()
     conn.execute(text(sql))
     conn.commit()
     conn.close()
@@ -67,35 +105,71 @@ CREATE TABLE xfollows (
 
 #%% ========================================
 
-def _upsert_users(profiles: Profile) -> int:
+# Profiles travel as a column-backed ProfileBatch and get bound as one
+# array per column, then unnest()ed server side. One statement per batch,
+# and no per-row dicts on the python side.
+# DISTINCT ON keeps ON CONFLICT from touching the same id twice.
+_UPSERT_USERS = """
+INSERT INTO xusers (
+    id, screen_name, name, description, followers_count, urlpinned, urlprofile
+)
+SELECT DISTINCT ON (id) *
+FROM unnest(
+    CAST(:id AS INT8[]), CAST(:screen_name AS TEXT[]), CAST(:name AS TEXT[]),
+    CAST(:description AS TEXT[]), CAST(:followers_count AS INT4[]),
+    CAST(:urlpinned AS TEXT[]), CAST(:urlprofile AS TEXT[])
+) AS t(id, screen_name, name, description, followers_count, urlpinned, urlprofile)
+ORDER BY id
+ON CONFLICT (id) DO UPDATE SET
+    screen_name      = EXCLUDED.screen_name,
+    name             = EXCLUDED.name,
+    description      = EXCLUDED.description,
+    followers_count  = EXCLUDED.followers_count,
+    urlpinned        = EXCLUDED.urlpinned,
+    urlprofile       = EXCLUDED.urlprofile
+"""
+
+
+def _user_params(batch: ProfileBatch) -> dict:
+    """ProfileBatch -> {column: list} bind params for _UPSERT_USERS"""
+    return dict(zip(PROFILE_FIELDS, map(list, batch.columns())))
+
+
+def _upsert_users(profiles: list[Profile] | ProfileBatch) -> int:
     """Upsert a list of profiles into the xusers table."""
     if not profiles:
         return 0
 
-    rows = [asdict(p) for p in profiles]
-
-    sql = """
-    INSERT INTO xusers (
-        id, screen_name, name, description, followers_count, urlpinned, urlprofile
-    )
-    VALUES (:id, :screen_name, :name, :description, :followers_count, :urlpinned, :urlprofile)
-    ON CONFLICT (id) DO UPDATE SET
-        screen_name      = EXCLUDED.screen_name,
-        name             = EXCLUDED.name,
-        description      = EXCLUDED.description,
-        followers_count  = EXCLUDED.followers_count,
-        urlpinned        = EXCLUDED.urlpinned,
-        urlprofile       = EXCLUDED.urlprofile
-    """
-    conn = engine.connect()
-    conn.execute(text(sql), rows)
+    batch = ProfileBatch.from_profiles(profiles)
+    conn = get_engine().connect()
+    conn.execute(text(_UPSERT_USERS), _user_params(batch))
     conn.commit()
     conn.close()
-    print(f"Upserted {len(rows)} users")
-    return len(rows)
+    print(f"Upserted {len(batch)} users")
+    return len(batch)
+
+
+# keep xminhash signatures (src/minhash.py) in step with new edges.
+# None = only if the xminhash table exists (checked once per process),
+# True/False to force it.
+UPDATE_MINHASH: bool | None = None
+
+
+@cache
+def _has_table(name: str) -> bool:
+    conn = get_engine().connect()
+    found = conn.execute(text("SELECT to_regclass(:name) IS NOT NULL"), {"name": name}).scalar()
+    conn.close()
+    return bool(found)
+
+
+def _update_minhash() -> bool:
+    if UPDATE_MINHASH is None:
+        return _has_table("xminhash")
+    return UPDATE_MINHASH
 
 
-def upsert_branch(id: int, profiles: list[Profile]) -> tuple[int, int]:
+def upsert_branch(id: int, profiles: list[Profile] | ProfileBatch) -> tuple[int, int]:
     """Upserts a branch (existing root node -> new profiles + edges)
     Fails if the root id isn't already in the database."""
     # Automatically fails if the root profile isn't in xusers:
@@ -104,47 +178,181 @@ def upsert_branch(id: int, profiles: list[Profile]) -> tuple[int, int]:
     if not profiles:
         return (0, 0)
     # prepare data
-    profiles = [asdict(p) for p in profiles]
-    edges    = [{'source_id': id, 'target_id': p['id']} for p in profiles]
+    batch = ProfileBatch.from_profiles(profiles)
+    target_ids = list(batch.id)
     # prepare sql statements
-    sql1 = """
-    INSERT INTO xusers (
-        id, screen_name, name, description, followers_count, urlpinned, urlprofile
-    )
-    VALUES (:id, :screen_name, :name, :description, :followers_count, :urlpinned, :urlprofile)
-    ON CONFLICT (id) DO UPDATE SET
-        screen_name      = EXCLUDED.screen_name,
-        name             = EXCLUDED.name,
-        description      = EXCLUDED.description,
-        followers_count  = EXCLUDED.followers_count,
-        urlpinned        = EXCLUDED.urlpinned,
-        urlprofile       = EXCLUDED.urlprofile
-    """
     sql2 = """
     INSERT INTO xfollows (source_id, target_id)
-    VALUES (:source_id, :target_id)
+    SELECT :source_id, unnest(CAST(:target_ids AS INT8[]))
     ON CONFLICT DO NOTHING
     """
-    conn = engine.connect()
+    conn = get_engine().connect()
     trans = conn.begin()
     try:
-        conn.execute(text(sql1), profiles)
-        conn.execute(text(sql2), edges)
+        conn.execute(text(_UPSERT_USERS), _user_params(batch))
+        conn.execute(text(sql2), {"source_id": id, "target_ids": target_ids})
+        if _update_minhash():
+            # imported here, src.minhash imports this module
+            from src.minhash import update_signature
+            update_signature(conn, id, target_ids)
         trans.commit()
     except Exception as e:
         trans.rollback()
         raise e
     finally:
         conn.close()
-    return (len(profiles), len(edges))
+    return (len(batch), len(target_ids))
+
+
+#%% ========================================
+# write-behind graph writer
+# upsert_branch is one connection + one transaction per crawled root,
+# so crawling hundreds of small accounts is mostly commit latency.
+# GraphWriter buffers profiles and edges from many branches, dedupes
+# them in memory (last profile seen wins, edges are a set), and flushes
+# everything in one transaction once it holds max_edges edges or
+# max_seconds have passed: COPY into temp staging tables, then one
+# set-based merge per table.
+# Same guarantee as upsert_branch: an edge never lands unless its root
+# is in xusers (already, or upserted in the same flush). Branches whose
+# root is missing are set aside in .rejected ({root: targets}) and the
+# rest of the flush goes through, so one bad root can't wedge the buffer.
+
+class GraphWriter:
+
+    def __init__(self, max_edges: int = 50_000, max_seconds: float = 30.0):
+        self.max_edges = max_edges
+        self.max_seconds = max_seconds
+        self.profiles: dict[int, tuple] = {}
+        self.edges: dict[int, set[int]] = {}
+        self.nedges = 0
+        self.rejected: dict[int, set[int]] = {}
+        self.lock = threading.RLock()
+        self.t_flush = time.monotonic()
+        self.closed = False
+        self._stop = threading.Event()
+        self._timer = threading.Thread(target=self._tick, daemon=True)
+        self._timer.start()
+        atexit.register(self.close)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
 
+    def add_branch(self, id: int, profiles: list[Profile] | ProfileBatch) -> None:
+        """Buffers a branch (root -> profiles + edges). May trigger a flush."""
+        if self.closed:
+            raise RuntimeError("GraphWriter is closed")
+        batch = ProfileBatch.from_profiles(profiles)
+        with self.lock:
+            for row in zip(*batch.columns()):
+                self.profiles[row[0]] = row
+            targets = self.edges.setdefault(id, set())
+            before = len(targets)
+            targets.update(batch.id)
+            self.nedges += len(targets) - before
+            full = self.nedges >= self.max_edges
+        if full:
+            self.flush()
 
-def get_intersection(ids: list[int]) -> list[Profile]:
+    def _tick(self) -> None:
+        while not self._stop.wait(1.0):
+            if self.nedges and time.monotonic() - self.t_flush >= self.max_seconds:
+                try:
+                    self.flush()
+                except Exception as e:
+                    # keep the buffer, the next add/flush/close will retry and raise
+                    print(f"GraphWriter: background flush failed: {e}")
+
+    def flush(self) -> tuple[int, int]:
+        """Writes everything buffered so far. Returns (nprofiles, nedges)."""
+        with self.lock:
+            if not self.profiles and not self.edges:
+                self.t_flush = time.monotonic()
+                return (0, 0)
+            profiles = list(self.profiles.values())
+            edges = [(s, t) for s, ts in self.edges.items() for t in ts]
+            t0 = time.time()
+            conn = get_engine().connect()
+            trans = conn.begin()
+            try:
+                # COPY goes through the raw psycopg2 cursor but stays inside
+                # this connection's transaction
+                cur = conn.connection.cursor()
+                cur.execute("""
+                CREATE TEMP TABLE xusers_stage
+                    (LIKE xusers INCLUDING DEFAULTS) ON COMMIT DROP;
+                CREATE TEMP TABLE xfollows_stage
+                    (source_id INT8, target_id INT8) ON COMMIT DROP;
+                """)
+                cols = ", ".join(PROFILE_FIELDS)
+                cur.copy_expert(f"COPY xusers_stage ({cols}) FROM STDIN", copy_buffer(profiles))
+                cur.copy_expert("COPY xfollows_stage (source_id, target_id) FROM STDIN",
+                                copy_buffer(edges))
+                updates = ",\n    ".join(f"{c} = EXCLUDED.{c}" for c in PROFILE_FIELDS if c != "id")
+                cur.execute(f"""
+                INSERT INTO xusers ({cols})
+                SELECT {cols} FROM xusers_stage
+                ON CONFLICT (id) DO UPDATE SET
+                    {updates}
+                """)
+                cur.execute("""
+                SELECT DISTINCT s.source_id
+                FROM xfollows_stage s
+                LEFT JOIN xusers u ON u.id = s.source_id
+                WHERE u.id IS NULL
+                """)
+                missing = {r[0] for r in cur.fetchall()}
+                if missing:
+                    cur.execute("DELETE FROM xfollows_stage WHERE source_id = ANY(%s)",
+                                (list(missing),))
+                cur.execute("""
+                INSERT INTO xfollows (source_id, target_id)
+                SELECT source_id, target_id FROM xfollows_stage
+                ON CONFLICT DO NOTHING
+                """)
+                cur.close()
+                if _update_minhash():
+                    from src.minhash import update_signature
+                    for source_id, targets in self.edges.items():
+                        if source_id not in missing:
+                            update_signature(conn, source_id, list(targets))
+                trans.commit()
+            except Exception as e:
+                trans.rollback()
+                raise e
+            finally:
+                conn.close()
+            if missing:
+                for root in missing:
+                    self.rejected.setdefault(root, set()).update(self.edges[root])
+                edges = [e for e in edges if e[0] not in missing]
+                print(f"GraphWriter: {len(missing)} roots not in xusers, their edges "
+                      f"are in .rejected: {sorted(missing)[:10]}")
+            self.profiles.clear()
+            self.edges.clear()
+            self.nedges = 0
+            self.t_flush = time.monotonic()
+        print(f"GraphWriter: flushed {len(profiles)} users, {len(edges)} edges "
+              f"in {time.time() - t0:.2f}s")
+        return (len(profiles), len(edges))
+
+    def close(self) -> None:
+        """Stops the timer and flushes whatever is left. Safe to call twice."""
+        if self.closed:
+            return
+        self._stop.set()
+        self.flush()
+        self.closed = True
+        atexit.unregister(self.close)
+
+
+def _get_intersection_sql(uniq_ids: list[int], k: int) -> list[Profile]:
     # this fn was written by chatgpt <3
-    if not ids:
-        return []
-    # dedup while preserving order
-    uniq_ids = list(dict.fromkeys(int(i) for i in ids))
+    # (k is the "followed by at least k of n" threshold, k == n is the
+    # plain intersection)
     stmt = text("""
     with input_ids(source_id) as (
       select unnest(:source_ids)
@@ -154,7 +362,7 @@ def get_intersection(ids: list[int]) -> list[Profile]:
       from xfollows f
       join input_ids i on i.source_id = f.source_id
       group by f.target_id
-      having count(distinct f.source_id) = (select count(*) from input_ids)
+      having count(distinct f.source_id) >= :k
     )
     select
       u.id, u.screen_name, u.name, u.description,
@@ -162,16 +370,88 @@ def get_intersection(ids: list[int]) -> list[Profile]:
     from common_targets ct
     join xusers u on u.id = ct.target_id
     order by u.followers_count desc nulls last, u.screen_name
-    """).bindparams(bindparam("source_ids", type_=ARRAY(BIGINT)))
-    conn = engine.connect()
+    """).bindparams(sa.bindparam("source_ids", type_=sa.ARRAY(sa.BIGINT)))
+    conn = get_engine().connect()
     try:
-        rs = conn.execute(stmt, {"source_ids": uniq_ids})
+        rs = conn.execute(stmt, {"source_ids": uniq_ids, "k": k})
         rows = [dict(r._mapping) for r in rs]
     finally:
         conn.close()
     return [Profile(**row) for row in rows]
 
 
+def get_following_lists(ids: list[int]) -> dict[int, list[int]]:
+    """{source_id: sorted target ids} straight off the xfollows primary key.
+    Sources with no edges are left out."""
+    stmt = text("""
+    select source_id, array_agg(target_id order by target_id)
+    from xfollows
+    where source_id = any(:source_ids)
+    group by source_id
+    """).bindparams(sa.bindparam("source_ids", type_=sa.ARRAY(sa.BIGINT)))
+    conn = get_engine().connect()
+    try:
+        rows = conn.execute(stmt, {"source_ids": list(ids)}).fetchall()
+    finally:
+        conn.close()
+    return {row[0]: row[1] for row in rows}
+
+
+def get_users(ids: list[int]) -> list[Profile]:
+    """Hydrates xusers rows for ids, most followed first."""
+    if not ids:
+        return []
+    stmt = text("""
+    select
+      id, screen_name, name, description,
+      followers_count, urlpinned, urlprofile
+    from xusers
+    where id = any(:ids)
+    order by followers_count desc nulls last, screen_name
+    """).bindparams(sa.bindparam("ids", type_=sa.ARRAY(sa.BIGINT)))
+    conn = get_engine().connect()
+    try:
+        rows = [dict(r._mapping) for r in conn.execute(stmt, {"ids": list(ids)})]
+    finally:
+        conn.close()
+    return [Profile(**row) for row in rows]
+
+
+def get_intersection(ids: list[int], k: int | None = None,
+                     method: str = "lists", graph=None) -> list[Profile]:
+    """Profiles followed by every id in ids (or by at least k of them).
+    method="lists" pulls each source's sorted following list (or reads
+    it from `graph`, a CSRGraph snapshot) and intersects them in python,
+    smallest first, then hydrates only the survivors.
+    method="sql" is the original GROUP BY/HAVING query."""
+    if not ids:
+        return []
+    # dedup while preserving order
+    uniq_ids = list(dict.fromkeys(int(i) for i in ids))
+    k = len(uniq_ids) if k is None else k
+    if method == "sql":
+        return _get_intersection_sql(uniq_ids, k)
+    if method != "lists":
+        raise ValueError(f"unknown method {method!r}")
+
+    if graph is not None:
+        lists = {}
+        for id in uniq_ids:
+            try:
+                lists[id] = graph.following(id)
+            except KeyError:
+                pass
+    else:
+        lists = get_following_lists(uniq_ids)
+    # a source with no edges can't contribute, so fewer than k lists
+    # means nothing can be followed by k of them
+    if len(lists) < k:
+        return []
+    survivors = at_least_k(list(lists.values()), k)
+    # numpy ints (from a snapshot) don't adapt in psycopg2
+    return get_users([int(i) for i in survivors])
+
+
 #%% ========================================
 # this is necessary to seed the db with root node
 
@@ -184,7 +464,14 @@ jackalxhunt = Profile(
     urlpinned="",
     urlprofile="https://x.com/jackalxhunt",
 )
-print(f"Updating db with jackalxhunt root node...", end="")
-nupdated = _upsert_users([jackalxhunt])
-print(f"done!")
+
+
+def bootstrap() -> None:
+    """Explicit startup: connects and seeds the jackalxhunt root node.
+    Call this once before crawling, importing the module no longer does."""
+    print(f"Updating db with jackalxhunt root node...", end="")
+    _upsert_users([jackalxhunt])
+    print(f"done!")
+
+# bootstrap()
 
@@ -0,0 +1,286 @@
+#%% ========================================
+from __future__ import annotations
+import os
+import time
+import hashlib
+
+from src.db import get_engine, text, ident
+from src.lazy import lazy
+from src.ledger import ledger, cost
+
+np = lazy("numpy")
+
+# Embedding store + nearest neighbours for the cmcnotes reports.
+# "which coins are most like this one?"
+#
+# Layout, per (column, model, dim), under local/embed/:
+#   <name>.f32    float32[capacity, dim] memmap, row i = cmcnotes.id i
+#   <name>.hash   uint64[capacity] memmap, blake2b of the text row i was
+#                 embedded from (0 = nothing embedded)
+# Rows are indexed by the coin id itself, so lookups are O(1) and there's
+# no id <-> row mapping to keep in sync. cmc ids are dense enough (tens of
+# thousands) that the holes cost less than the bookkeeping would. The
+# files grow (x1.5) when a bigger id shows up.
+# Vectors are stored unit-normalized, so cosine similarity is one matmul.
+#
+# refresh() hashes every non-null report, and only sends the ones whose
+# hash changed (new, or re-hydrated) to the embeddings endpoint, in bulk
+# requests of at most `batch` texts and `max_tokens` (estimated) tokens,
+# since the endpoint also caps the total tokens per request. The hash file is the cache: re-running is
+# free unless the text moved.
+#
+# topk() is brute force (chunked matmul + argpartition), which is plenty
+# for ~10k coins. IVFIndex adds a k-means partition on top (probe the
+# `nprobe` nearest of ~sqrt(n) cells) for sub-linear lookups once the
+# store is big or queries are many.
+
+EMBED_DIR = "local/embed"
+MODEL = "text-embedding-3-small"
+DIM = 512           # text-embedding-3 can shorten vectors, 512 keeps ~all the quality
+MAX_CHARS = 24_000  # ~6k tokens, the endpoint caps inputs at 8191 tokens
+MAX_REQUEST_TOKENS = 250_000    # the endpoint caps a whole request at 300k tokens
+
+
+def estimate_tokens(s: str) -> int:
+    """tokens a text will cost once cut to MAX_CHARS, on the high side
+    (~4 chars/token for english, assume 3)"""
+    return min(len(s), MAX_CHARS) // 3 + 1
+
+
+def text_hash(s: str) -> int:
+    """nonzero uint64 content hash (0 means 'not embedded')"""
+    h = int.from_bytes(hashlib.blake2b(s.encode(), digest_size=8).digest(), "little")
+    return h or 1
+
+
+class EmbeddingStore:
+
+    def __init__(self, column: str = "webprint_gpt5mini", model: str = MODEL,
+                 dim: int = DIM, root: str = EMBED_DIR, table: str = "cmcnotes"):
+        self.column = ident(column)
+        self.table = ident(table)
+        self.model = model
+        self.dim = dim
+        self.root = root
+        name = f"{column}.{model}.{dim}"
+        self.path_vecs = os.path.join(root, f"{name}.f32")
+        self.path_hash = os.path.join(root, f"{name}.hash")
+        self.vecs: np.memmap | None = None
+        self.hashes: np.memmap | None = None
+        self._open()
+
+    def __repr__(self) -> str:
+        return (f"EmbeddingStore({self.column!r}, {self.model}, dim={self.dim}, "
+                f"embedded={len(self.ids())}, capacity={self.capacity})")
+
+    @property
+    def capacity(self) -> int:
+        return 0 if self.hashes is None else len(self.hashes)
+
+    def _open(self) -> None:
+        if not os.path.exists(self.path_hash):
+            return
+        n = os.path.getsize(self.path_hash) // 8
+        self.hashes = np.memmap(self.path_hash, dtype=np.uint64, mode="r+", shape=(n,))
+        self.vecs = np.memmap(self.path_vecs, dtype=np.float32, mode="r+", shape=(n, self.dim))
+
+    def _grow(self, max_id: int) -> None:
+        """Makes sure row max_id exists (files grow by 1.5x, zero-filled)."""
+        if max_id < self.capacity:
+            return
+        n = max(max_id + 1, int(self.capacity * 1.5), 1024)
+        os.makedirs(self.root, exist_ok=True)
+        for path, width in ((self.path_hash, 8), (self.path_vecs, 4 * self.dim)):
+            with open(path, "ab") as f:
+                f.truncate(n * width)
+        self.vecs = self.hashes = None
+        self._open()
+
+    def ids(self) -> np.ndarray:
+        """ids that have a vector"""
+        if self.hashes is None:
+            return np.empty(0, dtype=np.int64)
+        return np.flatnonzero(self.hashes)
+
+    def vector(self, id: int) -> np.ndarray:
+        if id >= self.capacity or not self.hashes[id]:
+            raise KeyError(f"{self.column}: no embedding for id {id}")
+        return np.array(self.vecs[id])
+
+    # ---- embedding
+
+    def _texts(self) -> list[tuple[int, str]]:
+        sql = f"""
+        SELECT id, {self.column}
+        FROM {self.table}
+        WHERE {self.column} IS NOT NULL
+        ORDER BY id
+        """
+        conn = get_engine().connect()
+        rows = conn.execute(text(sql)).fetchall()
+        conn.close()
+        return [(r[0], r[1]) for r in rows]
+
+    def embed(self, texts: list[str]) -> np.ndarray:
+        """float32[len(texts), dim], unit-normalized. One request."""
+        from src.api_chatbot import get_client
+        t0 = time.time()
+        resp = get_client().embeddings.create(model=self.model, dimensions=self.dim,
+                                              input=[t[:MAX_CHARS] for t in texts])
+        ntokens = resp.usage.prompt_tokens
+        ledger.record(model=self.model, tier="default", ntokens_in=ntokens, ntokens_cached=0,
+                      ntokens_out=0, nwebcalls=0, latency=time.time() - t0,
+                      cost=cost(self.model, "default", ntokens_in=ntokens), cache_hit=False)
+        m = np.array([d.embedding for d in sorted(resp.data, key=lambda d: d.index)],
+                     dtype=np.float32)
+        m /= np.maximum(np.linalg.norm(m, axis=1, keepdims=True), 1e-12)
+        return m
+
+    @staticmethod
+    def _batches(todo: list, batch: int, max_tokens: int):
+        """todo split into requests of <= batch texts and <= max_tokens"""
+        chunk, ntokens = [], 0
+        for item in todo:
+            n = estimate_tokens(item[1])
+            if chunk and (len(chunk) >= batch or ntokens + n > max_tokens):
+                yield chunk
+                chunk, ntokens = [], 0
+            chunk.append(item)
+            ntokens += n
+        if chunk:
+            yield chunk
+
+    def refresh(self, batch: int = 256, max_tokens: int = MAX_REQUEST_TOKENS) -> int:
+        """Embeds every row whose text is new or changed. Returns how many."""
+        rows = self._texts()
+        if not rows:
+            return 0
+        self._grow(max(id for id, _ in rows))
+        todo = [(id, s, h) for id, s in rows
+                if self.hashes[id] != (h := np.uint64(text_hash(s)))]
+        print(f"{self.column}: {len(todo)}/{len(rows)} rows to embed")
+        t0 = time.time()
+        ndone = 0
+        for chunk in self._batches(todo, batch, max_tokens):
+            m = self.embed([s for _, s, _ in chunk])
+            ids = np.array([id for id, _, _ in chunk])
+            self.vecs[ids] = m
+            # hashes last: a crash mid-batch just re-embeds that batch
+            self.vecs.flush()
+            self.hashes[ids] = np.array([h for _, _, h in chunk], dtype=np.uint64)
+            self.hashes.flush()
+            ndone += len(chunk)
+            print(f"\r{self.column}: embedded {ndone}/{len(todo)}", end="", flush=True)
+        # rows that went NULL (or were deleted) drop out of the index
+        live = np.zeros(self.capacity, dtype=bool)
+        live[[id for id, _ in rows]] = True
+        stale = np.flatnonzero(~live & (self.hashes != 0))
+        if len(stale):
+            self.hashes[stale] = 0
+            self.hashes.flush()
+        if todo:
+            print(f"\n{self.column}: done in {time.time() - t0:.1f}s")
+        return len(todo)
+
+    # ---- queries
+
+    def topk(self, q: np.ndarray, k: int = 10, exclude: int | None = None,
+             chunk: int = 65_536) -> list[tuple[int, float]]:
+        """k most similar ids to the (unit) query vector: [(id, cosine), ...]"""
+        ids = self.ids()
+        if exclude is not None:
+            ids = ids[ids != exclude]
+        if not len(ids):
+            return []
+        q = np.asarray(q, dtype=np.float32)
+        scores = np.empty(len(ids), dtype=np.float32)
+        for i in range(0, len(ids), chunk):
+            scores[i:i + chunk] = self.vecs[ids[i:i + chunk]] @ q
+        k = min(k, len(ids))
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return [(int(ids[i]), float(scores[i])) for i in top]
+
+    def similar(self, id: int, k: int = 10) -> list[tuple[int, float]]:
+        """coins most like coin `id`"""
+        return self.topk(self.vector(id), k, exclude=id)
+
+    def query(self, s: str, k: int = 10) -> list[tuple[int, float]]:
+        """coins most like a free text description"""
+        return self.topk(self.embed([s])[0], k)
+
+
+#%% ========================================
+
+class IVFIndex:
+    """Inverted file index: spherical k-means cells over the store's
+    vectors, lists stored CSR style (order + offsets). A query scores the
+    centroids, then only the vectors in the `nprobe` best cells."""
+
+    def __init__(self, store: EmbeddingStore, nlist: int | None = None,
+                 iters: int = 20, seed: int = 0):
+        self.store = store
+        ids = store.ids()
+        if not len(ids):
+            raise ValueError(f"{store.column}: nothing embedded yet, run store.refresh() first")
+        x = np.asarray(store.vecs[ids])
+        nlist = nlist or max(1, int(np.sqrt(len(ids))))
+        rng = np.random.default_rng(seed)
+        c = x[rng.choice(len(x), size=min(nlist, len(x)), replace=False)].copy()
+        for _ in range(iters):
+            assign = np.argmax(x @ c.T, axis=1)
+            sums = np.zeros_like(c)
+            np.add.at(sums, assign, x)
+            empty = ~sums.any(axis=1)
+            # empty cells get re-seeded from random points
+            sums[empty] = x[rng.choice(len(x), size=int(empty.sum()))]
+            c = sums / np.maximum(np.linalg.norm(sums, axis=1, keepdims=True), 1e-12)
+        assign = np.argmax(x @ c.T, axis=1)
+        order = np.argsort(assign, kind="stable")
+        self.centroids = c.astype(np.float32)
+        self.ids = ids[order]
+        self.vecs = x[order]
+        self.offsets = np.concatenate([[0], np.cumsum(np.bincount(assign, minlength=len(c)))])
+
+    def __repr__(self) -> str:
+        sizes = np.diff(self.offsets)
+        return f"IVFIndex(n={len(self.ids)}, nlist={len(self.centroids)}, max_cell={sizes.max()})"
+
+    def topk(self, q: np.ndarray, k: int = 10, nprobe: int = 8,
+             exclude: int | None = None) -> list[tuple[int, float]]:
+        q = np.asarray(q, dtype=np.float32)
+        nprobe = min(nprobe, len(self.centroids))
+        cells = np.argpartition(-(self.centroids @ q), nprobe - 1)[:nprobe]
+        rows = np.concatenate([np.arange(self.offsets[c], self.offsets[c + 1]) for c in cells])
+        if exclude is not None:
+            rows = rows[self.ids[rows] != exclude]
+        if not len(rows):
+            return []
+        scores = self.vecs[rows] @ q
+        k = min(k, len(rows))
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return [(int(self.ids[rows[i]]), float(scores[i])) for i in top]
+
+    def similar(self, id: int, k: int = 10, nprobe: int = 8) -> list[tuple[int, float]]:
+        return self.topk(self.store.vector(id), k, nprobe, exclude=id)
+
+
+def names(ids) -> dict[int, str]:
+    """{id: name} for printing results"""
+    sql = "SELECT id, name FROM cmcnotes WHERE id = ANY(:ids)"
+    conn = get_engine().connect()
+    rows = conn.execute(text(sql), {"ids": [int(i) for i in ids]}).fetchall()
+    conn.close()
+    return {r[0]: r[1] for r in rows}
+
+
+#%% ========================================
+# usage:
+# store = EmbeddingStore("webprint_gpt5mini")
+# store.refresh()                          # only new/changed reports
+# hits = store.similar(1027, k=10)         # ethereum
+# n = names(i for i, _ in hits)
+# for i, s in hits: print(f"{s:.3f} {n[i]}")
+# ivf = IVFIndex(store)                    # once the store gets big
+# ivf.similar(1027, k=10, nprobe=8)
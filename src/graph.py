@@ -0,0 +1,227 @@
+#%% ========================================
+from __future__ import annotations
+import io
+import os
+import json
+import time
+import shutil
+
+from src.db import get_engine
+from src.lazy import lazy
+
+np = lazy("numpy")
+
+# In-memory snapshot of the xfollows DiGraph.
+# Every neighborhood question against postgres is an index scan + a
+# network round trip. Instead we dump xfollows once into a compressed
+# sparse row (CSR) layout:
+#   ids          int64[n]     sorted xusers ids, index i <-> ids[i]
+#   out_offsets  int64[n+1]   out-edges of i are out_targets[out_offsets[i]:out_offsets[i+1]]
+#   out_targets  int32[m]     (sorted within each row)
+#   in_offsets   int64[n+1]   same thing for in-edges (followers)
+#   in_targets   int32[m]
+# Each array is saved as its own .npy file so it can be np.load'ed with
+# mmap_mode='r'. Loading is then instant and several analysis processes
+# share the same pages through the OS page cache.
+# Snapshots are versioned: local/xgraph/v<ns>/ holds one complete set of
+# arrays and local/xgraph/current is a symlink to the newest one.
+
+SNAPSHOT_DIR = "local/xgraph"
+_ARRAYS = ("ids", "out_offsets", "out_targets", "in_offsets", "in_targets")
+
+
+#%% ========================================
+
+def _copy_out(sql: str) -> io.StringIO:
+    """Runs COPY (sql) TO STDOUT and returns the csv text."""
+    buf = io.StringIO()
+    conn = get_engine().raw_connection()
+    try:
+        cur = conn.cursor()
+        cur.copy_expert(f"COPY ({sql}) TO STDOUT WITH (FORMAT csv)", buf)
+        cur.close()
+    finally:
+        conn.close()
+    buf.seek(0)
+    return buf
+
+
+def _fetch_edges() -> tuple[np.ndarray, np.ndarray]:
+    import pandas as pd
+    buf = _copy_out("SELECT source_id, target_id FROM xfollows")
+    df = pd.read_csv(buf, header=None, names=["s", "t"], dtype=np.int64)
+    return df["s"].to_numpy(), df["t"].to_numpy()
+
+
+def _fetch_node_ids() -> np.ndarray:
+    import pandas as pd
+    buf = _copy_out("SELECT id FROM xusers")
+    return pd.read_csv(buf, header=None, names=["id"], dtype=np.int64)["id"].to_numpy()
+
+
+def _csr(rows: np.ndarray, cols: np.ndarray, n: int) -> tuple[np.ndarray, np.ndarray]:
+    """(row, col) index pairs -> (offsets, targets), cols sorted within each row"""
+    order = np.lexsort((cols, rows))
+    offsets = np.zeros(n + 1, dtype=np.int64)
+    np.cumsum(np.bincount(rows, minlength=n), out=offsets[1:])
+    return offsets, cols[order].astype(np.int32)
+
+
+#%% ========================================
+
+class CSRGraph:
+    """Out/in adjacency of xfollows in CSR form. Lookups take xusers ids."""
+
+    def __init__(self, ids, out_offsets, out_targets, in_offsets, in_targets, meta=None):
+        self.ids = ids
+        self.out_offsets = out_offsets
+        self.out_targets = out_targets
+        self.in_offsets = in_offsets
+        self.in_targets = in_targets
+        self.meta = meta or {}
+
+    @property
+    def n(self) -> int:
+        return len(self.ids)
+
+    @property
+    def m(self) -> int:
+        return len(self.out_targets)
+
+    def __repr__(self) -> str:
+        return f"CSRGraph(n={self.n}, m={self.m})"
+
+    # ---- id <-> index
+
+    def index(self, id: int) -> int:
+        """xusers id -> row index, KeyError if the id isn't in the snapshot"""
+        i = int(np.searchsorted(self.ids, id))
+        if i >= self.n or self.ids[i] != id:
+            raise KeyError(id)
+        return i
+
+    def indices(self, ids) -> np.ndarray:
+        """vectorized index(); unknown ids come back as -1"""
+        ids = np.asarray(ids, dtype=np.int64)
+        if self.n == 0:
+            # nothing to look up in; self.ids[n - 1] would be out of range
+            return np.full(ids.shape, -1, dtype=np.int64)
+        i = np.searchsorted(self.ids, ids)
+        i = np.minimum(i, self.n - 1)
+        return np.where(self.ids[i] == ids, i, -1)
+
+    # ---- lookups by row index
+
+    def out_idx(self, i: int) -> np.ndarray:
+        return self.out_targets[self.out_offsets[i]:self.out_offsets[i + 1]]
+
+    def in_idx(self, i: int) -> np.ndarray:
+        return self.in_targets[self.in_offsets[i]:self.in_offsets[i + 1]]
+
+    # ---- lookups by xusers id
+
+    def following(self, id: int) -> np.ndarray:
+        """ids that `id` follows (out-neighbors)"""
+        return self.ids[self.out_idx(self.index(id))]
+
+    def followers(self, id: int) -> np.ndarray:
+        """ids that follow `id` (in-neighbors), only as far as we've crawled"""
+        return self.ids[self.in_idx(self.index(id))]
+
+    def out_degree(self, id: int) -> int:
+        i = self.index(id)
+        return int(self.out_offsets[i + 1] - self.out_offsets[i])
+
+    def in_degree(self, id: int) -> int:
+        i = self.index(id)
+        return int(self.in_offsets[i + 1] - self.in_offsets[i])
+
+    def out_degrees(self) -> np.ndarray:
+        return np.diff(self.out_offsets)
+
+    def in_degrees(self) -> np.ndarray:
+        return np.diff(self.in_offsets)
+
+    # ---- persistence
+
+    def save(self, path: str = SNAPSHOT_DIR, keep: int = 2) -> str:
+        """Writes the arrays (+ meta.json) into a fresh version directory
+        <path>/v<timestamp>/, then repoints the <path>/current symlink at
+        it. The symlink swap is a single rename, so a reader sees either
+        the whole old snapshot or the whole new one, never a mix. Keeps
+        the `keep` newest versions (already mmap'ed ones stay readable
+        until closed). Returns the version directory."""
+        os.makedirs(path, exist_ok=True)
+        version = f"v{time.time_ns()}"
+        vdir = os.path.join(path, version)
+        os.makedirs(vdir)
+        for name in _ARRAYS:
+            np.save(os.path.join(vdir, f"{name}.npy"), np.ascontiguousarray(getattr(self, name)))
+        with open(os.path.join(vdir, "meta.json"), "w") as f:
+            json.dump({**self.meta, "n": self.n, "m": self.m}, f)
+        link = os.path.join(path, "current")
+        tmp = os.path.join(path, f"current.{version}.tmp")
+        os.symlink(version, tmp)
+        os.replace(tmp, link)
+        old = sorted(d for d in os.listdir(path) if d.startswith("v") and d != version)
+        for d in old[:max(0, len(old) - (keep - 1))]:
+            shutil.rmtree(os.path.join(path, d), ignore_errors=True)
+        print(f"Saved {self} to {vdir}")
+        return vdir
+
+    @classmethod
+    def load(cls, path: str = SNAPSHOT_DIR, mmap: bool = True) -> "CSRGraph":
+        """Memory-maps a saved snapshot (read only). `path` is the snapshot
+        root (follows <path>/current) or a version directory."""
+        current = os.path.join(path, "current")
+        if os.path.exists(current):
+            # resolve once, so every array comes from the same version
+            path = os.path.realpath(current)
+        mode = "r" if mmap else None
+        arrays = {name: np.load(os.path.join(path, f"{name}.npy"), mmap_mode=mode)
+                  for name in _ARRAYS}
+        meta = {}
+        if os.path.exists(os.path.join(path, "meta.json")):
+            with open(os.path.join(path, "meta.json")) as f:
+                meta = json.load(f)
+        return cls(**arrays, meta=meta)
+
+    @classmethod
+    def from_edges(cls, sources: np.ndarray, targets: np.ndarray,
+                   node_ids: np.ndarray | None = None, meta=None) -> "CSRGraph":
+        """Builds the snapshot from parallel arrays of xusers ids."""
+        sources = np.asarray(sources, dtype=np.int64)
+        targets = np.asarray(targets, dtype=np.int64)
+        parts = [sources, targets]
+        if node_ids is not None:
+            parts.append(np.asarray(node_ids, dtype=np.int64))
+        ids = np.unique(np.concatenate(parts))
+        n = len(ids)
+        s = np.searchsorted(ids, sources)
+        t = np.searchsorted(ids, targets)
+        out_offsets, out_targets = _csr(s, t, n)
+        in_offsets, in_targets = _csr(t, s, n)
+        return cls(ids, out_offsets, out_targets, in_offsets, in_targets, meta=meta)
+
+
+def build_snapshot(path: str | None = SNAPSHOT_DIR) -> CSRGraph:
+    """Exports xusers/xfollows into a CSRGraph and (optionally) saves it."""
+    t0 = time.time()
+    sources, targets = _fetch_edges()
+    node_ids = _fetch_node_ids()
+    t1 = time.time()
+    g = CSRGraph.from_edges(sources, targets, node_ids, meta={"built_at": time.time()})
+    t2 = time.time()
+    print(f"Built {g}: fetch {t1 - t0:.2f}s, build {t2 - t1:.2f}s")
+    if path:
+        g.save(path)
+    return g
+
+
+#%% ========================================
+# usage:
+
+# g = build_snapshot()
+# g = CSRGraph.load()
+# g.following(1967223627314757632)
+# g.in_degree(1967223627314757632)
@@ -0,0 +1,217 @@
+#%% ========================================
+import time
+import random
+import asyncio
+import contextvars
+from dataclasses import dataclass, field
+from typing import Callable, Awaitable
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from src.db import get_engine, text, ident
+from src.writeback import WriteBack
+from src.limiter import Limiter
+from src import ledger
+
+# Declarative column hydrators.
+# Every hydrate_* loop in shrine.py was the same thing: select rows
+# where <column> IS NULL (and its inputs are NOT NULL), build a prompt
+# per row, call a model, write the answer back into <column>. A Hydrator
+# is just that spec; run() takes care of the rest:
+#   - bounded concurrency: `workers` threads around a blocking `model`,
+#     or arun() with an async `amodel` (e.g. agpt5) and up to
+#     `concurrency` requests in flight on one event loop
+#   - retries with exponential backoff + jitter per row
+#   - or, with a `limiter` (src/limiter.py), adaptive concurrency (AIMD
+#     on 429s/latency) under the model's rpm/tpm budget; `workers` and
+#     `concurrency` are then just ceilings
+#   - progress/throughput reporting, and every model call it makes is
+#     tagged with a ledger run (src/ledger.py), so stats include p50/p95
+#     latency, total cost and $/row
+#   - batched write-back: workers hand results to a WriteBack buffer
+#     that flushes one set-based UPDATE every `flush_every` results or
+#     `flush_seconds` seconds (see src/writeback.py)
+# Failed rows are left NULL, so the next run() picks them up again.
+# A failed db write is not a failed row: the model answer stays in the
+# WriteBack buffer and the write is retried (stats "write_errors").
+#
+# example:
+#   Hydrator(column="webprint_distill1s",
+#            depends=("webprint_gpt5mini",),
+#            prompt=lambda row: f"... {row['webprint_gpt5mini']}",
+#            model=gpt5).run(limit=500)
+
+@dataclass
+class Hydrator:
+    column:        str                      # target column, filled when NULL
+    prompt:        Callable[[dict], str]    # row -> prompt
+    model:         Callable[[str], str]     # prompt -> response text
+    depends:       tuple[str, ...] = ()     # columns that must be NOT NULL
+    table:         str = "cmcnotes"
+    key:           str = "id"
+    order_by:      str = "rank ASC"
+    workers:       int = 10
+    amodel:        Callable[[str], Awaitable[str]] | None = None
+    concurrency:   int = 200
+    retries:       int = 3
+    flush_every:   int = 50
+    flush_seconds: float = 5.0
+    limiter:       Limiter | None = None
+    stats:         dict = field(default_factory=dict)
+
+    def __post_init__(self):
+        for name in (self.column, self.table, self.key, *self.depends):
+            ident(name)
+
+    def ensure_column(self, sqltype: str = "TEXT") -> None:
+        """Adds the target column if it doesn't exist yet."""
+        sql = f"ALTER TABLE {self.table} ADD COLUMN IF NOT EXISTS {self.column} {sqltype}"
+        conn = get_engine().connect()
+        conn.execute(text(sql))
+        conn.commit()
+        conn.close()
+
+    def pending(self, limit: int | None = None) -> list[dict]:
+        """Rows still missing `column` whose dependencies are all filled."""
+        where = [f"{self.column} IS NULL"] + [f"{d} IS NOT NULL" for d in self.depends]
+        sql = f"""
+        SELECT *
+        FROM {self.table}
+        WHERE {' AND '.join(where)}
+        ORDER BY {self.order_by}
+        """
+        if limit is not None:
+            sql += f"\nLIMIT {int(limit)}"
+        conn = get_engine().connect()
+        rows = conn.execute(text(sql)).mappings().fetchall()
+        conn.close()
+        return [dict(r) for r in rows]
+
+    def writeback(self) -> WriteBack:
+        return WriteBack(self.table, self.column, key=self.key,
+                         every=self.flush_every, seconds=self.flush_seconds)
+
+    def _call(self, row: dict) -> str:
+        """prompt + model call for one row, retried with backoff"""
+        prompt = self.prompt(row)
+        if self.limiter is not None:
+            return self.limiter.call(self.model, prompt)
+        for attempt in range(self.retries + 1):
+            try:
+                return self.model(prompt)
+            except Exception as e:
+                if attempt == self.retries:
+                    raise e
+                wait = 2 ** attempt + random.random()
+                print(f"\n{self.column}: row {row[self.key]} failed ({e!r}), retry in {wait:.1f}s")
+                time.sleep(wait)
+
+    def _report(self, done: int, total: int, written: int, failed: int, t0: float) -> None:
+        dt = time.time() - t0
+        rate = done / dt if dt else 0.0
+        eta = (total - done) / rate if rate else 0.0
+        print(f"\r{self.column}: {done}/{total} done, {written} written, "
+              f"{failed} failed, {rate:.2f} rows/s, eta {eta:.0f}s", end="", flush=True)
+
+    def _finish(self, total: int, written: int, failed: int, wb_errors: int,
+                t0: float, run_id: str) -> dict:
+        dt = time.time() - t0
+        usage = ledger.ledger.summary(run_id)
+        self.stats = {"column": self.column, "run": run_id, "rows": total,
+                      "written": written, "failed": failed, "write_errors": wb_errors,
+                      "elapsed": dt,
+                      "rows_per_s": total / dt if dt else 0.0,
+                      "p50_latency": usage.get("p50_latency", 0.0),
+                      "p95_latency": usage.get("p95_latency", 0.0),
+                      "cached_share": usage.get("cached_share", 0.0),
+                      "cost": usage.get("cost", 0.0),
+                      "cost_per_row": usage.get("cost", 0.0) / written if written else 0.0}
+        if self.limiter is not None:
+            self.stats["limiter"] = repr(self.limiter)
+        print(f"\n{self.column}: done! {written}/{total} written, {failed} failed in {dt:.2f}s, "
+              f"${self.stats['cost']:.4f} (${self.stats['cost_per_row']:.5f}/row)")
+        return self.stats
+
+    def run(self, limit: int | None = None, rows: list[dict] | None = None) -> dict:
+        """Hydrates up to `limit` pending rows (or the given rows). Returns stats."""
+        rows = self.pending(limit) if rows is None else rows
+        total = len(rows)
+        print(f"{self.column}: {total} rows to hydrate with {self.workers} workers")
+        t0 = time.time()
+        done = failed = 0
+        wb = self.writeback()
+
+        def work(row: dict) -> None:
+            # results go straight from the worker into the buffer. Only the
+            # model call can fail the row, a failed flush keeps the batch
+            # buffered for the next one
+            if wb.add(row[self.key], self._call(row), flush=False):
+                wb.try_flush()
+
+        with ledger.run(self.column) as run_id, ThreadPoolExecutor(max_workers=self.workers) as ex:
+            # each worker call carries the ledger run tag
+            futures = {ex.submit(contextvars.copy_context().run, work, row): row for row in rows}
+            for fut in as_completed(futures):
+                row = futures[fut]
+                done += 1
+                try:
+                    fut.result()
+                except Exception as e:
+                    failed += 1
+                    print(f"\n{self.column}: giving up on row {row[self.key]}: {e!r}")
+                self._report(done, total, wb.written, failed, t0)
+        written = wb.close()
+        return self._finish(total, written, failed, wb.errors, t0, run_id)
+
+    async def _acall(self, row: dict) -> str:
+        """async _call"""
+        prompt = self.prompt(row)
+        if self.limiter is not None:
+            return await self.limiter.acall(self.amodel, prompt)
+        for attempt in range(self.retries + 1):
+            try:
+                return await self.amodel(prompt)
+            except Exception as e:
+                if attempt == self.retries:
+                    raise e
+                wait = 2 ** attempt + random.random()
+                print(f"\n{self.column}: row {row[self.key]} failed ({e!r}), retry in {wait:.1f}s")
+                await asyncio.sleep(wait)
+
+    async def arun(self, limit: int | None = None, rows: list[dict] | None = None) -> dict:
+        """run() on asyncio: up to `concurrency` amodel calls in flight.
+        In ipython/jupyter: `await h.arun()`, in a script: asyncio.run(h.arun())"""
+        if self.amodel is None:
+            raise ValueError(f"{self.column}: arun() needs an async amodel")
+        if rows is None:
+            rows = await asyncio.to_thread(self.pending, limit)
+        total = len(rows)
+        print(f"{self.column}: {total} rows to hydrate, {self.concurrency} in flight")
+        t0 = time.time()
+        done = failed = 0
+        wb = self.writeback()
+        sem = asyncio.Semaphore(self.concurrency)
+
+        async def work(row: dict) -> None:
+            async with sem:
+                try:
+                    value = await self._acall(row)
+                except Exception as e:
+                    print(f"\n{self.column}: giving up on row {row[self.key]}: {e!r}")
+                    raise e
+            # db writes happen off the event loop (and don't fail the row)
+            if wb.add(row[self.key], value, flush=False):
+                await asyncio.to_thread(wb.try_flush)
+
+        with ledger.run(self.column) as run_id:
+            # tasks inherit the ledger run tag from this context
+            tasks = {asyncio.ensure_future(work(row)): row for row in rows}
+        for fut in asyncio.as_completed(list(tasks)):
+            done += 1
+            try:
+                await fut
+            except Exception:
+                failed += 1
+            self._report(done, total, wb.written, failed, t0)
+        written = await asyncio.to_thread(wb.close)
+        return await asyncio.to_thread(self._finish, total, written, failed, wb.errors,
+                                       t0, run_id)
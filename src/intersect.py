@@ -0,0 +1,66 @@
+#%% ========================================
+from bisect import bisect_left
+
+# Sorted-set intersection helpers for get_intersection.
+# Everything here works on sorted, duplicate free sequences of ids
+# (following lists come out of the xfollows primary key in order).
+# Intersections run smallest list first, so the running result only
+# ever shrinks, and each probe into the bigger list gallops forward
+# from where the previous probe landed: O(s log(l/s)) instead of O(s + l).
+
+
+def _gallop(a, x, lo: int) -> int:
+    """First index >= lo with a[index] >= x (exponential then binary search)"""
+    n = len(a)
+    step = 1
+    hi = lo
+    while hi < n and a[hi] < x:
+        lo = hi + 1
+        hi += step
+        step <<= 1
+    return bisect_left(a, x, lo, min(hi, n))
+
+
+def gallop_intersect(small, large) -> list:
+    """Intersection of two sorted sequences, probing `large` by galloping."""
+    if len(small) > len(large):
+        small, large = large, small
+    out = []
+    j = 0
+    n = len(large)
+    for x in small:
+        j = _gallop(large, x, j)
+        if j >= n:
+            break
+        if large[j] == x:
+            out.append(x)
+            j += 1
+    return out
+
+
+def intersect_all(lists: list) -> list:
+    """Intersection of many sorted sequences, smallest first."""
+    if not lists:
+        return []
+    lists = sorted(lists, key=len)
+    result = list(lists[0])
+    for other in lists[1:]:
+        if not result:
+            break
+        result = gallop_intersect(result, other)
+    return result
+
+
+def at_least_k(lists: list, k: int) -> list:
+    """Ids that show up in at least k of the sorted, duplicate free lists."""
+    if k <= 0:
+        raise ValueError("k must be >= 1")
+    if k > len(lists):
+        return []
+    if k == len(lists):
+        return intersect_all(lists)
+    # each list is a set, so counting occurrences counts sources
+    import numpy as np
+    allids = np.concatenate([np.asarray(l, dtype=np.int64) for l in lists])
+    ids, counts = np.unique(allids, return_counts=True)
+    return ids[counts >= k].tolist()
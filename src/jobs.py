@@ -0,0 +1,225 @@
+#%% ========================================
+from __future__ import annotations
+import os
+import json
+import time
+import glob
+import random
+from typing import Callable, Iterator
+from concurrent.futures import ThreadPoolExecutor
+
+from src.api_chatbot import get_client, record_response
+
+# Background-response job manager (o3, deep research).
+# o3_background/o3_deep_research used to create one background response
+# and then sleep-poll it, holding the caller for the whole run (deep
+# research takes 5-30 min). JobManager splits that up:
+#   submit()  creates the background response and saves the job under
+#             local/jobs/<id>.json right away
+#   watch()   one loop polls every outstanding job, each on its own
+#             backoff schedule (min_wait, growing x1.5 up to max_wait,
+#             jittered), retrieves due jobs in parallel, and yields
+#             them as they finish
+#   run(cb)   same, but hands each finished job to a callback
+# A job whose retrieve fails `max_errors` times in a row is given up on
+# (status "error", wait() raises) instead of being polled forever.
+# A job is only marked delivered after it's been yielded/handled, so
+# after a crash or restart a new JobManager picks up exactly where the
+# old one left off: open jobs get polled again and finished but
+# undelivered ones get delivered again.
+
+JOBS_DIR = "local/jobs"
+OPEN = {"queued", "in_progress"}
+
+BACKGROUND = {
+    "o3": dict(
+        model="o3",
+        background=True,
+    ),
+    "o3_deep_research": dict(
+        model="o3-deep-research",
+        background=True,
+        tools=[{"type": "web_search"}],
+    ),
+}
+
+
+class JobManager:
+
+    def __init__(self, root: str = JOBS_DIR, base_url: str | None = None,
+                 min_wait: float = 10.0, max_wait: float = 300.0, workers: int = 16,
+                 max_errors: int = 5):
+        self.root = root
+        self.base_url = base_url
+        self.min_wait = min_wait
+        self.max_wait = max_wait
+        self.workers = workers
+        self.max_errors = max_errors
+
+    def __repr__(self) -> str:
+        jobs = self.jobs()
+        n_open = sum(j["status"] in OPEN for j in jobs)
+        return f"JobManager({self.root!r}, jobs={len(jobs)}, open={n_open})"
+
+    @property
+    def client(self):
+        return get_client(self.base_url)
+
+    def _path(self, job_id: str) -> str:
+        return os.path.join(self.root, f"{job_id}.json")
+
+    def _save(self, job: dict) -> None:
+        os.makedirs(self.root, exist_ok=True)
+        tmp = self._path(job["id"]) + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(job, f, ensure_ascii=False)
+        os.replace(tmp, self._path(job["id"]))
+
+    def get(self, job_id: str) -> dict:
+        with open(self._path(job_id), encoding="utf-8") as f:
+            return json.load(f)
+
+    def jobs(self, tag: str | None = None) -> list[dict]:
+        out = []
+        for p in glob.glob(os.path.join(self.root, "*.json")):
+            with open(p, encoding="utf-8") as f:
+                job = json.load(f)
+            if tag is None or job["tag"] == tag:
+                out.append(job)
+        return sorted(out, key=lambda j: j["created"])
+
+    def pending(self) -> list[dict]:
+        """jobs not delivered yet (still running, or finished but unhandled)"""
+        return [j for j in self.jobs() if not j["delivered"]]
+
+    def _wait(self, polls: int) -> float:
+        # jitter inside the cap (and a capped exponent, 1.5**polls
+        # overflows a float after a couple of thousand polls)
+        wait = self.min_wait * 1.5 ** min(polls, 64) * random.uniform(0.8, 1.2)
+        return min(self.max_wait, wait)
+
+    def _sleep_until(self, t: float) -> None:
+        # next_poll may come from a record saved with another max_wait
+        time.sleep(min(self.max_wait, max(0.0, t - time.time())))
+
+    def submit(self, input_text: str, preset: str = "o3", tag: str | None = None, **kwargs) -> str:
+        """Starts a background response. Returns its id (also the job id)."""
+        request = {**BACKGROUND[preset], **kwargs, "input": input_text}
+        resp = self.client.responses.create(**request)
+        now = time.time()
+        self._save({"id": resp.id, "tag": tag, "preset": preset, "request": request,
+                    "status": resp.status, "created": now, "polls": 0,
+                    "next_poll": now + self._wait(0), "finished": None,
+                    "output_text": None, "error": None, "delivered": False})
+        print(f"jobs: submitted {resp.id} ({preset}, tag={tag})")
+        return resp.id
+
+    def _refresh(self, job: dict) -> dict:
+        try:
+            resp = self.client.responses.retrieve(job["id"])
+        except Exception as e:
+            # transient api error, just try again later (up to max_errors in a row)
+            job["error"] = repr(e)
+            job["polls"] += 1
+            job["nerrors"] = job.get("nerrors", 0) + 1
+            if job["nerrors"] >= self.max_errors:
+                job["status"] = "error"
+                job["finished"] = time.time()
+                print(f"jobs: giving up on {job['id']} after {job['nerrors']} failed retrieves: {e!r}")
+            else:
+                job["next_poll"] = time.time() + self._wait(job["polls"])
+            self._save(job)
+            return job
+        job["nerrors"] = 0
+        job["status"] = resp.status
+        job["polls"] += 1
+        if resp.status in OPEN:
+            job["next_poll"] = time.time() + self._wait(job["polls"])
+        else:
+            job["finished"] = time.time()
+            job["output_text"] = resp.output_text if resp.status == "completed" else None
+            job["error"] = resp.error.model_dump() if getattr(resp, "error", None) else None
+            if getattr(resp, "usage", None) is not None:
+                record_response(resp, job["request"], job["finished"] - job["created"], cache_hit=False)
+        self._save(job)
+        return job
+
+    def poll(self) -> list[dict]:
+        """Retrieves every job that's due (in parallel). Returns the ones
+        that are finished and not delivered yet."""
+        now = time.time()
+        jobs = self.pending()
+        due = [j for j in jobs if j["status"] in OPEN and j["next_poll"] <= now]
+        if due:
+            with ThreadPoolExecutor(max_workers=self.workers) as ex:
+                list(ex.map(self._refresh, due))
+        return [j for j in jobs if j["status"] not in OPEN]
+
+    def _deliver(self, job: dict) -> None:
+        job["delivered"] = True
+        self._save(job)
+
+    def watch(self, tag: str | None = None) -> Iterator[dict]:
+        """Yields jobs as they finish (oldest first), until none are left open.
+        A job counts as delivered once the consumer asks for the next one."""
+        t0 = time.time()
+        while True:
+            for job in self.poll():
+                if tag is not None and job["tag"] != tag:
+                    continue
+                print(f"jobs: {job['id']} {job['status']} after "
+                      f"{(job['finished'] or time.time()) - job['created']:.0f}s")
+                yield job
+                self._deliver(job)
+            left = [j for j in self.pending() if j["status"] in OPEN
+                    and (tag is None or j["tag"] == tag)]
+            if not left:
+                return
+            next_poll = min(j["next_poll"] for j in left)
+            print(f"jobs: {len(left)} open, elapsed {time.time() - t0:.0f}s")
+            self._sleep_until(next_poll)
+
+    def run(self, callback: Callable[[dict], None], tag: str | None = None) -> int:
+        """watch() with a callback. Returns how many jobs were delivered."""
+        n = 0
+        for job in self.watch(tag):
+            callback(job)
+            n += 1
+        return n
+
+    def wait(self, job_id: str) -> dict:
+        """Blocks on a single job (what o3_background used to do).
+        Other jobs are left alone. Raises if the job can't be retrieved."""
+        while True:
+            job = self.get(job_id)
+            if job["status"] in OPEN:
+                self._sleep_until(job["next_poll"])
+                job = self._refresh(job)
+            if job["status"] == "error":
+                raise RuntimeError(f"jobs: {job_id} failed to retrieve: {job['error']}")
+            if job["status"] not in OPEN:
+                self._deliver(job)
+                return job
+
+    def forget(self, delivered_only: bool = True) -> int:
+        """Deletes local job records. Returns how many."""
+        n = 0
+        for job in self.jobs():
+            if delivered_only and not job["delivered"]:
+                continue
+            os.remove(self._path(job["id"]))
+            n += 1
+        return n
+
+
+jobs = JobManager()
+
+
+#%% ========================================
+# usage:
+# from src.jobs import jobs
+# for coin in coins:
+#     jobs.submit(f"research {coin}", preset="o3_deep_research", tag=coin)
+# ... later, even from a fresh process:
+# for job in jobs.watch():
+#     print(job["tag"], job["status"], job["output_text"])
@@ -0,0 +1,30 @@
+#%% ========================================
+import importlib
+
+# Heavy third party modules (numpy ~90ms, sqlalchemy ~200ms) imported on
+# first attribute access instead of at import time, so importing a src/
+# module stays cheap (see IMPORT_BUDGET_MS in src/bootstrap.py).
+#   np = lazy("numpy")      # nothing imported yet
+#   np.zeros(3)             # numpy gets imported here
+# Only for use inside function bodies: module level code (and
+# annotations, so pair this with `from __future__ import annotations`)
+# would trigger the import straight away.
+
+
+class LazyModule:
+
+    def __init__(self, name: str):
+        self.__dict__["_name"] = name
+
+    def __repr__(self) -> str:
+        return f"LazyModule({self._name!r})"
+
+    def __getattr__(self, attr: str):
+        value = getattr(importlib.import_module(self._name), attr)
+        # cache it, later lookups are plain attribute hits
+        self.__dict__[attr] = value
+        return value
+
+
+def lazy(name: str) -> LazyModule:
+    return LazyModule(name)
@@ -0,0 +1,283 @@
+#%% ========================================
+import os
+import json
+import time
+import uuid
+import queue
+import threading
+import contextvars
+from contextlib import contextmanager
+from datetime import datetime, timezone
+
+# Usage/latency ledger for LLM calls.
+# Every call through api_chatbot._create/_acreate is recorded here:
+# model, service tier, input/cached/output tokens, web search calls,
+# latency and cost (from the one PRICES table below). record() only
+# puts the row on a queue, a background thread appends batches to
+# either a local jsonl file (default) or the llmusage table, so it never
+# slows down the caller.
+# Calls are tagged with the current run (see run()), Hydrator opens one
+# per hydration, and summary(run) gives throughput, p50/p95 latency,
+# total cost, $/call and the share of input tokens that hit the
+# provider's prompt cache (see src/prompts.py) for it.
+
+LEDGER_PATH = "local/ledger/usage.jsonl"
+
+# $ per 1M tokens: (input, cached input, output)
+# https://platform.openai.com/docs/pricing (SEPTEMBER 2025)
+# flex and batch are half price
+PRICES = {
+    ("gpt-5", "default"):                 (1.25,  0.125,  10.00),
+    ("gpt-5", "flex"):                    (0.625, 0.0625,  5.00),
+    ("gpt-5", "batch"):                   (0.625, 0.0625,  5.00),
+    ("gpt-5-mini", "default"):            (0.25,  0.025,   2.00),
+    ("gpt-5-mini", "flex"):               (0.125, 0.0125,  1.00),
+    ("gpt-5-mini", "batch"):              (0.125, 0.0125,  1.00),
+    ("gpt-5-nano", "default"):            (0.05,  0.005,   0.40),
+    ("gpt-5-nano", "flex"):               (0.025, 0.0025,  0.20),
+    ("gpt-5-nano", "batch"):              (0.025, 0.0025,  0.20),
+    ("o3", "default"):                    (2.00,  0.50,    8.00),
+    ("o3", "flex"):                       (1.00,  0.25,    4.00),
+    ("o3", "batch"):                      (1.00,  0.25,    4.00),
+    ("o3-deep-research", "default"):      (10.00, 2.50,   40.00),
+    ("o4-mini-deep-research", "default"): (2.00,  0.50,    8.00),
+    ("text-embedding-3-small", "default"): (0.02, 0.02,    0.00),
+    ("text-embedding-3-large", "default"): (0.13, 0.13,    0.00),
+}
+WEB_SEARCH_PER_CALL = 10.00 / 1000
+
+FIELDS = ("ts", "run", "model", "tier", "ntokens_in", "ntokens_cached",
+          "ntokens_out", "nwebcalls", "latency", "cost", "cache_hit")
+
+_RUN: contextvars.ContextVar[str | None] = contextvars.ContextVar("ledger_run", default=None)
+
+
+def price(model: str, tier: str = "default") -> tuple[float, float, float]:
+    """(input, cached, output) $/1M tokens. Dated snapshots
+    ("gpt-5-mini-2025-08-07") fall back to their base model."""
+    for name in sorted({m for m, _ in PRICES}, key=len, reverse=True):
+        if model == name or model.startswith(name + "-20"):
+            return PRICES.get((name, tier)) or PRICES[(name, "default")]
+    raise KeyError(f"no price for {model!r}")
+
+
+_UNPRICED: set[str] = set()
+
+
+def cost(model: str, tier: str = "default", ntokens_in: int = 0, ntokens_cached: int = 0,
+         ntokens_out: int = 0, nwebcalls: int = 0) -> float | None:
+    """$ for one call. ntokens_in includes the cached ones.
+    None (and a warning, once per model) if the model isn't in PRICES:
+    this runs after the call was paid for, so it must never raise."""
+    try:
+        p_in, p_cached, p_out = price(model, tier)
+    except KeyError:
+        if model not in _UNPRICED:
+            _UNPRICED.add(model)
+            print(f"ledger: no price for {model!r}, its calls are recorded with cost None")
+        return None
+    return ((ntokens_in - ntokens_cached) * p_in
+            + ntokens_cached * p_cached
+            + ntokens_out * p_out) / 1_000_000 + nwebcalls * WEB_SEARCH_PER_CALL
+
+
+@contextmanager
+def run(label: str):
+    """Tags every call made in this context (threads need
+    contextvars.copy_context(), asyncio tasks inherit it) with a run id."""
+    # the suffix keeps two runs started in the same second apart
+    run_id = f"{label}-{time.strftime('%Y%m%dT%H%M%S')}-{uuid.uuid4().hex[:8]}"
+    token = _RUN.set(run_id)
+    try:
+        yield run_id
+    finally:
+        _RUN.reset(token)
+
+
+def _quantile(xs: list[float], q: float) -> float:
+    if not xs:
+        return 0.0
+    xs = sorted(xs)
+    i = q * (len(xs) - 1)
+    lo = int(i)
+    hi = min(lo + 1, len(xs) - 1)
+    return xs[lo] + (xs[hi] - xs[lo]) * (i - lo)
+
+
+#%% ========================================
+
+def _create_table_llmusage():
+    sql = \
+"""
+CREATE TABLE llmusage (
+    ts              TIMESTAMPTZ NOT NULL,
+    run             TEXT,
+    model           TEXT NOT NULL,
+    tier            TEXT NOT NULL,
+    ntokens_in      INT4 NOT NULL,
+    ntokens_cached  INT4 NOT NULL,
+    ntokens_out     INT4 NOT NULL,
+    nwebcalls       INT4 NOT NULL,
+    latency         FLOAT8 NOT NULL,
+    cost            FLOAT8,         -- NULL: model not in PRICES
+    cache_hit       BOOLEAN NOT NULL
+);
+CREATE INDEX llmusage_run_idx ON llmusage (run);
+"""
+    from sqlalchemy import text
+    from src.db import get_engine
+    conn = get_engine().connect()
+    conn.execute(text(sql))
+    conn.commit()
+    conn.close()
+    print("Created table llmusage")
+
+# _create_table_llmusage()
+# (tables created before cost was nullable:
+#  ALTER TABLE llmusage ALTER COLUMN cost DROP NOT NULL;)
+
+
+class Ledger:
+
+    def __init__(self, path: str = LEDGER_PATH, table: str | None = None,
+                 every: int = 200, seconds: float = 5.0):
+        self.path = path
+        self.table = table        # "llmusage" to write to postgres instead
+        self.every = every
+        self.seconds = seconds
+        self.queue: queue.Queue = queue.Queue()
+        self.write_lock = threading.Lock()
+        self.written = 0
+        self._thread: threading.Thread | None = None
+
+    def __repr__(self) -> str:
+        return f"Ledger({self.table or self.path!r}, written={self.written})"
+
+    def record(self, **rec) -> None:
+        """Queues one call. Never blocks on io."""
+        rec.setdefault("ts", time.time())
+        rec.setdefault("run", _RUN.get())
+        self.queue.put(rec)
+        if self._thread is None:
+            with self.write_lock:
+                if self._thread is None:
+                    self._thread = threading.Thread(target=self._loop, daemon=True)
+                    self._thread.start()
+
+    def _loop(self) -> None:
+        # writes a batch every `every` records or `seconds` seconds;
+        # an Event on the queue (from flush()) forces a write and is set after
+        batch: list[dict] = []
+        t0 = time.monotonic()
+        while True:
+            timeout = max(0.0, self.seconds - (time.monotonic() - t0)) if batch else None
+            try:
+                item = self.queue.get(timeout=timeout)
+            except queue.Empty:
+                item = None
+            flushing = isinstance(item, threading.Event)
+            if item is not None and not flushing:
+                if not batch:
+                    t0 = time.monotonic()
+                batch.append(item)
+            if batch and (item is None or flushing or len(batch) >= self.every):
+                try:
+                    self._write(batch)
+                except Exception as e:
+                    print(f"\nLedger: write failed, dropped {len(batch)} records: {e!r}")
+                batch = []
+            if flushing:
+                item.set()
+
+    def _write(self, batch: list[dict]) -> None:
+        if not batch:
+            return
+        with self.write_lock:
+            if self.table is None:
+                os.makedirs(os.path.dirname(self.path), exist_ok=True)
+                with open(self.path, "a", encoding="utf-8") as f:
+                    for rec in batch:
+                        f.write(json.dumps(rec) + "\n")
+            else:
+                self._write_db(batch)
+            self.written += len(batch)
+
+    def _write_db(self, batch: list[dict]) -> None:
+        from src.db import get_engine
+        from src.pgcopy import copy_buffer
+        rows = [{**r, "ts": datetime.fromtimestamp(r["ts"], timezone.utc).isoformat()}
+                for r in batch]
+        conn = get_engine().raw_connection()
+        try:
+            cur = conn.cursor()
+            cur.copy_expert(f"COPY {self.table} ({', '.join(FIELDS)}) FROM STDIN",
+                            copy_buffer(rows, FIELDS))
+            conn.commit()
+        finally:
+            conn.close()
+
+    def flush(self) -> None:
+        """Waits until everything recorded so far is written (e.g. before summary())."""
+        if self._thread is None:
+            return
+        done = threading.Event()
+        self.queue.put(done)
+        done.wait()
+
+    def records(self, run: str | None = None) -> list[dict]:
+        self.flush()
+        if self.table is None:
+            if not os.path.exists(self.path):
+                return []
+            with open(self.path, encoding="utf-8") as f:
+                recs = [json.loads(line) for line in f if line.strip()]
+            return [r for r in recs if run is None or r["run"] == run]
+        from sqlalchemy import text
+        from src.db import get_engine
+        sql = f"SELECT {', '.join(FIELDS)}, extract(epoch FROM ts) AS epoch FROM {self.table}"
+        if run is not None:
+            sql += " WHERE run = :run"
+        conn = get_engine().connect()
+        rows = conn.execute(text(sql), {"run": run}).mappings().fetchall()
+        conn.close()
+        return [{**r, "ts": float(r["epoch"])} for r in rows]
+
+    def summary(self, run: str | None = None) -> dict:
+        """throughput, latency percentiles and cost over a run (or everything)"""
+        recs = self.records(run)
+        if not recs:
+            return {"run": run, "calls": 0}
+        latencies = [r["latency"] for r in recs if not r["cache_hit"]]
+        t_start = min(r["ts"] - r["latency"] for r in recs)
+        t_end = max(r["ts"] for r in recs)
+        dt = t_end - t_start
+        total = sum(r["cost"] or 0.0 for r in recs)
+        return {
+            "run":            run,
+            "calls":          len(recs),
+            "cache_hits":     sum(bool(r["cache_hit"]) for r in recs),
+            "elapsed":        dt,
+            "calls_per_s":    len(recs) / dt if dt else 0.0,
+            "p50_latency":    _quantile(latencies, 0.50),
+            "p95_latency":    _quantile(latencies, 0.95),
+            "ntokens_in":     sum(r["ntokens_in"] for r in recs),
+            "ntokens_cached": sum(r["ntokens_cached"] for r in recs),
+            "cached_share":   (sum(r["ntokens_cached"] for r in recs)
+                               / max(1, sum(r["ntokens_in"] for r in recs))),
+            "ntokens_out":    sum(r["ntokens_out"] for r in recs),
+            "nwebcalls":      sum(r["nwebcalls"] for r in recs),
+            "cost":           total,
+            "cost_per_call":  total / len(recs),
+            "unpriced":       sum(r["cost"] is None for r in recs),
+        }
+
+
+ledger = Ledger()
+
+
+#%% ========================================
+# usage:
+# from src.ledger import ledger
+# pprint(ledger.summary())                             # everything so far
+# pprint(ledger.summary("webprint_distill1s-20251001T120000"))
+# ledger.table = "llmusage"                            # log to postgres
@@ -0,0 +1,269 @@
+#%% ========================================
+import time
+import random
+import asyncio
+import threading
+from collections import deque
+
+# Adaptive concurrency + rate budgets for LLM calls.
+# A hard-coded max_workers=10 is either too slow or too fast depending
+# on the model/tier/time of day, and a single 429 used to kill the run.
+# Limiter wraps a model call with three things:
+#   1. AIMD concurrency: the number of calls allowed in flight grows by
+#      ~1 per window of successes (additive increase) and gets cut by
+#      `decrease` on a 429/timeout (multiplicative decrease, at most once
+#      per `cooldown` seconds). Optionally also backs off when latency
+#      goes over `target_latency`.
+#   2. per-model requests-per-minute and tokens-per-minute buckets. Each
+#      call reserves its (estimated) tokens up front and sleeps if the
+#      minute's budget is spent. The model callables return plain text,
+#      so the estimate is never corrected to the real usage (only given
+#      back when a call fails): size max_output on the generous side.
+#   3. retries with full-jitter exponential backoff, honoring retry-after.
+# It works from threads (call) and from asyncio (acall), so the same
+# limiter can sit in front of Hydrator.run and Hydrator.arun.
+# Throughput settles near whatever the account actually allows.
+
+# requests/tokens per minute. These are tier 1 numbers, bump them to
+# match https://platform.openai.com/settings/organization/limits
+MODEL_LIMITS = {
+    "gpt-5":      {"rpm": 500, "tpm": 500_000},
+    "gpt-5-mini": {"rpm": 500, "tpm": 500_000},
+    "gpt-5-nano": {"rpm": 500, "tpm": 200_000},
+    "o3":         {"rpm": 500, "tpm": 30_000},
+}
+
+_RETRYABLE_STATUS = {408, 409, 429, 500, 502, 503, 504}
+_THROTTLE_NAMES = {"RateLimitError", "APITimeoutError", "TimeoutError", "ReadTimeout"}
+_RETRY_NAMES = _THROTTLE_NAMES | {"APIConnectionError", "InternalServerError", "ConnectError"}
+
+
+def _status(e: Exception) -> int | None:
+    return getattr(e, "status_code", None) or getattr(getattr(e, "response", None), "status_code", None)
+
+
+def is_throttle(e: Exception) -> bool:
+    """rate limited or timed out: the signal to back off concurrency"""
+    return type(e).__name__ in _THROTTLE_NAMES or _status(e) == 429 or isinstance(e, TimeoutError)
+
+
+def is_retryable(e: Exception) -> bool:
+    return is_throttle(e) or type(e).__name__ in _RETRY_NAMES or _status(e) in _RETRYABLE_STATUS
+
+
+def _retry_after(e: Exception) -> float | None:
+    headers = getattr(getattr(e, "response", None), "headers", None) or {}
+    try:
+        return float(headers.get("retry-after"))
+    except (TypeError, ValueError):
+        return None
+
+
+#%% ========================================
+
+class Bucket:
+    """Per-minute budget that refills continuously. reserve() always
+    succeeds and returns how long the caller must wait before using it
+    (the balance can go negative, which queues later callers behind)."""
+
+    def __init__(self, per_minute: float):
+        self.rate = per_minute / 60.0
+        self.capacity = per_minute
+        self.level = per_minute
+        self.t = time.monotonic()
+        self.lock = threading.Lock()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self.level = min(self.capacity, self.level + (now - self.t) * self.rate)
+        self.t = now
+
+    def reserve(self, n: float) -> float:
+        with self.lock:
+            self._refill()
+            self.level -= min(n, self.capacity)
+            return max(0.0, -self.level / self.rate)
+
+    def adjust(self, delta: float) -> None:
+        """Gives back (negative delta) or takes more of a reservation."""
+        with self.lock:
+            self._refill()
+            self.level = min(self.capacity, self.level - delta)
+
+
+class AIMD:
+    """Concurrency gate whose limit adapts with AIMD. Usable from both
+    threads (acquire/release) and coroutines (aacquire/release)."""
+
+    def __init__(self, initial: float = 10, minimum: float = 1, maximum: float = 500,
+                 increase: float = 1.0, decrease: float = 0.5,
+                 target_latency: float | None = None, cooldown: float = 5.0):
+        self.limit = float(initial)
+        self.minimum = minimum
+        self.maximum = maximum
+        self.increase = increase
+        self.decrease = decrease
+        self.target_latency = target_latency
+        self.cooldown = cooldown
+        self.inflight = 0
+        self.t_decrease = 0.0
+        self.cond = threading.Condition()
+        self.waiters: deque = deque()
+
+    def __repr__(self) -> str:
+        return f"AIMD(limit={self.limit:.1f}, inflight={self.inflight})"
+
+    def _free(self) -> int:
+        return int(self.limit) - self.inflight
+
+    def _wake(self) -> None:
+        # caller holds self.cond
+        self.cond.notify_all()
+        n = self._free()
+        while n > 0 and self.waiters:
+            loop, fut = self.waiters.popleft()
+            if fut.done():
+                # cancelled while queued, don't spend a wake on it
+                continue
+            loop.call_soon_threadsafe(lambda f=fut: f.done() or f.set_result(None))
+            n -= 1
+
+    def acquire(self) -> None:
+        with self.cond:
+            while self._free() <= 0:
+                self.cond.wait()
+            self.inflight += 1
+
+    async def aacquire(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            with self.cond:
+                if self._free() > 0:
+                    self.inflight += 1
+                    return
+                fut = loop.create_future()
+                self.waiters.append((loop, fut))
+            try:
+                await fut
+            except asyncio.CancelledError:
+                with self.cond:
+                    try:
+                        self.waiters.remove((loop, fut))
+                    except ValueError:
+                        # already woken: hand the wake to the next waiter
+                        self._wake()
+                raise
+
+    def release(self) -> None:
+        with self.cond:
+            self.inflight -= 1
+            self._wake()
+
+    def _cut(self) -> None:
+        now = time.monotonic()
+        if now - self.t_decrease >= self.cooldown:
+            self.limit = max(self.minimum, self.limit * self.decrease)
+            self.t_decrease = now
+
+    def on_success(self, latency: float) -> None:
+        with self.cond:
+            if self.target_latency is not None and latency > self.target_latency:
+                self._cut()
+            else:
+                # +increase per `limit` successes, i.e. ~+1 per round trip
+                self.limit = min(self.maximum, self.limit + self.increase / self.limit)
+            self._wake()
+
+    def on_throttle(self) -> None:
+        with self.cond:
+            self._cut()
+
+
+#%% ========================================
+
+def estimate_tokens(prompt: str, max_output: int = 2000) -> int:
+    """rough token cost of a call: ~4 chars/token in + expected output"""
+    return len(prompt) // 4 + max_output
+
+
+class Limiter:
+    """AIMD concurrency + rpm/tpm budgets + jittered retries for one model."""
+
+    def __init__(self, model: str = "gpt-5", retries: int = 6,
+                 backoff: float = 1.0, backoff_cap: float = 60.0,
+                 max_output: int = 2000, **aimd):
+        limits = MODEL_LIMITS.get(model, {"rpm": 500, "tpm": 200_000})
+        self.model = model
+        self.rpm = Bucket(limits["rpm"])
+        self.tpm = Bucket(limits["tpm"])
+        self.gate = AIMD(**aimd)
+        self.retries = retries
+        self.backoff = backoff
+        self.backoff_cap = backoff_cap
+        self.max_output = max_output
+        self.calls = 0
+        self.throttles = 0
+        self.failures = 0
+
+    def __repr__(self) -> str:
+        return (f"Limiter({self.model}, {self.gate}, calls={self.calls}, "
+                f"throttles={self.throttles}, failures={self.failures})")
+
+    def _budget(self, prompt: str) -> tuple[float, int]:
+        tokens = estimate_tokens(prompt, self.max_output)
+        wait = max(self.rpm.reserve(1), self.tpm.reserve(tokens))
+        return wait, tokens
+
+    def _on_error(self, e: Exception, attempt: int) -> float:
+        """Returns how long to sleep before retrying, raises if we shouldn't."""
+        if attempt >= self.retries or not is_retryable(e):
+            self.failures += 1
+            raise e
+        if is_throttle(e):
+            self.throttles += 1
+            self.gate.on_throttle()
+        wait = _retry_after(e)
+        if wait is None:
+            # full jitter
+            wait = random.uniform(0, min(self.backoff_cap, self.backoff * 2 ** attempt))
+        return wait
+
+    def call(self, fn, prompt: str):
+        """fn(prompt) from a thread, under the limiter."""
+        for attempt in range(self.retries + 1):
+            wait, tokens = self._budget(prompt)
+            if wait:
+                time.sleep(wait)
+            self.gate.acquire()
+            t0 = time.monotonic()
+            try:
+                result = fn(prompt)
+            except Exception as e:
+                self.gate.release()
+                self.tpm.adjust(-tokens)
+                time.sleep(self._on_error(e, attempt))
+                continue
+            self.gate.release()
+            self.gate.on_success(time.monotonic() - t0)
+            self.calls += 1
+            return result
+
+    async def acall(self, fn, prompt: str):
+        """await fn(prompt) under the limiter."""
+        for attempt in range(self.retries + 1):
+            wait, tokens = self._budget(prompt)
+            if wait:
+                await asyncio.sleep(wait)
+            await self.gate.aacquire()
+            t0 = time.monotonic()
+            try:
+                result = await fn(prompt)
+            except Exception as e:
+                self.gate.release()
+                self.tpm.adjust(-tokens)
+                await asyncio.sleep(self._on_error(e, attempt))
+                continue
+            self.gate.release()
+            self.gate.on_success(time.monotonic() - t0)
+            self.calls += 1
+            return result
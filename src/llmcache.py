@@ -0,0 +1,159 @@
+#%% ========================================
+import os
+import json
+import time
+import hashlib
+import threading
+
+# On-disk, content-addressed cache for LLM responses.
+# Re-running a hydrator after a crash (or re-running a prompt we
+# already paid for) shouldn't cost full price and full latency again.
+# The key is a sha256 over everything that determines the output:
+# model, tools, reasoning effort, service tier, input (+ any other
+# request kwargs). Each entry is one json file under
+# <root>/<key[:2]>/<key>.json, written atomically, so several threads
+# or processes can share the cache.
+# Entries expire `ttl` seconds after they were written (file mtime, for
+# both get() and evict()). Once the cache grows past `max_bytes` the
+# least recently used entries (by atime, hits bump it) are evicted down
+# to 90% of the limit.
+
+CACHE_DIR = "local/llmcache"
+
+
+def cache_key(**request) -> str:
+    """sha256 of the canonical json of the request kwargs"""
+    blob = json.dumps(request, sort_keys=True, separators=(",", ":"), default=str)
+    return hashlib.sha256(blob.encode()).hexdigest()
+
+
+class LLMCache:
+
+    def __init__(self, root: str = CACHE_DIR,
+                 ttl: float = 30 * 24 * 3600,
+                 max_bytes: int = 512 * 1024 * 1024):
+        self.root = root
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.lock = threading.Lock()
+        self._size: int | None = None
+
+    def __repr__(self) -> str:
+        return f"LLMCache({self.root!r}, {self.stats()})"
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.root, key[:2], f"{key}.json")
+
+    def _entries(self) -> list[tuple[float, float, int, str]]:
+        """[(atime, mtime, size, path), ...] for every entry on disk"""
+        out = []
+        for dirpath, _, files in os.walk(self.root):
+            for f in files:
+                if not f.endswith(".json"):
+                    continue
+                p = os.path.join(dirpath, f)
+                try:
+                    st = os.stat(p)
+                except FileNotFoundError:
+                    continue
+                out.append((st.st_atime, st.st_mtime, st.st_size, p))
+        return out
+
+    def size(self) -> int:
+        with self.lock:
+            if self._size is None:
+                self._size = sum(s for _, _, s, _ in self._entries())
+            return self._size
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {"hits": self.hits, "misses": self.misses,
+                "hit_rate": self.hits / total if total else 0.0,
+                "evictions": self.evictions}
+
+    def get(self, key: str):
+        """Cached payload for key, or None (missing or expired)."""
+        p = self._path(key)
+        try:
+            mtime = os.stat(p).st_mtime
+            with open(p, encoding="utf-8") as f:
+                entry = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            with self.lock:
+                self.misses += 1
+            return None
+        if time.time() - mtime > self.ttl:
+            self._remove(p)
+            with self.lock:
+                self.misses += 1
+            return None
+        # bump atime only (mtime is the write time the ttl runs from), so
+        # eviction is least-recently-used
+        try:
+            os.utime(p, (time.time(), mtime))
+        except FileNotFoundError:
+            pass
+        with self.lock:
+            self.hits += 1
+        return entry["payload"]
+
+    def put(self, key: str, payload) -> None:
+        p = self._path(key)
+        os.makedirs(os.path.dirname(p), exist_ok=True)
+        data = json.dumps({"created": time.time(), "payload": payload}, ensure_ascii=False)
+        tmp = f"{p}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            f.write(data)
+        size = self.size()
+        try:
+            # overwriting a key replaces its bytes, it doesn't add to them
+            old = os.path.getsize(p)
+        except FileNotFoundError:
+            old = 0
+        os.replace(tmp, p)
+        with self.lock:
+            self._size = size - old + len(data.encode())
+            over = self._size > self.max_bytes
+        if over:
+            self.evict()
+
+    def _remove(self, p: str) -> int:
+        try:
+            n = os.path.getsize(p)
+            os.remove(p)
+        except FileNotFoundError:
+            return 0
+        with self.lock:
+            if self._size is not None:
+                self._size -= n
+        return n
+
+    def evict(self) -> int:
+        """Drops expired entries, then LRU entries until under 90% of max_bytes."""
+        entries = sorted(self._entries())
+        now = time.time()
+        total = sum(s for _, _, s, _ in entries)
+        target = self.max_bytes * 0.9
+        n = 0
+        for _, mtime, size, p in entries:
+            if total <= target and now - mtime <= self.ttl:
+                continue
+            self._remove(p)
+            total -= size
+            n += 1
+        with self.lock:
+            self._size = total
+            self.evictions += n
+        return n
+
+    def clear(self) -> None:
+        for *_, p in self._entries():
+            self._remove(p)
+        with self.lock:
+            self._size = 0
+
+
+cache = LLMCache()
@@ -0,0 +1,218 @@
+#%% ========================================
+from __future__ import annotations
+import time
+from functools import cache
+
+from src.db import get_engine, text, get_following_lists, get_users, _has_table
+from src.lazy import lazy
+from src.api_x import Profile
+
+np = lazy("numpy")
+
+# "Accounts that follow like this one"
+# Comparing following sets pairwise is O(n^2) set intersections, which
+# doesn't fly in SQL once the graph gets big. Instead every crawled
+# source gets a MinHash signature: NPERM 32-bit minimums over
+# independent hashes of its target ids. The fraction of equal slots
+# between two signatures estimates the Jaccard similarity of the sets.
+# Signatures live in xminhash (NPERM*4 bytes per source). LSH splits
+# each signature into BANDS bands of ROWS slots and buckets sources by
+# band, so a lookup only looks at sources sharing at least one bucket.
+# Candidates then get re-ranked by exact Jaccard on the real lists.
+# MinHash of a union is the elementwise min of the signatures, so when
+# upsert_branch adds edges we just min the new targets into the stored
+# signature (edges are never removed, except by a cascade -> rebuild).
+
+NPERM = 128
+BANDS = 32
+ROWS = NPERM // BANDS
+
+_C1 = 0xBF58476D1CE4E5B9
+_C2 = 0x94D049BB133111EB
+
+
+@cache
+def _seeds() -> np.ndarray:
+    # built on first use, numpy isn't imported until then
+    return np.random.default_rng(0x5EED).integers(0, 2**63, NPERM, dtype=np.uint64)
+
+
+#%% ========================================
+
+def _create_table_xminhash():
+    sql = \
+"""
+CREATE TABLE xminhash (
+    source_id   INT8 PRIMARY KEY
+        REFERENCES xusers(id) ON DELETE CASCADE,
+    sig         BYTEA NOT NULL,
+    updated_at  TIMESTAMPTZ NOT NULL DEFAULT now()
+);
+"""
+    conn = get_engine().connect()
+    conn.execute(text(sql))
+    conn.commit()
+    conn.close()
+    # so upsert_branch/GraphWriter start keeping signatures up to date
+    _has_table.cache_clear()
+    print("Created table xminhash")
+
+# _create_table_xminhash()
+
+
+#%% ========================================
+
+def _hashes(ids) -> np.ndarray:
+    """uint32[len(ids), NPERM]: splitmix64 of (id ^ seed_i), top 32 bits"""
+    x = np.asarray(ids, dtype=np.int64).astype(np.uint64)[:, None] ^ _seeds()[None, :]
+    x = (x ^ (x >> np.uint64(30))) * np.uint64(_C1)
+    x = (x ^ (x >> np.uint64(27))) * np.uint64(_C2)
+    x = x ^ (x >> np.uint64(31))
+    return (x >> np.uint64(32)).astype(np.uint32)
+
+
+def signature(ids, chunk: int = 4096) -> np.ndarray:
+    """MinHash signature (uint32[NPERM]) of a set of ids"""
+    sig = np.full(NPERM, np.iinfo(np.uint32).max, dtype=np.uint32)
+    ids = np.asarray(ids, dtype=np.int64)
+    for i in range(0, len(ids), chunk):
+        np.minimum(sig, _hashes(ids[i:i + chunk]).min(axis=0), out=sig)
+    return sig
+
+
+def _to_bytes(sig: np.ndarray) -> bytes:
+    return sig.astype("<u4").tobytes()
+
+
+def _from_bytes(blob) -> np.ndarray:
+    return np.frombuffer(bytes(blob), dtype="<u4").astype(np.uint32)
+
+
+def update_signature(conn, source_id: int, target_ids: list[int]) -> None:
+    """Mins target_ids into source_id's stored signature. Runs on the
+    caller's connection, so it commits/rolls back with the edges."""
+    if not target_ids:
+        return
+    sel = "SELECT sig FROM xminhash WHERE source_id = :id FOR UPDATE"
+    row = conn.execute(text(sel), {"id": source_id}).fetchone()
+    sig = signature(target_ids)
+    if row is not None:
+        np.minimum(sig, _from_bytes(row[0]), out=sig)
+    ups = """
+    INSERT INTO xminhash (source_id, sig) VALUES (:id, :sig)
+    ON CONFLICT (source_id) DO UPDATE
+    SET sig = EXCLUDED.sig, updated_at = now()
+    """
+    conn.execute(text(ups), {"id": source_id, "sig": _to_bytes(sig)})
+
+
+def rebuild_signatures(batch: int = 500) -> int:
+    """Recomputes every signature from xfollows from scratch."""
+    conn = get_engine().connect()
+    sources = [r[0] for r in conn.execute(text("SELECT DISTINCT source_id FROM xfollows"))]
+    conn.close()
+    sql = """
+    INSERT INTO xminhash (source_id, sig) VALUES (:source_id, :sig)
+    ON CONFLICT (source_id) DO UPDATE
+    SET sig = EXCLUDED.sig, updated_at = now()
+    """
+    t0 = time.time()
+    for i in range(0, len(sources), batch):
+        lists = get_following_lists(sources[i:i + batch])
+        rows = [{"source_id": id, "sig": _to_bytes(signature(targets))}
+                for id, targets in lists.items()]
+        conn = get_engine().connect()
+        conn.execute(text(sql), rows)
+        conn.commit()
+        conn.close()
+        print(f"signed {i + len(rows)}/{len(sources)} sources, elapsed {time.time() - t0:.2f}s")
+    return len(sources)
+
+
+def load_signatures() -> tuple[np.ndarray, np.ndarray]:
+    """(source ids int64[N], signatures uint32[N, NPERM])"""
+    conn = get_engine().connect()
+    rows = conn.execute(text("SELECT source_id, sig FROM xminhash ORDER BY source_id")).fetchall()
+    conn.close()
+    ids = np.array([r[0] for r in rows], dtype=np.int64)
+    sigs = np.frombuffer(b"".join(bytes(r[1]) for r in rows), dtype="<u4")
+    return ids, sigs.reshape(len(rows), NPERM).astype(np.uint32)
+
+
+#%% ========================================
+
+def jaccard(a, b) -> float:
+    a, b = set(a), set(b)
+    if not a and not b:
+        return 0.0
+    return len(a & b) / len(a | b)
+
+
+class LSHIndex:
+    """Banded LSH over MinHash signatures. Build once, query many."""
+
+    def __init__(self, ids: np.ndarray, sigs: np.ndarray, bands: int = BANDS):
+        self.ids = ids
+        self.sigs = sigs
+        self.bands = bands
+        self.rows = sigs.shape[1] // bands
+        self.pos = {int(id): i for i, id in enumerate(ids)}
+        self.buckets: list[dict[bytes, list[int]]] = []
+        t0 = time.time()
+        for b in range(bands):
+            band = np.ascontiguousarray(sigs[:, b * self.rows:(b + 1) * self.rows])
+            d: dict[bytes, list[int]] = {}
+            for i, key in enumerate(band):
+                d.setdefault(key.tobytes(), []).append(i)
+            self.buckets.append(d)
+        print(f"indexed {len(ids)} signatures in {time.time() - t0:.2f}s")
+
+    @classmethod
+    def load(cls, bands: int = BANDS) -> "LSHIndex":
+        return cls(*load_signatures(), bands=bands)
+
+    def candidates(self, sig: np.ndarray) -> np.ndarray:
+        """row positions of every source sharing at least one band bucket"""
+        out = set()
+        for b, d in enumerate(self.buckets):
+            key = np.ascontiguousarray(sig[b * self.rows:(b + 1) * self.rows]).tobytes()
+            out.update(d.get(key, ()))
+        return np.fromiter(out, dtype=np.int64, count=len(out))
+
+    def query(self, id: int, k: int = 20, rerank: int = 200) -> list[tuple[int, float]]:
+        """Top k [(source_id, jaccard)] most similar to `id`'s following set.
+        Candidates are pre-sorted by estimated Jaccard, the best `rerank`
+        get exact Jaccard from their real following lists."""
+        if id in self.pos:
+            sig = self.sigs[self.pos[id]]
+        else:
+            sig = signature(get_following_lists([id]).get(id, []))
+        cand = self.candidates(sig)
+        cand = cand[self.ids[cand] != id]
+        if len(cand) == 0:
+            return []
+        est = (self.sigs[cand] == sig[None, :]).mean(axis=1)
+        cand = cand[np.argsort(-est)[:rerank]]
+        cand_ids = [int(i) for i in self.ids[cand]]
+        lists = get_following_lists([id] + cand_ids)
+        mine = lists.get(id, [])
+        scored = [(c, jaccard(mine, lists.get(c, []))) for c in cand_ids]
+        scored.sort(key=lambda t: -t[1])
+        return scored[:k]
+
+
+def similar_accounts(id: int, k: int = 20, index: LSHIndex | None = None) -> list[tuple[Profile, float]]:
+    """Hydrated version of LSHIndex.query"""
+    index = index or LSHIndex.load()
+    scored = index.query(id, k=k)
+    users = {p.id: p for p in get_users([c for c, _ in scored])}
+    return [(users[c], j) for c, j in scored if c in users]
+
+
+#%% ========================================
+# usage:
+
+# _create_table_xminhash()
+# rebuild_signatures()
+# index = LSHIndex.load()
+# index.query(1967223627314757632)
@@ -0,0 +1,31 @@
+#%% ========================================
+import io
+
+# Helpers for feeding COPY ... FROM STDIN (FORMAT text).
+# COPY is by far the fastest way to get lots of rows into postgres,
+# we use it to fill temp staging tables that then get merged with a
+# single set-based INSERT/UPDATE.
+
+
+def copy_text(value) -> str:
+    """Formats a single value for COPY ... (FORMAT text)"""
+    if value is None:
+        return "\\N"
+    return (str(value)
+            .replace("\\", "\\\\")
+            .replace("\t", "\\t")
+            .replace("\n", "\\n")
+            .replace("\r", "\\r"))
+
+
+def copy_buffer(rows, columns: tuple[str, ...] | None = None) -> io.StringIO:
+    """Serializes rows into an in-memory COPY text stream.
+    rows are dicts (pick `columns` out of each) or plain tuples."""
+    buf = io.StringIO()
+    for row in rows:
+        if columns is not None:
+            row = (row.get(c) for c in columns)
+        buf.write("\t".join(copy_text(v) for v in row))
+        buf.write("\n")
+    buf.seek(0)
+    return buf
@@ -0,0 +1,121 @@
+#%% ========================================
+import os
+import re
+import json
+import hashlib
+import textwrap
+from dataclasses import dataclass, field
+from typing import Callable
+
+# Cache-friendly prompt templates.
+# The provider caches prompt prefixes: when the first N tokens of a
+# request are byte-identical to a recent one, those tokens are billed at
+# the cached-input rate (10%) and prefill is skipped, which also cuts
+# latency. (Only prompts over ~1024 tokens are eligible, matched in 128
+# token steps.) To get that, every request built from a template has to
+# share one exact prefix:
+#   [static instructions, compacted] [separator] [per-row data]
+# - the instructions are dedented and whitespace-compacted once, when
+#   the template is registered, so the prefix never depends on source
+#   indentation (and doesn't pay for it in tokens)
+# - nothing row-specific (name, slug, ...) goes into the instructions,
+#   it all comes after, in data(row), which is passed through as is
+# - every name's prefix digest is saved to DIGESTS_PATH, and registering
+#   a name with a different prefix raises (in this process or any later
+#   one), so a prompt can't silently drift between runs. replace=True
+#   accepts the change on purpose.
+# Cached tokens per call land in the ledger (ntokens_cached), and
+# ledger.summary(run) reports the cached share of input tokens.
+
+DIGESTS_PATH = "local/prompts/digests.json"
+SEPARATOR = "\n\nINPUT:\n<<<\n"
+TERMINATOR = "\n>>>"
+
+_SPACES = re.compile(r"[ \t]+")
+_BLANKS = re.compile(r"\n{3,}")
+
+
+def compact(text: str) -> str:
+    """Dedents, trims every line, collapses runs of spaces and blank lines.
+    Line breaks are kept (lists and paragraphs still read the same)."""
+    lines = (_SPACES.sub(" ", line).strip() for line in textwrap.dedent(text).splitlines())
+    return _BLANKS.sub("\n\n", "\n".join(lines)).strip()
+
+
+@dataclass(frozen=True)
+class Template:
+    name:         str
+    instructions: str                       # static part, compacted on init
+    data:         Callable[[dict], str]     # row -> the variable part
+    prefix:       str = field(init=False)
+    digest:       str = field(init=False)
+
+    def __post_init__(self):
+        prefix = compact(self.instructions) + SEPARATOR
+        object.__setattr__(self, "instructions", compact(self.instructions))
+        object.__setattr__(self, "prefix", prefix)
+        object.__setattr__(self, "digest", hashlib.sha256(prefix.encode()).hexdigest()[:12])
+
+    def __repr__(self) -> str:
+        return f"Template({self.name!r}, digest={self.digest}, prefix={len(self.prefix)} chars)"
+
+    def render(self, row: dict) -> str:
+        # only the static prefix is compacted, the row data is sent verbatim
+        return self.prefix + self.data(row) + TERMINATOR
+
+    # so a Template can be handed to Hydrator(prompt=...) directly
+    __call__ = render
+
+
+REGISTRY: dict[str, Template] = {}
+
+
+def _digests(path: str) -> dict[str, str]:
+    if not os.path.exists(path):
+        return {}
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def _save_digests(digests: dict[str, str], path: str) -> None:
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(digests, f, indent=1, sort_keys=True)
+    os.replace(tmp, path)
+
+
+def register(name: str, instructions: str, data: Callable[[dict], str],
+             replace: bool = False, path: str = DIGESTS_PATH) -> Template:
+    """Adds a template. Re-registering the same name is fine (re-running a
+    cell, a new process) as long as the prefix is byte-identical to the
+    one recorded in `path`."""
+    template = Template(name, instructions, data)
+    digests = _digests(path)
+    old = digests.get(name)
+    if old is not None and old != template.digest and not replace:
+        raise ValueError(f"prompt {name!r} changed: {old} -> {template.digest}, "
+                         f"pick a new name (e.g. {name}_v2) so the caches stay apart, "
+                         f"or register(..., replace=True)")
+    if old != template.digest:
+        digests[name] = template.digest
+        _save_digests(digests, path)
+    REGISTRY[name] = template
+    return template
+
+
+def get(name: str) -> Template:
+    return REGISTRY[name]
+
+
+#%% ========================================
+# usage:
+# from src import prompts
+# distill = prompts.register(
+#     "distill1s",
+#     """
+#     In only one sentence, describe what the crypto project below is...
+#     """,
+#     lambda row: row["webprint_gpt5mini"],
+# )
+# Hydrator(column="webprint_distill1s", prompt=distill, ...)
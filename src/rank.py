@@ -0,0 +1,185 @@
+#%% ========================================
+from __future__ import annotations
+import io
+import time
+
+from src.db import get_engine, text
+from src.lazy import lazy
+from src.graph import CSRGraph, _copy_out
+
+np = lazy("numpy")
+
+# Ranking accounts beyond raw followers_count.
+# PageRank over xfollows, where an edge source -> target (source follows
+# target) is a vote for target. Runs as sparse power iteration directly
+# on the CSRGraph arrays, so one iteration is a gather + a bincount over
+# the edge list. Personalized PageRank (PPR) is the same thing with the
+# teleport vector concentrated on a handful of roots (e.g. jackalxhunt),
+# which scores accounts by how "close" they are to our corner of the graph.
+# Scores get written back to xusers in bulk. Any previous scores can be
+# used as the starting vector, so a recompute after a small crawl only
+# needs a few iterations.
+
+SCORE_COLUMNS = ("pagerank", "ppr")
+
+
+#%% ========================================
+
+def _create_columns_scores():
+    sql = \
+"""
+ALTER TABLE xusers ADD COLUMN IF NOT EXISTS pagerank FLOAT8;
+ALTER TABLE xusers ADD COLUMN IF NOT EXISTS ppr      FLOAT8;
+CREATE INDEX IF NOT EXISTS xusers_pagerank_idx ON xusers(pagerank DESC NULLS LAST);
+CREATE INDEX IF NOT EXISTS xusers_ppr_idx ON xusers(ppr DESC NULLS LAST);
+"""
+    conn = get_engine().connect()
+    conn.execute(text(sql))
+    conn.commit()
+    conn.close()
+    print("Added score columns to xusers")
+
+# _create_columns_scores()
+
+
+#%% ========================================
+
+def pagerank(g: CSRGraph,
+             damping: float = 0.85,
+             personalize: list[int] | None = None,
+             x0: np.ndarray | None = None,
+             tol: float = 1e-9,
+             max_iter: int = 100) -> np.ndarray:
+    """Power iteration PageRank over g's out-edges. Returns float64[n]
+    aligned with g.ids and summing to 1.
+    personalize: xusers ids to teleport to (PPR), default is uniform
+    x0:          warm start vector aligned with g.ids (e.g. the last run)
+    tol:         stop once the L1 change between iterations drops below this"""
+    n = g.n
+    if n == 0:
+        return np.zeros(0)
+    outdeg = g.out_degrees().astype(np.float64)
+    dangling = outdeg == 0
+    inv_out = np.divide(1.0, outdeg, out=np.zeros(n), where=~dangling)
+    # source index of every edge, in the same order as out_targets
+    edge_src = np.repeat(np.arange(n, dtype=np.int32), g.out_degrees())
+    targets = np.asarray(g.out_targets)
+
+    if personalize:
+        idx = g.indices(personalize)
+        idx = idx[idx >= 0]
+        if len(idx) == 0:
+            raise ValueError("none of the personalization ids are in the graph")
+        p = np.zeros(n)
+        p[idx] = 1.0 / len(idx)
+    else:
+        p = np.full(n, 1.0 / n)
+
+    if x0 is not None and x0.sum() > 0:
+        x = np.asarray(x0, dtype=np.float64) / x0.sum()
+    else:
+        x = p.copy()
+
+    t0 = time.time()
+    for it in range(1, max_iter + 1):
+        contrib = (x * inv_out)[edge_src]
+        xnew = np.bincount(targets, weights=contrib, minlength=n)
+        # dangling nodes (nobody crawled / follows nobody) teleport
+        xnew += x[dangling].sum() * p
+        xnew = damping * xnew + (1 - damping) * p
+        err = np.abs(xnew - x).sum()
+        x = xnew
+        if err < tol:
+            break
+    print(f"pagerank converged in {it} iterations (err {err:.2e}, {time.time() - t0:.2f}s)")
+    return x
+
+
+#%% ========================================
+
+def read_scores(g: CSRGraph, column: str = "pagerank") -> np.ndarray:
+    """Loads stored scores from xusers aligned with g.ids (for warm starts).
+    Nodes without a score get the mean of the ones that have one."""
+    if column not in SCORE_COLUMNS:
+        raise ValueError(f"unknown score column {column!r}")
+    import pandas as pd
+    buf = _copy_out(f"SELECT id, {column} FROM xusers WHERE {column} IS NOT NULL")
+    df = pd.read_csv(buf, header=None, names=["id", "score"],
+                     dtype={"id": np.int64, "score": np.float64})
+    x = np.zeros(g.n)
+    if df.empty:
+        return x
+    idx = g.indices(df["id"].to_numpy())
+    keep = idx >= 0
+    x[idx[keep]] = df["score"].to_numpy()[keep]
+    missing = x == 0
+    if missing.any() and (~missing).any():
+        x[missing] = x[~missing].mean()
+    return x
+
+
+def _scores_tsv(ids: np.ndarray, scores: np.ndarray) -> io.StringIO:
+    """id<TAB>score lines for COPY. ids stay int64 the whole way: stacking
+    them with the float scores would round x snowflake ids (> 2**53) to
+    the nearest float64 and write scores to the wrong users."""
+    buf = io.StringIO()
+    buf.writelines(f"{i}\t{s!r}\n" for i, s in zip(ids.tolist(), scores.astype(np.float64).tolist()))
+    buf.seek(0)
+    return buf
+
+
+def write_scores(g: CSRGraph, scores: np.ndarray, column: str = "pagerank") -> int:
+    """Bulk writes scores into xusers.<column>: COPY into a temp table,
+    then one UPDATE ... FROM join."""
+    if column not in SCORE_COLUMNS:
+        raise ValueError(f"unknown score column {column!r}")
+    buf = _scores_tsv(g.ids, scores)
+    t0 = time.time()
+    conn = get_engine().raw_connection()
+    try:
+        cur = conn.cursor()
+        cur.execute("CREATE TEMP TABLE xscores (id INT8, score FLOAT8) ON COMMIT DROP")
+        cur.copy_expert("COPY xscores (id, score) FROM STDIN WITH (FORMAT text)", buf)
+        cur.execute(f"""
+        UPDATE xusers AS u
+        SET {column} = s.score
+        FROM xscores AS s
+        WHERE u.id = s.id
+        AND u.{column} IS DISTINCT FROM s.score
+        """)
+        n = cur.rowcount
+        conn.commit()
+        cur.close()
+    except Exception as e:
+        conn.rollback()
+        raise e
+    finally:
+        conn.close()
+    print(f"Wrote {n} xusers.{column} scores in {time.time() - t0:.2f}s")
+    return n
+
+
+def update_pagerank(g: CSRGraph, warm: bool = True, **kwargs) -> np.ndarray:
+    """Global PageRank, warm started from xusers.pagerank, written back."""
+    x0 = read_scores(g, "pagerank") if warm else None
+    x = pagerank(g, x0=x0, **kwargs)
+    write_scores(g, x, "pagerank")
+    return x
+
+
+def update_ppr(g: CSRGraph, roots: list[int], warm: bool = True, **kwargs) -> np.ndarray:
+    """Personalized PageRank seeded from roots, warm started, written back."""
+    x0 = read_scores(g, "ppr") if warm else None
+    x = pagerank(g, personalize=roots, x0=x0, **kwargs)
+    write_scores(g, x, "ppr")
+    return x
+
+
+#%% ========================================
+# usage:
+
+# from src.graph import build_snapshot
+# from src.db import jackalxhunt
+# g = build_snapshot()
+# update_pagerank(g)
+# update_ppr(g, [jackalxhunt.id])
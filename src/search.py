@@ -0,0 +1,123 @@
+#%% ========================================
+from src.db import get_engine, text, ident
+
+# Full-text search over the cmcnotes reports.
+# cmcnotes.search_tsv is a weighted tsvector, GENERATED ... STORED from
+#   A: name, slug
+#   B: webprint_distill1s
+#   C: webprint_distill1s_fun
+#   D: webprint_gpt5mini (the long report)
+# with a GIN index on it. Being a generated column, postgres recomputes
+# it on every UPDATE, so whatever the hydrators (or batch/WriteBack)
+# write is searchable immediately, no triggers or reindex jobs.
+# search() takes web-search style queries ("solana -meme", "\"layer 2\"
+# privacy", "restaking or eigenlayer"), ranks with ts_rank_cd and only
+# builds ts_headline snippets for the rows it returns.
+
+CONFIG = "english"
+WEIGHTS = {
+    "name":                   "A",
+    "slug":                   "A",
+    "webprint_distill1s":     "B",
+    "webprint_distill1s_fun": "C",
+    "webprint_gpt5mini":      "D",
+}
+HEADLINE = "MaxFragments=2, MaxWords=30, MinWords=10, FragmentDelimiter=' … ', StartSel=**, StopSel=**"
+
+
+def _tsv_expression() -> str:
+    # the two argument to_tsvector (with an explicit regconfig) is
+    # immutable, which generated columns require
+    return "\n    || ".join(
+        f"setweight(to_tsvector('{CONFIG}'::regconfig, coalesce({ident(col)}, '')), '{w}')"
+        for col, w in WEIGHTS.items())
+
+
+def _create_column_search_tsv():
+    """Adds cmcnotes.search_tsv + its GIN index. Rewrites the table once.
+    All the WEIGHTS columns have to exist already (Hydrator.ensure_column)."""
+    sql = \
+f"""
+ALTER TABLE cmcnotes ADD COLUMN search_tsv tsvector
+    GENERATED ALWAYS AS (
+    {_tsv_expression()}
+    ) STORED;
+CREATE INDEX cmcnotes_search_tsv_idx ON cmcnotes USING GIN (search_tsv);
+"""
+    conn = get_engine().connect()
+    conn.execute(text(sql))
+    conn.commit()
+    conn.close()
+    print("Created column cmcnotes.search_tsv")
+
+# _create_column_search_tsv()
+
+
+def _drop_column_search_tsv():
+    """To change WEIGHTS: drop, then _create_column_search_tsv() again."""
+    conn = get_engine().connect()
+    conn.execute(text("ALTER TABLE cmcnotes DROP COLUMN IF EXISTS search_tsv"))
+    conn.commit()
+    conn.close()
+    print("Dropped column cmcnotes.search_tsv")
+
+
+#%% ========================================
+
+def search(query: str, limit: int = 20, min_score: float = 0.0,
+           snippet: str = "webprint_gpt5mini") -> list[dict]:
+    """Ranked matches for a websearch-style query.
+    Returns [{id, rank, name, slug, score, snippet}, ...], best first.
+    min_score drops weak matches (ts_rank_cd, normalized to 0..1)."""
+    ident(snippet)
+    sql = f"""
+    WITH q AS (
+        SELECT websearch_to_tsquery('{CONFIG}', :query) AS q
+    ),
+    hits AS (
+        SELECT c.id, c.rank, c.name, c.slug, c.{snippet} AS body,
+               ts_rank_cd(c.search_tsv, q.q, 32) AS score
+        FROM cmcnotes c, q
+        WHERE c.search_tsv @@ q.q
+        ORDER BY score DESC, c.rank ASC NULLS LAST
+        LIMIT :limit
+    )
+    SELECT h.id, h.rank, h.name, h.slug, h.score,
+           ts_headline('{CONFIG}', coalesce(h.body, ''), q.q, :headline) AS snippet
+    FROM hits h, q
+    WHERE h.score >= :min_score
+    ORDER BY h.score DESC, h.rank ASC NULLS LAST
+    """
+    conn = get_engine().connect()
+    rows = conn.execute(text(sql), {"query": query, "limit": limit,
+                                    "min_score": min_score,
+                                    "headline": HEADLINE}).mappings().fetchall()
+    conn.close()
+    return [dict(r) for r in rows]
+
+
+def count(query: str) -> int:
+    """How many rows match at all (uses the GIN index, no ranking)."""
+    sql = f"""
+    SELECT count(*)
+    FROM cmcnotes
+    WHERE search_tsv @@ websearch_to_tsquery('{CONFIG}', :query)
+    """
+    conn = get_engine().connect()
+    n = conn.execute(text(sql), {"query": query}).scalar_one()
+    conn.close()
+    return n
+
+
+def show(query: str, limit: int = 10, **kwargs) -> None:
+    for r in search(query, limit=limit, **kwargs):
+        print(f"{r['score']:.3f}  #{r['rank']}  {r['name']} ({r['slug']})")
+        print(f"       {r['snippet']}")
+
+
+#%% ========================================
+# usage:
+# from src.search import search, show
+# show('restaking or eigenlayer')
+# show('"zero knowledge" -bridge', min_score=0.05)
+# search('meme dog solana', limit=50, snippet="webprint_distill1s_fun")
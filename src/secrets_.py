@@ -12,6 +12,9 @@ CMC_API_KEY            = os.environ.get('CMC_API_KEY',         '')
 # OpenAI API
 OPENAI_API_KEY         = os.environ.get('OPENAI_API_KEY',      '')
 
+# X/Twitter (raw cURL copied from the browser, see src/api_x.py)
+XAPI_CURL              = os.environ.get('XAPI_CURL',           '')
+
 # Postgres DB (Digital Ocean)
 POSTGRES_USERNAME      = os.environ.get('POSTGRES_USERNAME',   '')
 POSTGRES_PASSWORD      = os.environ.get('POSTGRES_PASSWORD',   '')
@@ -0,0 +1,197 @@
+#%% ========================================
+import json
+import time
+import uuid
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+# A tiny local stand-in for the bits of the OpenAI api we drive in bulk
+# (files + batches, background responses), so the batch and job plumbing
+# can be exercised end to end without spending anything. Point a client
+# at it with base_url="http://127.0.0.1:<port>/v1".
+# Every request "answers" with the first line of its input, and a batch
+# or background response completes `delay` seconds after it's created.
+# Batch requests whose input contains FAIL come back as 400s in the
+# batch's error file, to exercise the failure paths.
+# Everything lives in memory, it's for poking at, not for keeping.
+
+FAIL = "standin:fail"
+
+
+def fake_response(body: dict) -> dict:
+    """A completed Response (json form) for a /v1/responses request body"""
+    text = str(body.get("input", "")).strip().splitlines()[:1]
+    ntokens_in = len(str(body.get("input", ""))) // 4
+    return {
+        "id": f"resp_{uuid.uuid4().hex}",
+        "object": "response",
+        "created_at": int(time.time()),
+        "model": body.get("model", "gpt-5"),
+        "status": "completed",
+        "output": [{"type": "message", "id": f"msg_{uuid.uuid4().hex}",
+                    "status": "completed", "role": "assistant",
+                    "content": [{"type": "output_text", "annotations": [],
+                                 "text": f"standin: {text[0] if text else ''}"}]}],
+        "parallel_tool_calls": True,
+        "tool_choice": "auto",
+        "tools": body.get("tools", []),
+        "usage": {"input_tokens": ntokens_in,
+                  "input_tokens_details": {"cached_tokens": 0},
+                  "output_tokens": 16,
+                  "output_tokens_details": {"reasoning_tokens": 0},
+                  "total_tokens": ntokens_in + 16},
+    }
+
+
+class Standin:
+
+    def __init__(self, delay: float = 1.0):
+        self.delay = delay
+        self.files: dict[str, dict] = {}
+        self.batches: dict[str, dict] = {}
+        self.responses: dict[str, dict] = {}
+        self.lock = threading.Lock()
+
+    def add_file(self, content: bytes, purpose: str, filename: str = "upload.jsonl") -> dict:
+        meta = {"id": f"file-{uuid.uuid4().hex}", "object": "file", "bytes": len(content),
+                "created_at": int(time.time()), "filename": filename,
+                "purpose": purpose, "status": "processed"}
+        with self.lock:
+            self.files[meta["id"]] = {"meta": meta, "content": content}
+        return meta
+
+    def create_batch(self, req: dict) -> dict:
+        batch = {"id": f"batch_{uuid.uuid4().hex}", "object": "batch",
+                 "endpoint": req["endpoint"], "input_file_id": req["input_file_id"],
+                 "completion_window": req["completion_window"], "status": "in_progress",
+                 "created_at": int(time.time()), "in_progress_at": int(time.time()),
+                 "metadata": req.get("metadata"), "output_file_id": None,
+                 "error_file_id": None, "completed_at": None,
+                 "request_counts": {"total": 0, "completed": 0, "failed": 0}}
+        with self.lock:
+            self.batches[batch["id"]] = batch
+        return batch
+
+    def get_batch(self, batch_id: str) -> dict:
+        batch = self.batches[batch_id]
+        if batch["status"] == "in_progress" and time.time() - batch["created_at"] >= self.delay:
+            self._run_batch(batch)
+        return batch
+
+    def _run_batch(self, batch: dict) -> None:
+        lines = self.files[batch["input_file_id"]]["content"].decode().splitlines()
+        out, errors = [], []
+        for line in filter(str.strip, lines):
+            req = json.loads(line)
+            if FAIL in str(req["body"].get("input", "")):
+                response = {"status_code": 400, "request_id": uuid.uuid4().hex,
+                            "body": {"error": {"message": "standin: rejected",
+                                               "type": "invalid_request_error"}}}
+                dest = errors
+            else:
+                response = {"status_code": 200, "request_id": uuid.uuid4().hex,
+                            "body": fake_response(req["body"])}
+                dest = out
+            dest.append(json.dumps({"id": f"batch_req_{uuid.uuid4().hex}",
+                                    "custom_id": req["custom_id"],
+                                    "response": response, "error": None}))
+        update = {"status": "completed", "completed_at": int(time.time()),
+                  "request_counts": {"total": len(out) + len(errors),
+                                     "completed": len(out), "failed": len(errors)}}
+        if out:
+            update["output_file_id"] = self.add_file(("\n".join(out) + "\n").encode(),
+                                                     "batch_output", "output.jsonl")["id"]
+        if errors:
+            update["error_file_id"] = self.add_file(("\n".join(errors) + "\n").encode(),
+                                                    "batch_output", "errors.jsonl")["id"]
+        batch.update(update)
+
+    def create_response(self, body: dict) -> dict:
+        resp = fake_response(body)
+        if body.get("background"):
+            resp["status"] = "queued"
+        with self.lock:
+            self.responses[resp["id"]] = resp
+        return resp
+
+    def get_response(self, response_id: str) -> dict:
+        resp = self.responses[response_id]
+        if resp["status"] == "queued" and time.time() - resp["created_at"] >= self.delay:
+            resp["status"] = "completed"
+        return resp
+
+
+def _multipart(body: bytes, content_type: str) -> dict[str, bytes]:
+    """{name: value} of a multipart/form-data body"""
+    boundary = content_type.split("boundary=")[1].strip('"').encode()
+    parts = {}
+    for part in body.split(b"--" + boundary)[1:-1]:
+        head, _, value = part.partition(b"\r\n\r\n")
+        name = head.split(b'name="')[1].split(b'"')[0].decode()
+        parts[name] = value[:-2] if value.endswith(b"\r\n") else value
+    return parts
+
+
+def _handler(state: Standin):
+
+    class Handler(BaseHTTPRequestHandler):
+
+        def log_message(self, *args):
+            pass
+
+        def _send(self, obj, status: int = 200, raw: bytes | None = None) -> None:
+            data = raw if raw is not None else json.dumps(obj).encode()
+            self.send_response(status)
+            self.send_header("content-type", "application/octet-stream" if raw is not None
+                             else "application/json")
+            self.send_header("content-length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def _body(self) -> bytes:
+            return self.rfile.read(int(self.headers.get("content-length", 0)))
+
+        def do_POST(self):
+            path = self.path.split("?")[0]
+            if path == "/v1/files":
+                parts = _multipart(self._body(), self.headers["content-type"])
+                return self._send(state.add_file(parts["file"], parts["purpose"].decode()))
+            if path == "/v1/batches":
+                return self._send(state.create_batch(json.loads(self._body())))
+            if path == "/v1/responses":
+                return self._send(state.create_response(json.loads(self._body())))
+            self._send({"error": {"message": f"no route {path}"}}, 404)
+
+        def do_GET(self):
+            path = self.path.split("?")[0].rstrip("/").split("/")
+            try:
+                if path[2] == "batches":
+                    return self._send(state.get_batch(path[3]))
+                if path[2] == "responses":
+                    return self._send(state.get_response(path[3]))
+                if path[2] == "files" and path[-1] == "content":
+                    return self._send(None, raw=state.files[path[3]]["content"])
+                if path[2] == "files":
+                    return self._send(state.files[path[3]]["meta"])
+            except (KeyError, IndexError):
+                return self._send({"error": {"message": "not found"}}, 404)
+            self._send({"error": {"message": f"no route {self.path}"}}, 404)
+
+    return Handler
+
+
+def serve(port: int = 8765, delay: float = 1.0) -> ThreadingHTTPServer:
+    """Starts the stand-in on a daemon thread (port=0: any free port,
+    see server.url). server.shutdown() to stop."""
+    state = Standin(delay=delay)
+    server = ThreadingHTTPServer(("127.0.0.1", port), _handler(state))
+    server.state = state
+    server.url = f"http://127.0.0.1:{server.server_address[1]}/v1"
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    print(f"standin: listening on {server.url}")
+    return server
+
+
+if __name__ == "__main__":
+    serve()
+    threading.Event().wait()
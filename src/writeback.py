@@ -0,0 +1,123 @@
+#%% ========================================
+import time
+import threading
+
+from src.db import get_engine, text, ident
+
+# Batched write-back for (key, value) results.
+# Hydration workers used to open a connection, UPDATE one row and
+# commit, once per row. At high concurrency that's a storm of tiny
+# transactions. WriteBack collects results from any number of threads
+# and flushes them as a single set-based statement:
+#   UPDATE <table> SET <column> = v.value
+#   FROM unnest(:keys, :values) AS v(key, value)
+#   WHERE <table>.<key> = v.key
+# A flush happens every `every` results or `seconds` seconds (whichever
+# first), so db load stays flat no matter how many workers feed it.
+# Results for the same key are deduped in the buffer (last one wins).
+# A failed flush puts its batch back in the buffer (counted in .errors),
+# so the next flush/tick/close retries it. close() retries with backoff.
+
+class WriteBack:
+
+    def __init__(self, table: str, column: str, key: str = "id",
+                 value_type: str = "TEXT", key_type: str = "INT8",
+                 every: int = 100, seconds: float = 5.0):
+        self.table = ident(table)
+        self.column = ident(column)
+        self.key = ident(key)
+        self.every = every
+        self.seconds = seconds
+        self.sql = text(f"""
+        UPDATE {self.table} AS t
+        SET {self.column} = v.value
+        FROM unnest(CAST(:keys AS {key_type}[]), CAST(:values AS {value_type}[])) AS v(key, value)
+        WHERE t.{self.key} = v.key
+        """)
+        self.buffer: dict = {}
+        self.written = 0
+        self.flushes = 0
+        self.errors = 0
+        self.lock = threading.Lock()
+        self.flush_lock = threading.Lock()
+        self.t_flush = time.monotonic()
+        self._stop = threading.Event()
+        self._timer = threading.Thread(target=self._tick, daemon=True)
+        self._timer.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def add(self, key, value, flush: bool = True) -> bool:
+        """Queues one result. Thread safe. Returns True if the buffer is full,
+        in which case it's flushed inline unless flush=False (async callers
+        flush off the event loop themselves)."""
+        with self.lock:
+            self.buffer[key] = value
+            full = len(self.buffer) >= self.every
+        if full and flush:
+            self.flush()
+        return full
+
+    def _tick(self) -> None:
+        while not self._stop.wait(min(1.0, self.seconds)):
+            if self.buffer and time.monotonic() - self.t_flush >= self.seconds:
+                try:
+                    self.flush()
+                except Exception as e:
+                    print(f"\nWriteBack: background flush failed, will retry: {e!r}")
+
+    def flush(self) -> int:
+        """Writes everything buffered so far in one statement."""
+        with self.flush_lock:
+            with self.lock:
+                batch, self.buffer = self.buffer, {}
+                self.t_flush = time.monotonic()
+            if not batch:
+                return 0
+            try:
+                conn = get_engine().connect()
+                try:
+                    conn.execute(self.sql, {"keys": list(batch.keys()),
+                                            "values": list(batch.values())})
+                    conn.commit()
+                finally:
+                    conn.close()
+            except Exception:
+                # put it back (without clobbering anything newer)
+                with self.lock:
+                    self.buffer = {**batch, **self.buffer}
+                    self.errors += 1
+                raise
+            self.written += len(batch)
+            self.flushes += 1
+            return len(batch)
+
+    def try_flush(self) -> bool:
+        """flush() that doesn't raise: on failure the batch stays buffered
+        for the next attempt. For callers whose own work already succeeded."""
+        try:
+            self.flush()
+            return True
+        except Exception as e:
+            print(f"\nWriteBack: flush failed, will retry: {e!r}")
+            return False
+
+    def close(self, retries: int = 3, backoff: float = 1.0) -> int:
+        """Stops the timer and flushes the rest (retrying with backoff).
+        Returns rows written in total."""
+        self._stop.set()
+        for attempt in range(retries + 1):
+            try:
+                self.flush()
+                break
+            except Exception as e:
+                if attempt == retries:
+                    raise e
+                wait = backoff * 2 ** attempt
+                print(f"\nWriteBack: final flush failed ({e!r}), retry in {wait:.1f}s")
+                time.sleep(wait)
+        return self.written
@@ -0,0 +1,77 @@
+import pytest
+
+from src import api_chatbot, standin
+from src.batch import BatchRunner
+from src.hydrator import Hydrator
+from src.ledger import Ledger
+
+
+class Table:
+    """in-memory stand-in for the hydrated table (pending rows + WriteBack)"""
+
+    def __init__(self, rows):
+        self.rows = {r["id"]: dict(r, out=None) for r in rows}
+
+    def pending(self, limit=None):
+        return [r for r in self.rows.values() if r["out"] is None][:limit]
+
+    def writeback(self):
+        table = self
+
+        class WriteBack:
+            written = 0
+
+            def add(self, key, value, flush=True):
+                table.rows[key]["out"] = value
+                self.written += 1
+
+            def close(self):
+                return self.written
+
+        return WriteBack()
+
+
+@pytest.fixture
+def server(monkeypatch):
+    # the stand-in doesn't check the key, but the sdk wants one
+    monkeypatch.setattr(api_chatbot, "OPENAI_API_KEY", "x")
+    server = standin.serve(port=0, delay=0.0)
+    yield server
+    server.shutdown()
+
+
+def runner(server, tmp_path, rows, **kwargs):
+    table = Table(rows)
+    h = Hydrator(column="out", prompt=lambda row: row["text"], model=str)
+    h.pending, h.writeback = table.pending, table.writeback
+    # a ledger of its own, so tests don't append to local/ledger/usage.jsonl
+    kwargs.setdefault("ledger", Ledger(path=str(tmp_path / "usage.jsonl")))
+    return table, BatchRunner(h, base_url=server.url, root=str(tmp_path), **kwargs)
+
+
+def test_batch_roundtrip_with_errors(server, tmp_path):
+    rows = [{"id": i, "text": f"row {i}"} for i in range(10)]
+    rows[3]["text"] = f"row 3 {standin.FAIL}"
+    table, r = runner(server, tmp_path, rows)
+    stats = r.run(every=0.01)
+    assert stats["written"] == 9
+    r.ledger.flush()
+    assert len(r.ledger.records()) == 9
+    assert table.rows[0]["out"] == "standin: row 0"
+    assert table.rows[3]["out"] is None
+    [job] = r.jobs()
+    assert job["failed"] == 1 and set(job["errors"]) == {"3"}
+    # the failed row is pending again, and no longer counted as in flight
+    assert r.outstanding() == set()
+    assert [row["id"] for row in table.pending()] == [3]
+
+
+def test_submit_splits_by_bytes(server, tmp_path):
+    rows = [{"id": i, "text": "x" * 1000} for i in range(10)]
+    # ~1.1kB per request line: 3 fit under 4kB
+    table, r = runner(server, tmp_path, rows, max_bytes=4000)
+    ids = r.submit()
+    assert len(ids) == 4
+    assert [len(j["keys"]) for j in r.jobs()] == [3, 3, 3, 1]
+    r.run(every=0.01)
+    assert table.pending() == []
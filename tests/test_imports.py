@@ -0,0 +1,14 @@
+import pytest
+
+from src.bootstrap import MODULES, IMPORT_BUDGET_MS, import_times, heavy_imports
+
+
+def test_import_budget():
+    times = import_times()
+    slow = {mod: round(ms) for mod, ms in times.items() if ms > IMPORT_BUDGET_MS}
+    assert not slow, f"over the {IMPORT_BUDGET_MS}ms import budget: {slow}"
+
+
+@pytest.mark.parametrize("mod", MODULES)
+def test_no_heavy_imports(mod):
+    assert heavy_imports(mod) == []
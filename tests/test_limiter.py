@@ -0,0 +1,27 @@
+import asyncio
+
+from src.limiter import AIMD
+
+
+def test_cancelled_waiter_does_not_eat_a_wake():
+    async def main():
+        gate = AIMD(initial=1, minimum=1, maximum=1)
+        await gate.aacquire()
+        done = []
+
+        async def worker(i):
+            await gate.aacquire()
+            done.append(i)
+            gate.release()
+
+        tasks = [asyncio.create_task(worker(i)) for i in range(3)]
+        await asyncio.sleep(0.01)
+        tasks[0].cancel()
+        await asyncio.sleep(0.01)
+        gate.release()
+        await asyncio.wait_for(asyncio.gather(*tasks[1:]), timeout=2)
+        assert done == [1, 2]
+        assert gate.inflight == 0
+        assert not gate.waiters
+
+    asyncio.run(main())
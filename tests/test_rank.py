@@ -0,0 +1,21 @@
+import numpy as np
+
+from src.graph import CSRGraph
+from src.rank import _scores_tsv, pagerank
+
+
+def test_scores_tsv_keeps_snowflake_ids():
+    # real x ids are well past 2**53, where float64 can't represent them
+    ids = np.array([1312083283, 1815661646446788134, 2**63 - 1, 2**53 + 1], dtype=np.int64)
+    scores = np.array([0.25, 1e-12, 0.5, 1 / 3])
+    rows = [line.split("\t") for line in _scores_tsv(ids, scores).read().splitlines()]
+    assert [int(i) for i, _ in rows] == ids.tolist()
+    assert [float(s) for _, s in rows] == scores.tolist()
+
+
+def test_pagerank_empty_graph():
+    empty = np.zeros(0, dtype=np.int64)
+    offsets = np.zeros(1, dtype=np.int64)
+    g = CSRGraph(empty, offsets, empty.astype(np.int32), offsets, empty.astype(np.int32))
+    assert g.indices([1, 2]).tolist() == [-1, -1]
+    assert pagerank(g).shape == (0,)